@@ -47,10 +47,13 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'bufet_system.middleware.PerformanceMiddleware',
+    'bufet_system.middleware.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'bufet_system.middleware.GuestCartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -69,6 +72,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'bufet_system.context_processors.cfg_assets_root',
+                'bufet_system.context_processors.cart_summary',
             ],
         },
     },
@@ -88,8 +92,57 @@ DATABASES = {
     }
 }
 
-db_from_env = dj_database_url.config(conn_max_age=500)
+# Persistent connections must be off (DJANGO_CONN_MAX_AGE=0) under ASGI,
+# where each request runs its sync code in a new thread.
+db_from_env = dj_database_url.config(
+    conn_max_age=int(os.environ.get('DJANGO_CONN_MAX_AGE', 500)))
 DATABASES['default'].update(db_from_env)
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# PostgreSQL connections are pooled per worker process (DJANGO_DB_POOL=0
+# turns this off). Each gunicorn worker gets an equal share of
+# DB_MAX_CONNECTIONS, but never more than one connection per thread.
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 2))
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 4))
+DB_MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS', 20))
+if (DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql'
+        and os.environ.get('DJANGO_DB_POOL', '1') == '1'):
+    DATABASES['default'].update({
+        'ENGINE': 'bufet_system.backends.postgresql',
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'max_size': max(1, min(GUNICORN_THREADS,
+                                   DB_MAX_CONNECTIONS // WEB_CONCURRENCY)),
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        },
+    })
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Local memory while developing, a shared file-based cache on the single
+# production node so all gunicorn workers see the same entries.
+
+if DEBUG:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'bufet',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('DJANGO_CACHE_DIR',
+                                       '/var/tmp/bufet_cache'),
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Seconds cached menu and restaurant pages live before being rebuilt.
+# Staff edits invalidate them immediately through versioned keys.
+BUFET_CACHE_TIMEOUT = int(os.environ.get('BUFET_CACHE_TIMEOUT', 600))
 
 
 # Password validation
@@ -140,4 +193,95 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'bufet_system.User'
 
+# The signed-in user is loaded from the cache rather than the user table
+# on each request; saving or deleting a user drops its cached copy.
+# ModelBackend stays listed so sessions created before the cached backend
+# keep working; they move to it on their next login.
+AUTHENTICATION_BACKENDS = [
+    'bufet_system.backends.auth.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+BUFET_USER_CACHE_TIMEOUT = int(os.environ.get('BUFET_USER_CACHE_TIMEOUT',
+                                              300))
+
+# Sessions are read from the cache and written through to the database,
+# and only saved when a request changed them.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_SAVE_EVERY_REQUEST = False
+
 LOGIN_REDIRECT_URL = '/'
+
+# Per-view SQL query budgets, keyed by "app_name:url_name". Overruns are
+# logged while developing; tests switch the mode to "raise".
+# SQLite counts BEGIN/COMMIT/SAVEPOINT as queries, so the write views keep
+# some headroom for them.
+BUFET_QUERY_BUDGET_MODE = os.environ.get('BUFET_QUERY_BUDGET_MODE',
+                                         'log' if DEBUG else '')
+BUFET_QUERY_BUDGET_DEFAULT = 20
+BUFET_QUERY_BUDGETS = {
+    'bufet_system:index': 4,
+    'bufet_system:menu': 6,
+    'bufet_system:dish-detail': 5,
+    'bufet_system:restaurant-list': 5,
+    'bufet_system:product-cart': 8,
+    'bufet_system:order-checkout': 13,
+    'bufet_system:order-list': 5,
+    'bufet_system:add-to-cart': 12,
+    'bufet_system:delete-from-cart': 12,
+    'bufet_system:batch-checkout': 12,
+    'bufet_system:cart-api': 12,
+    'bufet_system:analytics-report': 8,
+    'bufet_system:demand-report': 8,
+    'bufet_system:order-export': 4,
+    'bufet_system:async-index': 4,
+    'bufet_system:async-menu': 6,
+    'bufet_system:async-product-cart': 8,
+    'bufet_system:async-order-checkout': 8,
+}
+
+# Share of requests (0..1) measured by PerformanceMiddleware, and how many
+# recent samples per view the rolling windows keep.
+BUFET_PERF_SAMPLE_RATE = float(os.environ.get('BUFET_PERF_SAMPLE_RATE',
+                                              1.0 if DEBUG else 0.1))
+BUFET_PERF_WINDOW = int(os.environ.get('BUFET_PERF_WINDOW', 1000))
+# Send the Server-Timing header of measured responses to every visitor
+# rather than to staff only (it always goes out with DEBUG).
+BUFET_SERVER_TIMING_PUBLIC = os.environ.get(
+    'BUFET_SERVER_TIMING_PUBLIC', '0') == '1'
+
+# Let the async views run independent queries concurrently, each in its own
+# thread and database connection.
+BUFET_ASYNC_PARALLEL_QUERIES = os.environ.get(
+    'BUFET_ASYNC_PARALLEL_QUERIES', '1') == '1'
+
+# Largest number of dishes changed by one cart API request.
+BUFET_CART_API_MAX_LINES = int(os.environ.get('BUFET_CART_API_MAX_LINES',
+                                              100))
+
+# Largest quantity of one dish a cart form or API request may set.
+BUFET_CART_MAX_QUANTITY = int(os.environ.get('BUFET_CART_MAX_QUANTITY', 99))
+
+# Anonymous visitors' carts live in this signed cookie until they log in.
+BUFET_GUEST_CART_COOKIE = 'bufet_cart'
+BUFET_GUEST_CART_MAX_AGE = int(os.environ.get('BUFET_GUEST_CART_MAX_AGE',
+                                              14 * 24 * 3600))
+# Keeps the cookie well under the 4 KB browsers accept.
+BUFET_GUEST_CART_MAX_LINES = int(os.environ.get('BUFET_GUEST_CART_MAX_LINES',
+                                                50))
+
+# Order lines fetched and folded into the demand report per chunk; bounds
+# the report's memory use.
+BUFET_REPORT_CHUNK_SIZE = int(os.environ.get('BUFET_REPORT_CHUNK_SIZE',
+                                             20000))
+
+# Orders per chunk of the streaming order export; each chunk costs one
+# query for its lines.
+BUFET_EXPORT_CHUNK_SIZE = int(os.environ.get('BUFET_EXPORT_CHUNK_SIZE',
+                                             2000))
+
+# Largest number of orders accepted by one batch checkout request.
+BUFET_BATCH_CHECKOUT_MAX = int(os.environ.get('BUFET_BATCH_CHECKOUT_MAX',
+                                              500))
+
+# Upper bound, in seconds, on how stale the landing page counters may be.
+BUFET_STATS_MAX_AGE = int(os.environ.get('BUFET_STATS_MAX_AGE', 300))
@@ -1,7 +1,16 @@
+from django import forms
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
-from bufet_system.models import User, Dish, Restaurant, Order, ProductCart
+from bufet_system import ingredients, search
+from bufet_system.models import (User,
+                                 Dish,
+                                 Ingredient,
+                                 Restaurant,
+                                 Order,
+                                 ProductCart,
+                                 ProductCartItem)
+from bufet_system.pagination import EstimatedCountPaginator
 
 
 @admin.register(User)
@@ -29,10 +38,53 @@ class UserAdmin(UserAdmin):
 
 @admin.register(Dish)
 class DishAdmin(admin.ModelAdmin):
-    list_display = ("name", "ingredients", "price", "weight")
+    list_display = ("name", "ingredients", "display_allergens", "price",
+                    "weight")
     search_fields = ["name", ]
     list_filter = ["name", "price", "weight", ]
 
+    def get_search_results(self, request, queryset, search_term):
+        # Use the search indexes instead of icontains scans; the change
+        # list applies its own ordering afterwards.
+        if not search_term.strip():
+            return queryset, False
+        return search.search_dishes(search_term, queryset), False
+
+    @admin.display(description="Allergens")
+    def display_allergens(self, obj):
+        return ", ".join(ingredients.allergen_names(obj.allergens))
+
+
+class IngredientForm(forms.ModelForm):
+    allergens = forms.MultipleChoiceField(
+        choices=[(name, name) for name in Ingredient.ALLERGENS],
+        widget=forms.CheckboxSelectMultiple,
+        required=False,
+    )
+
+    class Meta:
+        model = Ingredient
+        fields = ["name", "allergens"]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.initial["allergens"] = ingredients.allergen_names(
+            self.instance.allergens)
+
+    def clean_allergens(self):
+        return ingredients.allergen_mask(self.cleaned_data["allergens"])
+
+
+@admin.register(Ingredient)
+class IngredientAdmin(admin.ModelAdmin):
+    form = IngredientForm
+    list_display = ("name", "display_allergens")
+    search_fields = ["name"]
+
+    @admin.display(description="Allergens")
+    def display_allergens(self, obj):
+        return ", ".join(ingredients.allergen_names(obj.allergens))
+
 
 @admin.register(Restaurant)
 class RestaurantAdmin(admin.ModelAdmin):
@@ -41,15 +93,34 @@ class RestaurantAdmin(admin.ModelAdmin):
     list_filter = ["address", ]
 
 
+class ProductCartItemInline(admin.TabularInline):
+    # Read-only: editing lines here would bypass the cart summaries.
+    model = ProductCartItem
+    fields = ("item_id", "dish_name", "unit_price", "quantity")
+    readonly_fields = fields
+    can_delete = False
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(ProductCart)
 class ProductCartAdmin(admin.ModelAdmin):
     @admin.display(description="Items")
     def display_items(self, obj):
-        return ", ".join([item.name for item in obj.items.all()])
+        return ", ".join([line.dish_name
+                          for line in obj.productcartitem_set.all()])
 
     list_display = ("user", "created_at", "status", "display_items")
+    inlines = [ProductCartItemInline]
     search_fields = ["user__username"]
     list_filter = ["status"]
+    list_select_related = ("user",)
+
+    def get_queryset(self, request):
+        return (super().get_queryset(request)
+                .prefetch_related("productcartitem_set"))
 
 
 @admin.register(Order)
@@ -65,4 +136,7 @@ class OrderAdmin(admin.ModelAdmin):
                      "restaurant__id",
                      "product_cart__id"]
     list_filter = ["user", "restaurant"]
+    list_select_related = ("user", "restaurant", "product_cart")
     readonly_fields = ("id", "created_at", "total_price")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -0,0 +1,286 @@
+"""Daily rollups of orders, units and revenue per restaurant and per dish.
+
+New orders are added to the rollups once their transaction commits
+(``record_orders``). For a batch of orders this takes one read of their
+lines plus one ``INSERT ... ON CONFLICT DO UPDATE`` per table, whatever
+the number of days, restaurants or dishes involved. ``rebuild``
+recomputes whole days from the orders tables; it backfills history and
+repairs rows after orders are edited or deleted. Reports read only the
+rollups, so their cost does not grow with the number of orders.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Case, Count, F, Max, Min, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from bufet_system.models import (DailyDishStats,
+                                 DailyRestaurantStats,
+                                 Order,
+                                 ProductCartItem)
+
+ZERO = Decimal("0.00")
+# Rows per upsert statement, well under SQLite's bound parameter limit.
+UPSERT_BATCH = 150
+
+
+def _key_filter(field, key):
+    if key is None:
+        return Q(**{f"{field}__isnull": True})
+    return Q(**{field: key})
+
+
+def _bump(model, field, day, deltas):
+    """Add ``deltas`` (``{key: [orders, units, revenue]}``) to one day.
+
+    The portable path, for databases without ``ON CONFLICT``.
+
+    Existing rows get one UPDATE with CASE expressions; missing rows are
+    bulk inserted, falling back to the UPDATE if another transaction
+    inserted them first.
+    """
+    def case(position, output_field):
+        return Case(*[When(_key_filter(field, key),
+                           then=Value(delta[position]))
+                      for key, delta in deltas.items()],
+                    default=Value(0),
+                    output_field=output_field)
+
+    rows = model.objects.filter(day=day)
+    match = Q()
+    for key in deltas:
+        match |= _key_filter(field, key)
+    updated = rows.filter(match).update(
+        orders_count=F("orders_count") + case(0, models.IntegerField()),
+        units=F("units") + case(1, models.IntegerField()),
+        revenue=F("revenue") + case(2, model._meta.get_field("revenue")),
+    )
+    if updated == len(deltas):
+        return
+
+    missing = deltas
+    if updated:
+        present = set(rows.filter(match).values_list(field, flat=True))
+        missing = {key: delta for key, delta in deltas.items()
+                   if key not in present}
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create([
+                model(day=day, orders_count=orders, units=units,
+                      revenue=revenue, **{field: key})
+                for key, (orders, units, revenue) in missing.items()
+            ])
+    except IntegrityError:
+        _bump(model, field, day, missing)
+
+
+def _upsert(model, field, deltas):
+    """Add ``deltas`` (``{(day, key): [orders, units, revenue]}``).
+
+    Inserts the rows and, where one already exists, adds to it instead,
+    in one statement. Rows with a NULL key conflict on the partial
+    unique index instead of the (day, key) one, so they get their own
+    statement.
+    """
+    ops = connection.ops
+    quote = ops.quote_name
+    table = quote(model._meta.db_table)
+    day, key = quote("day"), quote(model._meta.get_field(field).column)
+    columns = [day, key, quote("orders_count"), quote("units"),
+               quote("revenue")]
+    revenue = model._meta.get_field("revenue")
+    totals = ", ".join(f"{column} = {table}.{column} + excluded.{column}"
+                       for column in columns[2:])
+    targets = {True: f"({day}) WHERE {key} IS NULL",
+               False: f"({day}, {key})"}
+    groups = {True: [], False: []}
+    for (date, subject), (orders, units, amount) in deltas.items():
+        groups[subject is None].append([
+            ops.adapt_datefield_value(date), subject, orders, units,
+            ops.adapt_decimalfield_value(amount, revenue.max_digits,
+                                         revenue.decimal_places),
+        ])
+    with connection.cursor() as cursor:
+        for null_key, rows in groups.items():
+            for start in range(0, len(rows), UPSERT_BATCH):
+                batch = rows[start:start + UPSERT_BATCH]
+                values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(batch))
+                cursor.execute(
+                    f"INSERT INTO {table} ({', '.join(columns)}) "
+                    f"VALUES {values} "
+                    f"ON CONFLICT {targets[null_key]} DO UPDATE SET {totals}",
+                    [value for row in batch for value in row])
+
+
+def _local_day(moment):
+    return timezone.localdate(moment) if timezone.is_aware(moment) \
+        else moment.date()
+
+
+def apply_orders(orders):
+    """Add ``orders`` to the rollups right away."""
+    orders = [order for order in orders if order.pk is not None]
+    if not orders:
+        return
+    restaurants = defaultdict(lambda: defaultdict(lambda: [0, 0, ZERO]))
+    dishes = defaultdict(lambda: defaultdict(lambda: [0, 0, ZERO]))
+    days = {}
+    for order in orders:
+        day = _local_day(order.created_at)
+        days[order.product_cart_id] = (day, order.restaurant_id)
+        delta = restaurants[day][order.restaurant_id]
+        delta[0] += 1
+        delta[2] += order.total_price or ZERO
+
+    carts = [cart for cart in days if cart is not None]
+    lines = (ProductCartItem.objects
+             .filter(cart_id__in=carts)
+             .values_list("cart_id", "item_id", "quantity", "unit_price"))
+    for cart, dish, quantity, price in lines:
+        day, restaurant = days[cart]
+        delta = dishes[day][dish]
+        delta[0] += 1
+        delta[1] += quantity
+        delta[2] += price * quantity
+        restaurants[day][restaurant][1] += quantity
+
+    if connection.vendor not in ("postgresql", "sqlite"):
+        with transaction.atomic():
+            for day, deltas in restaurants.items():
+                _bump(DailyRestaurantStats, "restaurant_id", day, deltas)
+            for day, deltas in dishes.items():
+                _bump(DailyDishStats, "dish_id", day, deltas)
+        return
+    with transaction.atomic():
+        _upsert(DailyRestaurantStats, "restaurant_id",
+                {(day, key): delta for day, deltas in restaurants.items()
+                 for key, delta in deltas.items()})
+        _upsert(DailyDishStats, "dish_id",
+                {(day, key): delta for day, deltas in dishes.items()
+                 for key, delta in deltas.items()})
+
+
+def record_orders(orders):
+    """Add newly placed ``orders`` once the current transaction commits.
+
+    Deferring keeps the busy per-day rows out of the order transaction,
+    the same way the site counters are updated.
+    """
+    orders = list(orders)
+    transaction.on_commit(lambda: apply_orders(orders))
+
+
+def day_bounds(first, last):
+    """Aware datetimes covering local days ``first`` to ``last``."""
+    zone = timezone.get_current_timezone()
+    return (datetime.combine(first, time.min, tzinfo=zone),
+            datetime.combine(last + timedelta(days=1), time.min,
+                             tzinfo=zone))
+
+
+def rebuild(first, last):
+    """Recompute the rollups of days ``first`` to ``last`` from orders.
+
+    Runs in one transaction: the days' rows are deleted and re-inserted
+    from two GROUP BY queries.
+    """
+    start, end = day_bounds(first, last)
+    orders = Order.objects.filter(created_at__gte=start, created_at__lt=end)
+    lines = ProductCartItem.objects.filter(cart__order__created_at__gte=start,
+                                           cart__order__created_at__lt=end)
+    restaurant_rows = (
+        orders.annotate(day=TruncDate("created_at"))
+        .values("day", "restaurant_id")
+        .annotate(orders_count=Count("pk"),
+                  units=Coalesce(Sum("product_cart__items_count"), 0),
+                  revenue=Sum("total_price"))
+        .order_by()
+    )
+    dish_rows = (
+        lines.annotate(day=TruncDate("cart__order__created_at"))
+        .values("day", "item_id")
+        .annotate(orders_count=Count("pk"),
+                  units=Sum("quantity"),
+                  revenue=Sum(F("quantity") * F("unit_price"),
+                              output_field=DailyDishStats._meta
+                              .get_field("revenue")))
+        .order_by()
+    )
+    with transaction.atomic():
+        DailyRestaurantStats.objects.filter(day__range=(first, last)).delete()
+        DailyDishStats.objects.filter(day__range=(first, last)).delete()
+        DailyRestaurantStats.objects.bulk_create(
+            DailyRestaurantStats(day=row["day"],
+                                 restaurant_id=row["restaurant_id"],
+                                 orders_count=row["orders_count"],
+                                 units=row["units"],
+                                 revenue=row["revenue"] or ZERO)
+            for row in restaurant_rows.iterator()
+        )
+        DailyDishStats.objects.bulk_create(
+            DailyDishStats(day=row["day"],
+                           dish_id=row["item_id"],
+                           orders_count=row["orders_count"],
+                           units=row["units"],
+                           revenue=row["revenue"])
+            for row in dish_rows.iterator()
+        )
+
+
+def order_days():
+    """``(first, last)`` local days with orders, or ``None`` if none."""
+    bounds = Order.objects.aggregate(first=Min("created_at"),
+                                     last=Max("created_at"))
+    if bounds["first"] is None:
+        return None
+    return _local_day(bounds["first"]), _local_day(bounds["last"])
+
+
+def backfill(first, last, chunk_days=7, progress=None):
+    """``rebuild`` days ``first`` to ``last``, ``chunk_days`` at a time."""
+    day = first
+    while day <= last:
+        chunk_end = min(day + timedelta(days=chunk_days - 1), last)
+        rebuild(day, chunk_end)
+        if progress is not None:
+            progress(day, chunk_end)
+        day = chunk_end + timedelta(days=1)
+
+
+def report(first, last, top=10):
+    """Totals for days ``first`` to ``last`` from the rollups only."""
+    restaurant_rows = DailyRestaurantStats.objects.filter(
+        day__range=(first, last))
+    dish_rows = DailyDishStats.objects.filter(day__range=(first, last))
+    totals = restaurant_rows.aggregate(
+        orders=Coalesce(Sum("orders_count"), 0),
+        units=Coalesce(Sum("units"), 0),
+        revenue=Coalesce(Sum("revenue"), ZERO),
+    )
+    return {
+        "first": first,
+        "last": last,
+        "totals": totals,
+        "days": list(
+            restaurant_rows.values("day")
+            .annotate(orders=Sum("orders_count"), revenue=Sum("revenue"))
+            .order_by("day")
+        ),
+        "restaurants": list(
+            restaurant_rows.values("restaurant_id", "restaurant__address")
+            .annotate(orders=Sum("orders_count"),
+                      units=Sum("units"),
+                      revenue=Sum("revenue"))
+            .order_by("-revenue", "restaurant_id")
+        ),
+        "dishes": list(
+            dish_rows.values("dish_id", "dish__name")
+            .annotate(orders=Sum("orders_count"),
+                      units=Sum("units"),
+                      revenue=Sum("revenue"))
+            .order_by("-units", "dish_id")[:top]
+        ),
+    }
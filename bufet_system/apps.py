@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BufetSystemConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bufet_system'
+
+    def ready(self):
+        from bufet_system import signals  # noqa: F401
@@ -0,0 +1,203 @@
+"""Async variants of the read-heavy pages, served under ``/async/``.
+
+They are meant for an ASGI server (``uvicorn bufet.asgi:application``).
+Queries that do not depend on each other, such as a page of rows and
+the row count, go through ``gather_queries``. With
+``BUFET_ASYNC_PARALLEL_QUERIES`` enabled, each of them runs in its own
+worker thread and therefore on its own database connection, so they
+overlap instead of queuing. Forms still post to the synchronous views.
+"""
+import asyncio
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.paginator import InvalidPage, Page, Paginator
+from django.db import close_old_connections
+from django.http import Http404
+from django.shortcuts import render
+from django.views import View
+
+from .cart import get_draft_cart, get_guest_cart
+from .catalog import get_catalog
+from .forms import OrderForm
+from .models import Restaurant
+from .stats import get_site_stats
+from .views import menu_context, menu_filters, narrowed_menu
+
+
+def _on_own_connection(call):
+    def run():
+        try:
+            return call()
+        finally:
+            close_old_connections()
+    return run
+
+
+async def gather_queries(*calls):
+    """Run independent synchronous ORM callables and return their results.
+
+    Concurrent on separate connections when
+    ``BUFET_ASYNC_PARALLEL_QUERIES`` is on; otherwise one after another
+    on the request's connection, which is what tests need to see data
+    inside their transaction. Either way the queries count towards the
+    request's budget and timings (see ``instrumentation.collect``).
+    """
+    if settings.BUFET_ASYNC_PARALLEL_QUERIES:
+        return await asyncio.gather(*(
+            sync_to_async(_on_own_connection(call),
+                          thread_sensitive=False)()
+            for call in calls
+        ))
+    return [await sync_to_async(call)() for call in calls]
+
+
+async def paginate(queryset, per_page, number):
+    """``(paginator, page)`` for ``number``, counting and fetching at once."""
+    try:
+        number = int(number)
+    except (TypeError, ValueError):
+        raise Http404("Invalid page.")
+    offset = (max(number, 1) - 1) * per_page
+    count, objects = await gather_queries(
+        queryset.count,
+        lambda: list(queryset[offset:offset + per_page]),
+    )
+    paginator = Paginator(queryset, per_page)
+    paginator.count = count
+    try:
+        number = paginator.validate_number(number)
+    except InvalidPage as error:
+        raise Http404(str(error))
+    return paginator, Page(objects, number, paginator)
+
+
+def page_context(name, paginator, page):
+    return {
+        name: page.object_list,
+        "object_list": page.object_list,
+        "paginator": paginator,
+        "page_obj": page,
+        "is_paginated": page.has_other_pages(),
+    }
+
+
+async def arender(request, template_name, context):
+    """Render in the request's sync thread.
+
+    Templates may still touch the ORM through lazy context, such as the
+    navbar cart badge.
+    """
+    return await sync_to_async(render)(request, template_name, context)
+
+
+class AsyncLoginRequiredMixin:
+    async def dispatch(self, request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncIndexView(View):
+    async def get(self, request):
+        site_stats = await sync_to_async(get_site_stats)()
+        context = {
+            "num_restaurants": site_stats["restaurants"],
+            "num_orders": site_stats["orders"],
+            "num_users": site_stats["users"],
+        }
+        return await arender(request, "bufet_system/index.html", context)
+
+
+class AsyncMenuListView(View):
+    """``MenuListView``, with the same search and ingredient filters."""
+    paginate_by = 5
+
+    async def get(self, request):
+        query = request.GET.get("q", "").strip()
+        number = request.GET.get("page") or 1
+        filters = menu_filters(request.GET)
+        queryset = await sync_to_async(narrowed_menu)(query, filters)
+        if queryset is not None:
+            paginator, page = await paginate(queryset, self.paginate_by,
+                                             number)
+        else:
+            menu = (await sync_to_async(get_catalog)()).menu
+            paginator = Paginator(menu, self.paginate_by)
+            try:
+                page = paginator.page(number)
+            except InvalidPage as error:
+                raise Http404(str(error))
+
+        context = page_context("dishes", paginator, page)
+        context.update(menu_context(query, filters))
+        return await arender(request, "bufet_system/menu.html", context)
+
+
+class AsyncProductCartListView(View):
+    """``ProductCartListView``: the draft cart, or the guest cart of an
+    anonymous visitor, read from its cookie and the catalog snapshot.
+    """
+    paginate_by = 5
+
+    async def get(self, request):
+        user = await request.auser()
+        if not user.is_authenticated:
+            lines = await sync_to_async(
+                lambda: get_guest_cart(request).get_lines())()
+            paginator = Paginator(lines, self.paginate_by)
+            try:
+                page = paginator.page(request.GET.get("page") or 1)
+            except InvalidPage as error:
+                raise Http404(str(error))
+            context = page_context("lines", paginator, page)
+            context["total_price"] = sum(
+                (line.subtotal for line in lines), Decimal("0.00"))
+            return await arender(request,
+                                 "bufet_system/product_cart.html",
+                                 context)
+
+        cart = await sync_to_async(get_draft_cart)(request)
+        if cart is None:
+            context = {"lines": [], "object_list": [],
+                       "is_paginated": False}
+        else:
+            paginator, page = await paginate(cart.get_lines(),
+                                             self.paginate_by,
+                                             request.GET.get("page") or 1)
+            context = page_context("lines", paginator, page)
+            context["total_price"] = cart.total_price
+        return await arender(request,
+                             "bufet_system/product_cart.html",
+                             context)
+
+
+class AsyncOrderCheckoutView(AsyncLoginRequiredMixin, View):
+    """GET side of checkout; the form posts to ``OrderCreateView``."""
+
+    async def get(self, request):
+        cart = await sync_to_async(get_draft_cart)(request)
+        calls = [lambda: list(Restaurant.objects.all())]
+        if cart is not None:
+            calls.append(lambda: list(cart.get_lines()))
+        restaurants, *lines = await gather_queries(*calls)
+
+        form = OrderForm()
+        # Reuse the fetched restaurants instead of letting the radio
+        # widget query them again while rendering.
+        form.fields["restaurant"].choices = [
+            (restaurant.pk, str(restaurant)) for restaurant in restaurants]
+        context = {
+            "form": form,
+            "user_details": await request.auser(),
+            "restaurants": restaurants,
+        }
+        if cart is not None:
+            context["lines"] = lines[0]
+            context["total_price"] = cart.total_price
+        return await arender(request,
+                             "bufet_system/order_checkout.html",
+                             context)
@@ -0,0 +1,78 @@
+"""Authentication backend that serves the signed-in user from the cache.
+
+Enabled with ``AUTHENTICATION_BACKENDS =
+["bufet_system.backends.auth.CachedModelBackend", ...]``.
+``AuthenticationMiddleware`` loads the user on every authenticated
+request; with this backend that is a cache read instead of a query on the
+user table. Snapshots are dropped whenever a user is saved or deleted
+(see ``bufet_system.signals``) and expire after
+``BUFET_USER_CACHE_TIMEOUT`` seconds, which bounds staleness after
+``QuerySet.update()`` calls that bypass signals. Permission checks still
+read the database.
+
+A snapshot holds the user's fields without the password hash, plus the
+session hash derived from it, since the cache may live on disk. The
+password stays a deferred field on the restored user: reading it loads
+it from the database, and ``save()`` writes only the other fields.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend, UserModel
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db import router, transaction
+
+
+def user_key(user_id):
+    return f"bufet:user:{user_id}"
+
+
+def forget_user(user_id):
+    """Drop the cached snapshot now and again once the transaction commits.
+
+    The second delete catches a snapshot re-read by another request
+    before the change became visible to it.
+    """
+    key = user_key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def snapshot(user):
+    """What the cache keeps of ``user``: everything but the password."""
+    return {
+        "fields": {field.attname: getattr(user, field.attname)
+                   for field in UserModel._meta.concrete_fields
+                   if field.attname != "password"},
+        "session_auth_hash": user.get_session_auth_hash(),
+    }
+
+
+def restore(cached):
+    """A ``User`` from ``snapshot()``, with the password deferred."""
+    fields = cached["fields"]
+    user = UserModel.from_db(router.db_for_read(UserModel), list(fields),
+                             list(fields.values()))
+    user._session_auth_hash = cached["session_auth_hash"]
+    return user
+
+
+class CachedModelBackend(ModelBackend):
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user = super().authenticate(request, username, password, **kwargs)
+        if user is None and password is not None:
+            # ModelBackend follows this one only to load sessions created
+            # before it existed; stop it from checking the password again.
+            raise PermissionDenied
+        return user
+
+    def get_user(self, user_id):
+        key = user_key(user_id)
+        cached = cache.get(key)
+        if cached is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, snapshot(user), settings.BUFET_USER_CACHE_TIMEOUT)
+        else:
+            user = restore(cached)
+        return user if self.user_can_authenticate(user) else None
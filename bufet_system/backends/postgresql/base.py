@@ -0,0 +1,79 @@
+"""PostgreSQL backend that borrows connections from a per-process pool.
+
+Enabled with ``ENGINE = "bufet_system.backends.postgresql"``. Pool
+options come from a ``POOL`` dict in the database settings (``max_size``,
+``timeout``, ``max_idle``, ``max_lifetime``, ``check_after``). Closing a
+Django connection at the end of a request hands it back to the pool
+instead of disconnecting, so run it with ``CONN_MAX_AGE = 0``.
+"""
+from django.db.backends.postgresql import base, creation
+
+from bufet_system import pool as pools
+
+# TRANSACTION_STATUS_IDLE in psycopg2, TransactionStatus.IDLE in psycopg 3.
+IDLE = 0
+
+POOL_DEFAULTS = {
+    "max_size": 4,
+    "timeout": 10.0,
+    "max_idle": 300.0,
+    "max_lifetime": 3600.0,
+    "check_after": 30.0,
+}
+
+
+def _is_usable(connection):
+    if connection.closed:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+    return True
+
+
+def close_database_pools(name):
+    """Drop the pooled connections to database ``name``, e.g. before it
+    is dropped."""
+    pools.close_pools(lambda key: key[3] == name)
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        close_database_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_pool(self, conn_params):
+        settings = self.settings_dict
+        key = (self.alias, settings["HOST"], settings["PORT"],
+               settings["NAME"], settings["USER"])
+        options = {**POOL_DEFAULTS, **settings.get("POOL", {})}
+        connect = super().get_new_connection
+        return pools.get_pool(key, lambda: pools.ConnectionPool(
+            lambda: connect(conn_params), check=_is_usable, **options))
+
+    def get_new_connection(self, conn_params):
+        # The base class records the isolation level on the wrapper while
+        # connecting; pooled connections all share the configured one.
+        options = self.settings_dict["OPTIONS"]
+        self.isolation_level = base.IsolationLevel(
+            options.get("isolation_level",
+                        base.IsolationLevel.READ_COMMITTED))
+        return self.get_pool(conn_params).acquire()
+
+    def _close(self):
+        if self.connection is None:
+            return
+        pool = self.get_pool(self.get_connection_params())
+        connection = self.connection
+        discard = connection.closed or self.in_atomic_block
+        if not discard and connection.info.transaction_status != IDLE:
+            # connection.rollback() is a no-op in autocommit mode.
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("ROLLBACK")
+            except base.Database.Error:
+                discard = True
+        pool.release(connection, discard=discard)
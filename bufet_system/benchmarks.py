@@ -0,0 +1,560 @@
+"""Benchmark scenarios driven by ``manage.py bench_bufet``.
+
+Every scenario runs against a throwaway copy of the configured database
+(SQLite by default, PostgreSQL when ``DATABASE_URL`` points at one), so
+it never touches real data.
+"""
+import http.cookiejar
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from bufet_system import instrumentation, seeding, stats
+from bufet_system.instrumentation import percentile
+from bufet_system.models import (Dish,
+                                 Order,
+                                 ProductCart,
+                                 Restaurant,
+                                 User)
+
+FLOW_VIEWS = ("bufet_system:menu",
+              "bufet_system:add-to-cart",
+              "bufet_system:product-cart",
+              "bufet_system:order-checkout",
+              "bufet_system:order-list")
+
+
+@contextmanager
+def benchmark_database(keepdb=False, on_disk=False):
+    """Create a scratch database for the duration of the block.
+
+    ``on_disk`` puts a SQLite test database in a temporary file instead
+    of memory, so that server threads with their own connections see it.
+    """
+    old_name = connection.settings_dict["NAME"]
+    if on_disk and connection.vendor == "sqlite":
+        handle, path = tempfile.mkstemp(prefix="bench_bufet_",
+                                        suffix=".sqlite3")
+        os.close(handle)
+        connection.settings_dict["TEST"]["NAME"] = path
+    connection.creation.create_test_db(verbosity=0,
+                                       autoclobber=True,
+                                       keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name,
+                                            verbosity=0,
+                                            keepdb=keepdb)
+        if on_disk:
+            connection.settings_dict["TEST"]["NAME"] = None
+
+
+def summarize(timings, queries):
+    """Latency percentiles in milliseconds plus mean queries per request."""
+    return {
+        "requests": len(timings),
+        "p50_ms": percentile(timings, 0.50) * 1000,
+        "p95_ms": percentile(timings, 0.95) * 1000,
+        "p99_ms": percentile(timings, 0.99) * 1000,
+        "queries": sum(queries) / len(queries) if queries else 0.0,
+    }
+
+
+def measure(call, iterations):
+    """Run ``call`` repeatedly, recording wall time and SQL queries."""
+    timings, queries = [], []
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - started)
+        queries.append(len(captured))
+    return summarize(timings, queries)
+
+
+def grow_orders(target, batch_size=5000):
+    """Bulk insert orders until the table holds ``target`` rows."""
+    user, _ = User.objects.get_or_create(username="bench",
+                                         defaults={"phone_number": "bench"})
+    restaurant, _ = Restaurant.objects.get_or_create(address="Bench street")
+    missing = target - Order.objects.count()
+    while missing > 0:
+        batch = min(batch_size, missing)
+        Order.objects.bulk_create(
+            Order(user=user,
+                  restaurant=restaurant,
+                  total_price=Decimal("100.00"))
+            for _ in range(batch)
+        )
+        missing -= batch
+    stats.refresh_counters()
+
+
+def index_scenario(sizes, iterations):
+    """Landing page latency as the orders table grows.
+
+    Compares the counters-backed IndexView with the three COUNT(*)
+    queries it used to run on every request.
+    """
+    client = Client()
+    url = reverse("bufet_system:index")
+    results = []
+    for size in sizes:
+        grow_orders(size)
+        cache.clear()
+        client.get(url)
+        view = measure(lambda: client.get(url), iterations)
+        counts = measure(
+            lambda: (Restaurant.objects.count(),
+                     Order.objects.count(),
+                     User.objects.count()),
+            iterations,
+        )
+        results.append({"orders": size, "view": view, "count_star": counts})
+    return results
+
+
+class ClientSession:
+    """One logged-in user driven through Django's test client."""
+
+    def __init__(self, user):
+        self.client = Client()
+        self.client.force_login(user)
+
+    def get(self, path):
+        return self.client.get(path).status_code
+
+    def post(self, path, data):
+        return self.client.post(path, data).status_code
+
+
+class _KeepStatus(urllib.request.HTTPErrorProcessor):
+    """Hand back every response as-is instead of following redirects."""
+
+    def http_response(self, request, response):
+        return response
+
+    https_response = http_response
+
+
+class HTTPSession:
+    """One user talking to a live server over HTTP, cookies and all."""
+
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), _KeepStatus)
+        self.get("/accounts/login/")
+        status = self.post("/accounts/login/",
+                           {"username": username, "password": password})
+        if status != 302:
+            raise RuntimeError(f"Could not log in as {username}.")
+
+    def _csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == "csrftoken":
+                return cookie.value
+        return ""
+
+    def _send(self, request):
+        with self.opener.open(request) as response:
+            response.read()
+            return response.status
+
+    def get(self, path):
+        return self._send(urllib.request.Request(self.base_url + path))
+
+    def post(self, path, data):
+        token = self._csrf_token()
+        body = urllib.parse.urlencode({**data, "csrfmiddlewaretoken": token})
+        return self._send(urllib.request.Request(
+            self.base_url + path,
+            data=body.encode(),
+            headers={"X-CSRFToken": token,
+                     "Referer": self.base_url + path},
+        ))
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def wsgi_server():
+    """Serve the project on a free local port from a thread-per-request
+    WSGI server; yields the base URL."""
+    server = ThreadedWSGIServer(("127.0.0.1", 0), _QuietHandler)
+    server.set_app(get_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def seed_customers(users, dishes, restaurants, orders, seed, count):
+    """Seed the database and return up to ``count`` seeded users."""
+    seeding.seed(users=users, dishes=dishes, restaurants=restaurants,
+                 orders=orders, seed=seed)
+    customers = list(User.objects.filter(username__startswith="seed_user_")
+                     .order_by("pk")[:max(count, 1)])
+    if not customers:
+        raise ValueError("The benchmark needs at least one seeded user.")
+    return customers
+
+
+@contextmanager
+def asgi_server():
+    """Serve the project with uvicorn on a free local port; yields the
+    base URL."""
+    try:
+        import uvicorn
+    except ImportError:
+        raise ImproperlyConfigured("The ASGI benchmark needs uvicorn "
+                                   "(pip install uvicorn).")
+    from django.core.asgi import get_asgi_application
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(get_asgi_application(),
+                                           lifespan="off",
+                                           log_level="warning",
+                                           access_log=False))
+    thread = threading.Thread(target=server.run,
+                              kwargs={"sockets": [sock]},
+                              daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn did not start.")
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{sock.getsockname()[1]}"
+    finally:
+        server.should_exit = True
+        thread.join()
+        sock.close()
+
+
+def run_flow(session, rng, dish_ids, restaurant_ids, record):
+    """One customer visit: menu, a few dishes into the cart, the cart,
+    checkout and the order history."""
+    def step(label, call):
+        started = time.perf_counter()
+        status = call()
+        record(label, time.perf_counter() - started, status)
+
+    step("bufet_system:menu",
+         lambda: session.get(reverse("bufet_system:menu")))
+    for dish_id in rng.sample(dish_ids, min(len(dish_ids), 3)):
+        step("bufet_system:add-to-cart",
+             lambda: session.post(reverse("bufet_system:add-to-cart",
+                                          args=[dish_id]),
+                                  {"quantity": rng.randint(1, 3)}))
+    step("bufet_system:product-cart",
+         lambda: session.get(reverse("bufet_system:product-cart")))
+    checkout = reverse("bufet_system:order-checkout")
+    step("bufet_system:order-checkout", lambda: session.get(checkout))
+    step("bufet_system:order-checkout",
+         lambda: session.post(checkout,
+                              {"restaurant": rng.choice(restaurant_ids)}))
+    step("bufet_system:order-list",
+         lambda: session.get(reverse("bufet_system:order-list")))
+
+
+def flow_scenario(users, dishes, restaurants, orders, seed=0,
+                  mode="client", threads=1, iterations=20):
+    """Seed the database and time the ordering flow end to end.
+
+    ``mode="client"`` runs the flow in-process through the test client,
+    one visit after another; ``mode="wsgi"`` runs ``threads`` concurrent
+    customers against a threaded WSGI server over real HTTP. Each
+    customer completes ``iterations`` visits. Latency is measured by the
+    caller, queries per request by the performance middleware.
+    """
+    customers = seed_customers(users, dishes, restaurants, orders, seed,
+                               threads)
+    dish_ids = list(Dish.objects.order_by("pk").values_list("pk", flat=True))
+    restaurant_ids = list(Restaurant.objects.order_by("pk")
+                          .values_list("pk", flat=True))
+    cache.clear()
+
+    timings = {}
+    errors = []
+    lock = threading.Lock()
+
+    def record(label, seconds, status):
+        with lock:
+            timings.setdefault(label, []).append(seconds)
+            if status >= 400:
+                errors.append((label, status))
+
+    def visit(session, worker):
+        rng = random.Random(f"{seed}:{worker}")
+        for _ in range(iterations):
+            run_flow(session, rng, dish_ids, restaurant_ids, record)
+
+    with override_settings(BUFET_PERF_SAMPLE_RATE=1.0):
+        if mode == "wsgi":
+            with wsgi_server() as base_url:
+                sessions = [HTTPSession(base_url,
+                                        customers[worker % len(customers)]
+                                        .username,
+                                        seeding.SEED_PASSWORD)
+                            for worker in range(threads)]
+                instrumentation.registry.reset()
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=threads) as pool:
+                    for future in [pool.submit(visit, session, worker)
+                                   for worker, session
+                                   in enumerate(sessions)]:
+                        future.result()
+                elapsed = time.perf_counter() - started
+        else:
+            session = ClientSession(customers[0])
+            instrumentation.registry.reset()
+            started = time.perf_counter()
+            visit(session, 0)
+            elapsed = time.perf_counter() - started
+        server = instrumentation.registry.snapshot()
+
+    everything = [value for values in timings.values() for value in values]
+    views = {
+        label: {
+            **summarize(timings.get(label, []), []),
+            "queries": server.get(label, {})
+                             .get("sql_queries", {}).get("mean", 0.0),
+        }
+        for label in FLOW_VIEWS
+    }
+    overall = summarize(everything, [])
+    if everything:
+        overall["queries"] = sum(view["queries"] * view["requests"]
+                                 for view in views.values()) / len(everything)
+    return {
+        "mode": mode,
+        "threads": threads if mode == "wsgi" else 1,
+        "scale": {"users": users, "dishes": dishes,
+                  "restaurants": restaurants, "orders": orders,
+                  "seed": seed, "iterations": iterations},
+        "seconds": elapsed,
+        "rps": len(everything) / elapsed if elapsed else 0.0,
+        "errors": len(errors),
+        "overall": overall,
+        "views": views,
+    }
+
+
+def compare_to_baseline(result, baseline, tolerance=0.2):
+    """Regressions of ``result`` against a stored ``baseline`` run.
+
+    Latency may grow and throughput may drop by ``tolerance`` (a fraction)
+    before it counts; queries per request may not grow at all beyond
+    rounding noise from concurrent retries.
+    """
+    problems = []
+    for key in ("mode", "threads", "scale"):
+        if result[key] != baseline[key]:
+            return [f"baseline was recorded with a different {key}: "
+                    f"{baseline[key]!r} instead of {result[key]!r}"]
+    if result["errors"] > baseline["errors"]:
+        problems.append(f"{result['errors']} failed requests, "
+                        f"baseline had {baseline['errors']}")
+    if result["rps"] < baseline["rps"] * (1 - tolerance):
+        problems.append(f"throughput fell to {result['rps']:.1f} req/s "
+                        f"from {baseline['rps']:.1f}")
+    for label, current in [("overall", result["overall"]),
+                           *result["views"].items()]:
+        previous = (baseline["overall"] if label == "overall"
+                    else baseline["views"].get(label))
+        if previous is None:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            problems.append(f"{label} p95 rose to {current['p95_ms']:.2f}ms "
+                            f"from {previous['p95_ms']:.2f}ms")
+        if current["queries"] > previous["queries"] + 0.5:
+            problems.append(f"{label} runs {current['queries']:.1f} queries "
+                            f"per request, up from {previous['queries']:.1f}")
+    return problems
+
+
+ASGI_PAGES = {
+    "sync": ("bufet_system:index",
+             "bufet_system:menu",
+             "bufet_system:product-cart",
+             "bufet_system:order-checkout"),
+    "async": ("bufet_system:async-index",
+              "bufet_system:async-menu",
+              "bufet_system:async-product-cart",
+              "bufet_system:async-order-checkout"),
+}
+
+
+def asgi_scenario(users, dishes, restaurants, orders, seed=0, threads=8,
+                  iterations=20):
+    """Concurrent page loads: threaded WSGI against uvicorn.
+
+    ``threads`` logged-in customers, each with a few dishes in the cart,
+    load the landing page, menu, cart and checkout ``iterations`` times.
+    This runs on the threaded WSGI server (standing in for a threaded
+    gunicorn worker), on uvicorn with the synchronous views, and on
+    uvicorn with the async views.
+    """
+    # Under ASGI every request runs its sync code in a fresh thread, so
+    # persistent connections would pile up; Django needs them off there.
+    connections.settings["default"]["CONN_MAX_AGE"] = 0
+    customers = seed_customers(users, dishes, restaurants, orders, seed,
+                               threads)
+    for customer in customers:
+        cart = ProductCart.objects.get_or_create_draft(customer)
+        for dish in Dish.objects.order_by("pk")[:3]:
+            cart.add_product(dish, 1)
+
+    results = []
+    for server, pages in (("wsgi", "sync"),
+                          ("asgi", "sync"),
+                          ("asgi", "async")):
+        cache.clear()
+        serve = wsgi_server if server == "wsgi" else asgi_server
+        with serve() as base_url:
+            sessions = [HTTPSession(base_url,
+                                    customers[worker % len(customers)]
+                                    .username,
+                                    seeding.SEED_PASSWORD)
+                        for worker in range(threads)]
+            paths = [reverse(name) for name in ASGI_PAGES[pages]]
+            timings, errors = [], []
+            lock = threading.Lock()
+
+            def load(session):
+                for _ in range(iterations):
+                    for path in paths:
+                        started = time.perf_counter()
+                        status = session.get(path)
+                        with lock:
+                            timings.append(time.perf_counter() - started)
+                            if status >= 400:
+                                errors.append((path, status))
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                for future in [pool.submit(load, session)
+                               for session in sessions]:
+                    future.result()
+            elapsed = time.perf_counter() - started
+        results.append({
+            "server": server,
+            "views": pages,
+            "rps": len(timings) / elapsed if elapsed else 0.0,
+            "errors": len(errors),
+            **summarize(timings, []),
+        })
+    return results
+
+
+AUTH_PAGES = ("bufet_system:index",
+              "bufet_system:menu",
+              "bufet_system:restaurant-list",
+              "bufet_system:product-cart",
+              "bufet_system:order-list")
+AUTH_CONFIGS = {
+    "db": {
+        "SESSION_ENGINE": "django.contrib.sessions.backends.db",
+        "AUTHENTICATION_BACKENDS": [
+            "django.contrib.auth.backends.ModelBackend"],
+    },
+    "cached": {
+        "SESSION_ENGINE": "django.contrib.sessions.backends.cached_db",
+        "AUTHENTICATION_BACKENDS": [
+            "bufet_system.backends.auth.CachedModelBackend"],
+    },
+}
+
+
+def auth_scenario(users, dishes, restaurants, orders, seed=0, iterations=20):
+    """Queries per authenticated page: DB sessions against cached ones.
+
+    A logged-in customer loads ``AUTH_PAGES`` ``iterations`` times with
+    each of ``AUTH_CONFIGS``, after one warm-up pass. Queries touching
+    the session and user tables are counted apart from the total.
+    """
+    customer = seed_customers(users, dishes, restaurants, orders, seed, 1)[0]
+    cart = ProductCart.objects.get_or_create_draft(customer)
+    for dish in Dish.objects.order_by("pk")[:3]:
+        cart.add_product(dish, 1)
+    tables = {"session": Session._meta.db_table,
+              "user": User._meta.db_table}
+
+    results = []
+    for config, overrides in AUTH_CONFIGS.items():
+        with override_settings(**overrides):
+            cache.clear()
+            # A fresh client loads the middleware, and so the session
+            # engine, under these settings.
+            session = ClientSession(customer)
+            paths = [reverse(name) for name in AUTH_PAGES]
+            for path in paths:
+                session.get(path)
+            overall = {"timings": [], "queries": [], "session": [],
+                       "user": [], "errors": 0}
+            for name, path in zip(AUTH_PAGES, paths):
+                page = {"timings": [], "queries": [], "session": [],
+                        "user": [], "errors": 0}
+                for _ in range(iterations):
+                    counts = dict.fromkeys(["queries", *tables], 0)
+
+                    def count(execute, sql, params, many, context):
+                        counts["queries"] += 1
+                        for kind, table in tables.items():
+                            if table in sql:
+                                counts[kind] += 1
+                        return execute(sql, params, many, context)
+
+                    with connection.execute_wrapper(count):
+                        started = time.perf_counter()
+                        status = session.get(path)
+                        elapsed = time.perf_counter() - started
+                    for row in (page, overall):
+                        row["timings"].append(elapsed)
+                        row["errors"] += status >= 400
+                        for kind, value in counts.items():
+                            row[kind].append(value)
+                results.append(_auth_row(config, name, page))
+            results.append(_auth_row(config, "overall", overall))
+    return results
+
+
+def _auth_row(config, page, samples):
+    requests = len(samples["timings"]) or 1
+    return {
+        "config": config,
+        "page": page,
+        "errors": samples["errors"],
+        "session_queries": sum(samples["session"]) / requests,
+        "user_queries": sum(samples["user"]) / requests,
+        **summarize(samples["timings"], samples["queries"]),
+    }
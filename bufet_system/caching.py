@@ -0,0 +1,123 @@
+"""Versioned cache keys for catalog data that only staff edit.
+
+Each namespace has a version number stored in the cache. Keys built with
+``make_key`` embed the current version, so bumping it (on ``post_save`` /
+``post_delete`` of the underlying models) invalidates every cached page,
+object and template fragment of that namespace at once without having to
+know their keys.
+
+Versions start from the clock rather than 1, so a version key that was
+evicted or flushed comes back with a number never used before and cannot
+revive stale entries, or a stale in-process snapshot such as
+``bufet_system.catalog``.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page
+from django.db import transaction
+
+MENU = "menu"
+RESTAURANTS = "restaurants"
+
+
+def _version_key(namespace):
+    return f"bufet:{namespace}:version"
+
+
+def get_version(namespace):
+    version = cache.get(_version_key(namespace))
+    if version is None:
+        fresh = time.time_ns()
+        cache.add(_version_key(namespace), fresh, timeout=None)
+        version = cache.get(_version_key(namespace), fresh)
+    return version
+
+
+def bump_version(namespace):
+    """Invalidate a namespace once the current transaction commits."""
+    def bump():
+        try:
+            cache.incr(_version_key(namespace))
+        except ValueError:
+            cache.set(_version_key(namespace), time.time_ns(), timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def make_key(namespace, *parts):
+    suffix = ":".join(str(part) for part in parts)
+    return f"bufet:{namespace}:v{get_version(namespace)}:{suffix}"
+
+
+def get_or_compute(namespace, parts, compute):
+    """Return the cached value for ``parts`` or store ``compute()``."""
+    key = make_key(namespace, *parts)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, settings.BUFET_CACHE_TIMEOUT)
+    return value
+
+
+class CachedPageMixin:
+    """Serve ListView pages from the cache of ``cache_namespace``.
+
+    Caches the object count and the objects of each requested page, so a
+    warm hit renders without touching the database. Template fragments
+    can use ``cache_version`` and ``cache_timeout`` from the context to
+    share the same invalidation.
+    """
+    cache_namespace = None
+
+    def paginate_queryset(self, queryset, page_size):
+        page_number = (self.kwargs.get(self.page_kwarg)
+                       or self.request.GET.get(self.page_kwarg)
+                       or 1)
+        key = make_key(self.cache_namespace, "page", page_size, page_number)
+        cached = cache.get(key)
+        if cached is None:
+            paginator, page, object_list, is_paginated = (
+                super().paginate_queryset(queryset, page_size))
+            cache.set(key,
+                      (paginator.count, page.number, list(object_list)),
+                      settings.BUFET_CACHE_TIMEOUT)
+            return paginator, page, object_list, is_paginated
+
+        count, number, objects = cached
+        paginator = self.get_paginator(
+            queryset,
+            page_size,
+            orphans=self.get_paginate_orphans(),
+            allow_empty_first_page=self.get_allow_empty(),
+        )
+        paginator.count = count
+        page = Page(objects, number, paginator)
+        return paginator, page, objects, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["cache_version"] = get_version(self.cache_namespace)
+        context["cache_timeout"] = settings.BUFET_CACHE_TIMEOUT
+        return context
+
+
+class CachedObjectMixin:
+    """Serve a DetailView object from the cache of ``cache_namespace``."""
+    cache_namespace = None
+
+    def get_object(self, queryset=None):
+        if queryset is not None:
+            return super().get_object(queryset)
+        return get_or_compute(
+            self.cache_namespace,
+            ("object", self.kwargs.get(self.pk_url_kwarg)),
+            super().get_object,
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["cache_version"] = get_version(self.cache_namespace)
+        context["cache_timeout"] = settings.BUFET_CACHE_TIMEOUT
+        return context
@@ -0,0 +1,159 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.core import signing
+
+from bufet_system import catalog
+from bufet_system.models import ProductCart
+
+_UNSET = object()
+
+GUEST_CART_SALT = "bufet_system.guest_cart"
+
+# Duck-types the rows of ProductCartItemQuerySet.with_details().
+GuestLine = namedtuple("GuestLine",
+                       ["item_id", "name", "price", "quantity", "subtotal"])
+
+
+class GuestCart:
+    """An anonymous visitor's cart, kept in a signed cookie.
+
+    Holds only dish ids and quantities, so adding to it costs no database
+    writes; ``GuestCartMiddleware`` stores it back on the response when it
+    changed. On login it is merged into the user's draft ``ProductCart``
+    (see ``merge_guest_cart``).
+    """
+
+    def __init__(self, quantities=None):
+        self.quantities = dict(quantities or {})
+        self.changed = False
+
+    @classmethod
+    def from_request(cls, request):
+        value = request.COOKIES.get(settings.BUFET_GUEST_CART_COOKIE)
+        if not value:
+            return cls()
+        try:
+            pairs = signing.loads(value, salt=GUEST_CART_SALT,
+                                  max_age=settings.BUFET_GUEST_CART_MAX_AGE)
+            quantities = {int(dish): int(quantity)
+                          for dish, quantity in pairs}
+        except (signing.BadSignature, ValueError, TypeError):
+            cart = cls()
+            cart.changed = True
+            return cart
+        return cls({dish: quantity for dish, quantity in quantities.items()
+                    if quantity > 0})
+
+    def dumps(self):
+        return signing.dumps(sorted(self.quantities.items()),
+                             salt=GUEST_CART_SALT, compress=True)
+
+    @property
+    def items_count(self):
+        return sum(self.quantities.values())
+
+    def add(self, dish_id, quantity=1):
+        """Add ``quantity`` of a dish; False if the cart is full."""
+        if quantity <= 0:
+            return True
+        full = len(self.quantities) >= settings.BUFET_GUEST_CART_MAX_LINES
+        if full and dish_id not in self.quantities:
+            return False
+        self.quantities[dish_id] = self.quantities.get(dish_id, 0) + quantity
+        self.changed = True
+        return True
+
+    def remove(self, dish_id, quantity=1):
+        if dish_id not in self.quantities:
+            return
+        if self.quantities[dish_id] > quantity:
+            self.quantities[dish_id] -= quantity
+        else:
+            del self.quantities[dish_id]
+        self.changed = True
+
+    def set_quantities(self, quantities):
+        """Like ``ProductCart.set_quantities``, keyed by dish id.
+
+        Returns False, changing nothing, if the result would hold more
+        than ``BUFET_GUEST_CART_MAX_LINES`` dishes.
+        """
+        updated = dict(self.quantities)
+        for dish_id, quantity in quantities.items():
+            if quantity > 0:
+                updated[dish_id] = quantity
+            else:
+                updated.pop(dish_id, None)
+        if len(updated) > settings.BUFET_GUEST_CART_MAX_LINES:
+            return False
+        self.changed = self.changed or updated != self.quantities
+        self.quantities = updated
+        return True
+
+    def clear(self):
+        self.changed = self.changed or bool(self.quantities)
+        self.quantities = {}
+
+    def get_lines(self):
+        """The lines at current dish prices, by name; dishes that no
+        longer exist are left out. Reads the catalog snapshot, not the
+        database.
+        """
+        dishes = catalog.in_bulk(self.quantities)
+        lines = [GuestLine(pk, dish.name, dish.price, self.quantities[pk],
+                           dish.price * self.quantities[pk])
+                 for pk, dish in dishes.items()]
+        return sorted(lines, key=lambda line: (line.name, line.item_id))
+
+
+def get_guest_cart(request):
+    """Return the anonymous visitor's cart, read once per request."""
+    cart = getattr(request, "_guest_cart", None)
+    if cart is None:
+        cart = request._guest_cart = GuestCart.from_request(request)
+    return cart
+
+
+def merge_guest_cart(request, user):
+    """Add the guest cart's lines to ``user``'s draft cart and empty it.
+
+    The lines are added with one ``set_quantities`` batch, so merging
+    costs the same few statements however many dishes the guest picked.
+    """
+    guest = get_guest_cart(request)
+    if not guest.quantities:
+        return
+    dishes = catalog.in_bulk(guest.quantities)
+    if dishes:
+        cart = ProductCart.objects.get_or_create_draft(user)
+        cart.set_quantities({dish: guest.quantities[pk]
+                             for pk, dish in dishes.items()}, add=True)
+        request._cached_draft_cart = cart
+    guest.clear()
+
+
+def get_draft_cart(request, create=False):
+    """Return the current user's draft cart, resolved once per request.
+
+    The result is memoised on the request, so views, their context and
+    the navbar context processor share a single lookup. With
+    ``create=True`` a missing cart is created instead of returning None.
+    """
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated:
+        return None
+
+    cart = getattr(request, "_cached_draft_cart", _UNSET)
+    if cart is _UNSET or (cart is None and create):
+        if create:
+            cart = ProductCart.objects.get_or_create_draft(user)
+        else:
+            cart = ProductCart.objects.draft_for(user)
+        request._cached_draft_cart = cart
+    return cart
+
+
+def forget_draft_cart(request):
+    """Drop the memoised cart, e.g. after it has been checked out."""
+    request._cached_draft_cart = None
@@ -0,0 +1,85 @@
+"""Per-worker snapshot of the dish catalog.
+
+Adding to or removing from a cart needs a dish's price and name, and the
+menu its name, price and weight. ``get_catalog`` keeps those for every
+dish in memory, so cart writes and menu pages read no dish rows. The
+snapshot is tagged with the ``caching.MENU`` version it was loaded at.
+Saving or deleting a dish bumps that version (see
+``bufet_system.signals``), and the next call in each worker reloads the
+snapshot. Snapshots are never modified, so threads share them without
+locking.
+"""
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+from django.http import Http404
+
+from bufet_system import caching
+from bufet_system.models import Dish
+
+_DishInfo = namedtuple("DishInfo", ["id", "name", "price", "weight"])
+
+
+class DishInfo(_DishInfo):
+    """A dish as the catalog holds it.
+
+    Stands in for a ``Dish`` in ``ProductCart`` methods, which read only
+    ``pk``, ``name`` and ``price``.
+    """
+    __slots__ = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+
+Catalog = namedtuple("Catalog", ["version", "dishes", "menu"])
+Catalog.__doc__ = """Every dish at one ``caching.MENU`` version.
+
+``dishes`` is a read-only ``{id: DishInfo}`` mapping and ``menu`` a tuple
+of the same dishes in menu order.
+"""
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def load(version):
+    """Read every dish into a new ``Catalog`` tagged with ``version``."""
+    menu = tuple(DishInfo._make(row) for row in (
+        Dish.objects.order_by("name", "pk")
+        .values_list("pk", "name", "price", "weight")
+        .iterator(chunk_size=2000)))
+    return Catalog(version, MappingProxyType({dish.id: dish
+                                              for dish in menu}), menu)
+
+
+def get_catalog():
+    """The current snapshot, reloaded if the menu version moved on.
+
+    The version is read before the dishes, so a snapshot is never tagged
+    newer than its contents.
+    """
+    global _catalog
+    version = caching.get_version(caching.MENU)
+    catalog = _catalog
+    if catalog is None or catalog.version != version:
+        with _catalog_lock:
+            catalog = _catalog
+            if catalog is None or catalog.version != version:
+                catalog = _catalog = load(version)
+    return catalog
+
+
+def in_bulk(dish_ids):
+    """``{id: DishInfo}`` for those of ``dish_ids`` that exist."""
+    dishes = get_catalog().dishes
+    return {pk: dishes[pk] for pk in dish_ids if pk in dishes}
+
+
+def get_dish_or_404(dish_id):
+    dish = get_catalog().dishes.get(dish_id)
+    if dish is None:
+        raise Http404("No dish matches the given query.")
+    return dish
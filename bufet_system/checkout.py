@@ -0,0 +1,189 @@
+"""Placing many orders at once, e.g. a team lunch submitted by one client.
+
+``place_orders`` validates every entry against users and restaurants
+fetched up front and against dish prices from the catalog snapshot, then
+writes the carts, their lines and the orders with three ``bulk_create``
+calls in a single transaction. The number of queries does not depend on
+how many entries are submitted.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from bufet_system import analytics, catalog, stats
+from bufet_system.models import (Dish,
+                                 Order,
+                                 ProductCart,
+                                 ProductCartItem,
+                                 Restaurant)
+
+CENT = Decimal("0.01")
+
+
+def _total_limit():
+    """The smallest total ``Order.total_price`` cannot hold."""
+    field = Order._meta.get_field("total_price")
+    return Decimal(10) ** (field.max_digits - field.decimal_places)
+
+
+def _as_id(value):
+    if isinstance(value, bool):
+        raise ValueError(value)
+    return int(value)
+
+
+def parse_entry(entry):
+    """``(user_id, restaurant_id, {dish_id: quantity})`` from raw input.
+
+    ``lines`` may be a ``{dish_id: quantity}`` mapping (JSON object keys
+    are strings) or a list of ``{"dish": ..., "quantity": ...}`` items.
+    Raises ``ValueError`` describing the first problem found.
+    """
+    if not isinstance(entry, dict):
+        raise ValueError("Entry must be an object.")
+    try:
+        user_id = _as_id(entry["user"])
+        restaurant_id = _as_id(entry["restaurant"])
+    except KeyError as error:
+        raise ValueError(f"Missing field {error.args[0]!r}.")
+    except (TypeError, ValueError):
+        raise ValueError("User and restaurant must be ids.")
+
+    raw_lines = entry.get("lines")
+    if isinstance(raw_lines, dict):
+        pairs = raw_lines.items()
+    elif isinstance(raw_lines, list):
+        try:
+            pairs = [(line["dish"], line.get("quantity", 1))
+                     for line in raw_lines]
+        except (KeyError, TypeError, AttributeError):
+            raise ValueError("Each line needs a dish.")
+    else:
+        raise ValueError("Lines must be a mapping or a list.")
+
+    lines = {}
+    for dish, quantity in pairs:
+        try:
+            dish_id, quantity = _as_id(dish), _as_id(quantity)
+        except (TypeError, ValueError):
+            raise ValueError("Dishes and quantities must be integers.")
+        if quantity < 1:
+            raise ValueError(f"Quantity for dish {dish_id} must be "
+                             f"positive.")
+        lines[dish_id] = lines.get(dish_id, 0) + quantity
+    if not lines:
+        raise ValueError("An order needs at least one line.")
+    maximum = settings.BUFET_CART_MAX_QUANTITY
+    for dish_id, quantity in lines.items():
+        if quantity > maximum:
+            raise ValueError(f"Quantity for dish {dish_id} must be at "
+                             f"most {maximum}.")
+    return user_id, restaurant_id, lines
+
+
+def place_orders(entries):
+    """Validate ``entries`` and place the valid ones together.
+
+    Returns one result per entry, in order: ``{"order": <id>, "total":
+    "<price>"}`` when it was placed or ``{"errors": [...]}`` when it was
+    rejected. Rejected entries do not stop the others.
+    """
+    parsed = []
+    results = []
+    for entry in entries:
+        try:
+            parsed.append(parse_entry(entry))
+            results.append(None)
+        except ValueError as error:
+            parsed.append(None)
+            results.append({"errors": [str(error)]})
+
+    valid = [plan for plan in parsed if plan is not None]
+    users = set(get_user_model().objects.filter(
+        pk__in={user_id for user_id, _, _ in valid}, is_active=True,
+    ).values_list("pk", flat=True))
+    restaurants = set(Restaurant.objects.filter(
+        pk__in={restaurant_id for _, restaurant_id, _ in valid},
+    ).values_list("pk", flat=True))
+    dishes = catalog.in_bulk({dish for _, _, lines in valid
+                              for dish in lines})
+    prices = {pk: dish.price for pk, dish in dishes.items()}
+    names = {pk: dish.name for pk, dish in dishes.items()}
+
+    limit = _total_limit()
+    accepted = []
+    for index, plan in enumerate(parsed):
+        if plan is None:
+            continue
+        user_id, restaurant_id, lines = plan
+        errors = []
+        if user_id not in users:
+            errors.append(f"Unknown or inactive user {user_id}.")
+        if restaurant_id not in restaurants:
+            errors.append(f"Unknown restaurant {restaurant_id}.")
+        errors.extend(f"Unknown dish {dish}." for dish in lines
+                      if dish not in prices)
+        if all(dish in prices for dish in lines):
+            total = sum(prices[dish] * quantity
+                        for dish, quantity in lines.items())
+            if total >= limit:
+                errors.append(f"Order total {total} is over the limit of "
+                              f"{limit - CENT}.")
+        if errors:
+            results[index] = {"errors": errors}
+        else:
+            accepted.append((index, plan))
+
+    if accepted:
+        orders = write_orders([plan for _, plan in accepted], prices,
+                              names)
+        for (index, _), order in zip(accepted, orders):
+            results[index] = {"order": order.pk,
+                              "total": str(order.total_price)}
+    return results
+
+
+def write_orders(plans, prices, names=None):
+    """Insert completed carts, their lines and orders for ``plans``.
+
+    ``plans`` are ``(user_id, restaurant_id, {dish_id: quantity})``
+    tuples already checked against ``prices``. Lines record the price and
+    the dish name from ``names`` (read from the database when not given).
+    Bulk inserts skip model signals, so the order counter and the daily
+    rollups are updated here.
+    """
+    if names is None:
+        names = dict(Dish.objects.filter(pk__in=prices)
+                     .values_list("pk", "name"))
+    totals = [sum((prices[dish] * quantity
+                   for dish, quantity in lines.items()),
+                  Decimal("0")).quantize(CENT)
+              for _, _, lines in plans]
+    with transaction.atomic():
+        carts = ProductCart.objects.bulk_create([
+            ProductCart(user_id=user_id,
+                        status=ProductCart.STATUS_COMPLETED,
+                        lines_count=len(lines),
+                        items_count=sum(lines.values()),
+                        total_price=total)
+            for (user_id, _, lines), total in zip(plans, totals)
+        ])
+        ProductCartItem.objects.bulk_create([
+            ProductCartItem(cart_id=cart.pk, item_id=dish, quantity=quantity,
+                            unit_price=prices[dish], dish_name=names[dish])
+            for cart, (_, _, lines) in zip(carts, plans)
+            for dish, quantity in lines.items()
+        ])
+        orders = Order.objects.bulk_create([
+            Order(user_id=cart.user_id,
+                  restaurant_id=restaurant_id,
+                  total_price=total,
+                  product_cart_id=cart.pk)
+            for cart, (_, restaurant_id, _), total
+            in zip(carts, plans, totals)
+        ])
+        stats.increment(stats.counter_name(Order), len(orders))
+        analytics.record_orders(orders)
+    return orders
@@ -1,5 +1,24 @@
 from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from bufet_system.cart import get_draft_cart, get_guest_cart
 
 
 def cfg_assets_root(request):
     return {'ASSETS_ROOT': settings.ASSETS_ROOT}
+
+
+def cart_summary(request):
+    """Expose the draft cart item count for the navbar badge.
+
+    Evaluated lazily, so pages that do not show the badge (admin, login)
+    do not pay for the lookup. Guests' counts come from their cookie.
+    """
+    def items_count():
+        user = getattr(request, "user", None)
+        if user is not None and not user.is_authenticated:
+            return get_guest_cart(request).items_count
+        cart = get_draft_cart(request)
+        return cart.items_count if cart is not None else 0
+
+    return {'cart_items_count': SimpleLazyObject(items_count)}
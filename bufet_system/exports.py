@@ -0,0 +1,158 @@
+"""Streaming exports of orders with their lines, user and restaurant.
+
+Orders are read with ``values_list().iterator()`` (a server-side cursor
+on PostgreSQL), and their lines are fetched with one query per
+``chunk_size`` orders. Neither model instances nor the whole history are
+held in memory. ``stream`` turns the records into encoded (optionally
+gzipped) pieces for a ``StreamingHttpResponse`` or a file.
+"""
+import csv
+import zlib
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from bufet_system.analytics import day_bounds
+from bufet_system.models import Order, ProductCartItem
+from bufet_system.utils import batched
+
+FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+FLUSH_BYTES = 64 * 1024
+
+ORDER_FIELDS = ("id", "created_at", "user_id", "user__username",
+                "user__email", "restaurant_id", "restaurant__address",
+                "total_price", "product_cart_id")
+LINE_FIELDS = ("cart_id", "item_id", "dish_name", "quantity",
+               "unit_price")
+# Spreadsheets run cells starting with these as formulas.
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+CSV_HEADER = ("order_id", "created_at", "user_id", "username", "email",
+              "restaurant_id", "restaurant", "order_total", "dish_id",
+              "dish", "quantity", "unit_price", "line_total")
+
+
+def records(first, last, restaurant=None, chunk_size=2000):
+    """Yield ``(order, lines)`` for orders placed on days ``first``..``last``.
+
+    ``order`` is a tuple of ``ORDER_FIELDS`` without the cart id and
+    ``lines`` a list of ``(dish_id, dish_name, quantity, unit_price)``.
+    Orders come oldest first.
+    """
+    start, end = day_bounds(first, last)
+    orders = Order.objects.filter(created_at__gte=start, created_at__lt=end)
+    if restaurant is not None:
+        orders = orders.filter(restaurant_id=restaurant)
+    rows = (orders.order_by("created_at", "id")
+            .values_list(*ORDER_FIELDS)
+            .iterator(chunk_size=chunk_size))
+    for batch in batched(rows, chunk_size):
+        lines = defaultdict(list)
+        carts = [row[-1] for row in batch if row[-1] is not None]
+        for cart, *line in (ProductCartItem.objects
+                            .filter(cart_id__in=carts)
+                            .order_by("cart_id", "item_id")
+                            .values_list(*LINE_FIELDS)):
+            lines[cart].append(line)
+        for row in batch:
+            yield row[:-1], lines.get(row[-1], [])
+
+
+def csv_text(value):
+    """``value``, quoted with ``'`` if a spreadsheet would run it."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_rows(records):
+    """One row per order line; orders without lines get one bare row.
+
+    User-entered text (names, username, email, address) goes through
+    ``csv_text``.
+    """
+    yield CSV_HEADER
+    for (order_id, created_at, *order), lines in records:
+        head = (order_id, created_at.isoformat(), *map(csv_text, order))
+        if not lines:
+            yield head + (None,) * 5
+        for dish_id, name, quantity, price in lines:
+            yield head + (dish_id, csv_text(name), quantity, price,
+                          price * quantity)
+
+
+def json_records(records):
+    """One nested object per order.
+
+    ``created_at`` is formatted here rather than by the JSON encoder, which
+    would cut it to milliseconds, so both formats carry microseconds.
+    """
+    for order, lines in records:
+        (order_id, created_at, user_id, username, email,
+         restaurant_id, address, total) = order
+        yield {
+            "id": order_id,
+            "created_at": created_at.isoformat(),
+            "user": {"id": user_id, "username": username, "email": email},
+            "restaurant": (None if restaurant_id is None
+                           else {"id": restaurant_id, "address": address}),
+            "total": total,
+            "lines": [{"dish": dish_id,
+                       "name": name,
+                       "quantity": quantity,
+                       "unit_price": price,
+                       "total": price * quantity}
+                      for dish_id, name, quantity, price in lines],
+        }
+
+
+class _Echo:
+    """File-like object whose ``write`` hands the text back to ``csv``."""
+
+    def write(self, value):
+        return value
+
+
+def encode(records, export_format="csv"):
+    """Yield the text of ``records`` in ``export_format``, row by row."""
+    if export_format == "csv":
+        writer = csv.writer(_Echo())
+        for row in csv_rows(records):
+            yield writer.writerow(row)
+    elif export_format == "jsonl":
+        encoder = DjangoJSONEncoder()
+        for record in json_records(records):
+            yield encoder.encode(record) + "\n"
+    else:
+        raise ValueError(f"Unknown export format {export_format!r}.")
+
+
+def stream(records, export_format="csv", compress=False):
+    """Yield UTF-8 bytes in pieces of about ``FLUSH_BYTES``.
+
+    With ``compress`` the pieces together form one gzip file.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    pending, size = [], 0
+    for text in encode(records, export_format):
+        data = text.encode()
+        pending.append(data)
+        size += len(data)
+        if size >= FLUSH_BYTES:
+            piece = b"".join(pending)
+            pending, size = [], 0
+            if compressor is not None:
+                piece = compressor.compress(piece)
+            if piece:
+                yield piece
+    piece = b"".join(pending)
+    if compressor is not None:
+        piece = compressor.compress(piece) + compressor.flush()
+    if piece:
+        yield piece
+
+
+def filename(first, last, export_format, compress=False, restaurant=None):
+    name = f"orders-{first}-{last}"
+    if restaurant is not None:
+        name += f"-restaurant-{restaurant}"
+    return f"{name}.{export_format}" + (".gz" if compress else "")
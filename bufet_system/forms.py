@@ -1,4 +1,5 @@
 from django import forms
+from django.conf import settings
 from bufet_system.models import Order, Restaurant
 
 
@@ -16,6 +17,7 @@ class OrderForm(forms.ModelForm):
 class AddToCartForm(forms.Form):
     quantity = forms.IntegerField(
         min_value=1,
+        max_value=settings.BUFET_CART_MAX_QUANTITY,
         initial=1,
         widget=forms.NumberInput(attrs={"class": "form-control"})
     )
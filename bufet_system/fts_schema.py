@@ -0,0 +1,72 @@
+"""Schema of the SQLite FTS5 index of dishes, shared with migrations.
+
+Migrations 0012 and 0013 run these statements, so they must keep doing
+what they did when those migrations were written. Do not edit them, and
+do not import models here. A later change to the index belongs in new
+statements used by a new migration.
+"""
+
+FTS_TABLE = "bufet_system_dish_fts"
+DISH_TABLE = "bufet_system_dish"
+
+# An external-content FTS5 table: it stores only the index and reads the
+# text from bufet_system_dish, which the triggers keep it in step with.
+FTS_CREATE = (
+    "CREATE VIRTUAL TABLE bufet_system_dish_fts USING fts5("
+    "name, ingredients, content='bufet_system_dish', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')"
+)
+FTS_TRIGGERS = {
+    "bufet_system_dish_fts_insert":
+        "CREATE TRIGGER bufet_system_dish_fts_insert "
+        "AFTER INSERT ON bufet_system_dish BEGIN "
+        "INSERT INTO bufet_system_dish_fts(rowid, name, ingredients) "
+        "VALUES (new.id, new.name, new.ingredients); END",
+    "bufet_system_dish_fts_delete":
+        "CREATE TRIGGER bufet_system_dish_fts_delete "
+        "AFTER DELETE ON bufet_system_dish BEGIN "
+        "INSERT INTO bufet_system_dish_fts"
+        "(bufet_system_dish_fts, rowid, name, ingredients) "
+        "VALUES ('delete', old.id, old.name, old.ingredients); END",
+    "bufet_system_dish_fts_update":
+        "CREATE TRIGGER bufet_system_dish_fts_update "
+        "AFTER UPDATE ON bufet_system_dish BEGIN "
+        "INSERT INTO bufet_system_dish_fts"
+        "(bufet_system_dish_fts, rowid, name, ingredients) "
+        "VALUES ('delete', old.id, old.name, old.ingredients); "
+        "INSERT INTO bufet_system_dish_fts(rowid, name, ingredients) "
+        "VALUES (new.id, new.name, new.ingredients); END",
+}
+
+
+def has_fts(connection):
+    return FTS_TABLE in connection.introspection.table_names()
+
+
+def fts_triggers(connection):
+    """Names of the ``FTS_TRIGGERS`` present in ``connection``'s database."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master "
+                       "WHERE type = 'trigger' AND tbl_name = %s",
+                       [DISH_TABLE])
+        return {name for name, in cursor.fetchall()} & set(FTS_TRIGGERS)
+
+
+def create_fts_triggers(schema_editor):
+    for name, statement in FTS_TRIGGERS.items():
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        schema_editor.execute(statement)
+
+
+def restore_fts_triggers(apps, schema_editor):
+    """``RunPython`` function recreating the FTS triggers on SQLite.
+
+    Schema changes SQLite cannot make in place, such as adding a NOT NULL
+    column, copy the dish table into a new one and drop the old one with
+    its triggers. The FTS table survives and still matches the rows,
+    which keep their ids. Run this after any such change to the dish
+    table; it does nothing on other databases or without FTS5.
+    """
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite" and has_fts(connection):
+        create_fts_triggers(schema_editor)
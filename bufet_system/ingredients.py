@@ -0,0 +1,186 @@
+"""Ingredients parsed out of ``Dish.ingredients``, and menu filters on them.
+
+A dish's ingredient text is split on commas into lower-cased names. Each
+name is an ``Ingredient`` row linked to the dish through
+``Dish.ingredient_set``. ``Dish.allergens`` holds the OR of its
+ingredients' allergen masks, so "free of" filters are a bitwise test on
+the dish row with no join at all. Filters by ingredient are ``EXISTS``
+semi-joins on the link table, which is indexed on both of its columns.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+
+from bufet_system.models import Dish, Ingredient
+
+# Allergens given to ingredients when they are first seen; staff can
+# correct them in the admin.
+KNOWN_ALLERGENS = {
+    "flour": ("gluten",),
+    "bread": ("gluten",),
+    "semolina": ("gluten",),
+    "pasta": ("gluten",),
+    "noodles": ("gluten", "eggs"),
+    "milk": ("milk",),
+    "butter": ("milk",),
+    "cream": ("milk",),
+    "sour cream": ("milk",),
+    "cheese": ("milk",),
+    "cottage cheese": ("milk",),
+    "kefir": ("milk",),
+    "eggs": ("eggs",),
+    "mayonnaise": ("eggs", "mustard"),
+    "walnuts": ("nuts",),
+    "hazelnuts": ("nuts",),
+    "almonds": ("nuts",),
+    "peanuts": ("peanuts",),
+    "fish": ("fish",),
+    "herring": ("fish",),
+    "salmon": ("fish",),
+    "shrimp": ("crustaceans",),
+    "mussels": ("molluscs",),
+    "soy sauce": ("soy", "gluten"),
+    "celery": ("celery",),
+    "mustard": ("mustard",),
+    "sesame": ("sesame",),
+}
+# Dish ids per UPDATE, well under SQLite's bound parameter limit.
+UPDATE_BATCH = 500
+
+DishIngredient = Dish.ingredient_set.through
+
+
+def parse(text):
+    """Distinct lower-cased ingredient names in ``text``, in order."""
+    length = Ingredient._meta.get_field("name").max_length
+    names = (" ".join(part.split()).lower()[:length]
+             for part in text.split(","))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def allergen_mask(names):
+    """The bitmask of allergen ``names``."""
+    mask = 0
+    for name in names:
+        if name not in Ingredient.ALLERGENS:
+            raise ValueError(f"Unknown allergen {name!r}.")
+        mask |= 1 << Ingredient.ALLERGENS.index(name)
+    return mask
+
+
+def allergen_names(mask):
+    """The allergen names set in ``mask``."""
+    return [name for bit, name in enumerate(Ingredient.ALLERGENS)
+            if mask >> bit & 1]
+
+
+def get_or_create(names):
+    """``{name: (pk, allergens)}`` for ``names``, creating missing ones."""
+    def read(names):
+        return {name: (pk, allergens) for name, pk, allergens
+                in Ingredient.objects.filter(name__in=names)
+                .values_list("name", "pk", "allergens")}
+
+    found = read(names)
+    missing = [name for name in names if name not in found]
+    if missing:
+        # Conflicts are rows created concurrently; read them back below.
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=name,
+                        allergens=allergen_mask(KNOWN_ALLERGENS.get(name,
+                                                                    ())))
+             for name in missing],
+            ignore_conflicts=True)
+        found.update(read(missing))
+    return found
+
+
+def link_dishes(dishes):
+    """Set the ingredient links and allergen masks of saved ``dishes``.
+
+    Only dishes whose links or mask differ from what their text says are
+    written, in a handful of queries for the whole list.
+    """
+    parsed = {dish.pk: parse(dish.ingredients) for dish in dishes}
+    known = get_or_create({name for names in parsed.values()
+                           for name in names})
+    current = defaultdict(set)
+    for dish_id, ingredient_id in (DishIngredient.objects
+                                   .filter(dish_id__in=parsed)
+                                   .values_list("dish_id", "ingredient_id")):
+        current[dish_id].add(ingredient_id)
+
+    relinked, links, masks = [], [], {}
+    for dish in dishes:
+        wanted = {known[name][0] for name in parsed[dish.pk]}
+        mask = 0
+        for name in parsed[dish.pk]:
+            mask |= known[name][1]
+        if wanted != current[dish.pk]:
+            relinked.append(dish.pk)
+            links.extend(DishIngredient(dish_id=dish.pk, ingredient_id=pk)
+                         for pk in wanted)
+        if mask != dish.allergens:
+            dish.allergens = masks[dish.pk] = mask
+    with transaction.atomic():
+        if relinked:
+            DishIngredient.objects.filter(dish_id__in=relinked).delete()
+            DishIngredient.objects.bulk_create(links)
+        set_masks(masks)
+
+
+def set_masks(masks):
+    """Write ``{dish_id: allergens}``, one UPDATE per distinct mask.
+
+    There are far fewer distinct masks than dishes, so this beats a
+    per-row ``bulk_update``.
+    """
+    by_mask = defaultdict(list)
+    for dish_id, mask in masks.items():
+        by_mask[mask].append(dish_id)
+    for mask, dish_ids in by_mask.items():
+        for start in range(0, len(dish_ids), UPDATE_BATCH):
+            (Dish.objects
+             .filter(pk__in=dish_ids[start:start + UPDATE_BATCH])
+             .exclude(allergens=mask)
+             .update(allergens=mask))
+
+
+def refresh_allergens(dish_ids):
+    """Recompute ``Dish.allergens`` of the dishes with ``dish_ids``."""
+    dish_ids = list(dish_ids)
+    masks = dict.fromkeys(dish_ids, 0)
+    for start in range(0, len(dish_ids), UPDATE_BATCH):
+        batch = dish_ids[start:start + UPDATE_BATCH]
+        for dish_id, mask in (DishIngredient.objects
+                              .filter(dish_id__in=batch)
+                              .values_list("dish_id",
+                                           "ingredient__allergens")):
+            masks[dish_id] |= mask
+    with transaction.atomic():
+        set_masks(masks)
+
+
+def filter_dishes(queryset, include=(), exclude=(), free_of=()):
+    """Dishes of ``queryset`` with every ingredient named in ``include``,
+    none named in ``exclude`` and none of the allergens in ``free_of``.
+    """
+    ids = {}
+    if include or exclude:
+        ids = dict(Ingredient.objects.filter(name__in=[*include, *exclude])
+                   .values_list("name", "pk"))
+    for name in include:
+        if name not in ids:
+            return queryset.none()
+        queryset = queryset.filter(Exists(DishIngredient.objects.filter(
+            dish_id=OuterRef("pk"), ingredient_id=ids[name])))
+    excluded = [ids[name] for name in exclude if name in ids]
+    if excluded:
+        queryset = queryset.exclude(Exists(DishIngredient.objects.filter(
+            dish_id=OuterRef("pk"), ingredient_id__in=excluded)))
+    mask = allergen_mask(free_of)
+    if mask:
+        queryset = (queryset.alias(flagged=F("allergens").bitand(mask))
+                    .filter(flagged=0))
+    return queryset
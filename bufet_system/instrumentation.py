@@ -0,0 +1,171 @@
+"""In-process request metrics for the performance middleware.
+
+Each worker process keeps rolling windows of the most recent samples per
+view, so memory stays bounded and the numbers describe current traffic
+rather than everything since start-up. Workers do not share their
+windows; the staff endpoint reports the worker that served it.
+
+Per-request SQL is observed with ``collect``. Every connection passes
+its queries to the collectors of the current context (see ``install``).
+Context variables follow ``sync_to_async`` into worker threads, so this
+also sees queries that async views run on other threads' connections.
+``connection.execute_wrapper`` would only see those of the thread that
+installed it.
+"""
+import contextvars
+import functools
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+METRICS = ("wall_ms", "sql_ms", "sql_queries", "template_ms",
+           "response_bytes")
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of ``samples`` (``fraction`` in 0..1)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+
+_collectors = contextvars.ContextVar("bufet_sql_collectors", default=())
+
+
+def _dispatch(execute, sql, params, many, context):
+    for collector in reversed(_collectors.get()):
+        execute = functools.partial(collector, execute)
+    return execute(sql, params, many, context)
+
+
+def install(connection):
+    """Route ``connection``'s queries through the ``collect`` collectors.
+
+    Called for every new connection. The dispatcher goes first in the
+    list, so ``execute_wrapper`` blocks, which pop the last wrapper on
+    exit, never remove it.
+    """
+    if _dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _dispatch)
+
+
+@contextmanager
+def collect(collector):
+    """Pass every query run in this context, on any thread, to
+    ``collector``, an ``execute_wrapper``-style callable.
+    """
+    token = _collectors.set((*_collectors.get(), collector))
+    try:
+        yield collector
+    finally:
+        _collectors.reset(token)
+
+
+class SQLTimer:
+    """``collect`` callable timing executed queries.
+
+    Async views may run queries on several threads at once, hence the
+    lock.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.duration += elapsed
+                self.count += 1
+
+
+class RollingWindow:
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self.total = 0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.total += 1
+
+    def summary(self, buckets=None):
+        samples = list(self.samples)
+        summary = {
+            "count": self.total,
+            "window": len(samples),
+            "mean": sum(samples) / len(samples) if samples else 0.0,
+            "p50": percentile(samples, 0.50),
+            "p95": percentile(samples, 0.95),
+            "p99": percentile(samples, 0.99),
+            "max": max(samples, default=0.0),
+        }
+        if buckets:
+            histogram = {f"le_{bound}": 0 for bound in buckets}
+            histogram["inf"] = 0
+            for value in samples:
+                for bound in buckets:
+                    if value <= bound:
+                        histogram[f"le_{bound}"] += 1
+                        break
+                else:
+                    histogram["inf"] += 1
+            summary["histogram"] = histogram
+        return summary
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, label, sample):
+        size = settings.BUFET_PERF_WINDOW
+        with self._lock:
+            windows = self._views.get(label)
+            if windows is None:
+                windows = {metric: RollingWindow(size) for metric in METRICS}
+                self._views[label] = windows
+            for metric in METRICS:
+                value = sample.get(metric)
+                if value is not None:
+                    windows[metric].add(value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                label: {
+                    metric: window.summary(
+                        BUCKETS_MS if metric == "wall_ms" else None)
+                    for metric, window in windows.items()
+                }
+                for label, windows in sorted(self._views.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+registry = Registry()
+
+
+def server_timing(sample):
+    """``Server-Timing`` header value for one request's sample."""
+    parts = [f'db;dur={sample["sql_ms"]:.1f};'
+             f'desc="{sample["sql_queries"]} queries"']
+    if sample.get("template_ms") is not None:
+        parts.append(f'tpl;dur={sample["template_ms"]:.1f}')
+    parts.append(f'total;dur={sample["wall_ms"]:.1f}')
+    return ", ".join(parts)
@@ -0,0 +1,44 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bufet_system import analytics
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the daily restaurant and dish rollups from orders, "
+            "a few days per transaction.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=date.fromisoformat,
+                            help="First day (YYYY-MM-DD); defaults to the "
+                                 "day of the oldest order.")
+        parser.add_argument("--end", type=date.fromisoformat,
+                            help="Last day (YYYY-MM-DD); defaults to the "
+                                 "day of the newest order.")
+        parser.add_argument("--chunk-days", type=int, default=7,
+                            help="Days rebuilt per transaction.")
+
+    def handle(self, *args, **options):
+        if options["chunk_days"] < 1:
+            raise CommandError("--chunk-days must be positive.")
+        days = analytics.order_days()
+        if days is None and not (options["start"] and options["end"]):
+            self.stdout.write("No orders to aggregate.")
+            return
+        first = options["start"] or days[0]
+        last = options["end"] or days[1]
+        if first > last:
+            raise CommandError("--start must not be after --end.")
+
+        def progress(chunk_start, chunk_end):
+            if options["verbosity"] > 1:
+                self.stdout.write(f"  {chunk_start} .. {chunk_end}")
+
+        started = time.perf_counter()
+        analytics.backfill(first, last, chunk_days=options["chunk_days"],
+                           progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt rollups from {first} to {last} in "
+            f"{time.perf_counter() - started:.1f}s."))
@@ -0,0 +1,168 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment
+
+from bufet_system import benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Run a benchmark scenario against a throwaway copy of the "
+            "configured database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenario", choices=["index", "flow", "asgi",
+                                                 "auth"])
+        parser.add_argument(
+            "--sizes",
+            default="0,10000,100000",
+            help="Comma separated table sizes to measure at (index).",
+        )
+        parser.add_argument("--iterations", type=int, default=None,
+                            help="Requests per size (index, default 200) "
+                                 "or visits per customer (flow, asgi, "
+                                 "auth, default 20).")
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--dishes", type=int, default=100)
+        parser.add_argument("--restaurants", type=int, default=10)
+        parser.add_argument("--orders", type=int, default=10000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--mode", choices=["client", "wsgi"],
+                            default="client")
+        parser.add_argument("--threads", type=int, default=4,
+                            help="Concurrent customers (flow in wsgi "
+                                 "mode, asgi).")
+        parser.add_argument("--baseline",
+                            help="JSON file with a previous flow run to "
+                                 "compare against.")
+        parser.add_argument("--save-baseline", action="store_true",
+                            help="Write this run to --baseline instead of "
+                                 "comparing.")
+        parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="Allowed latency/throughput drift as a "
+                                 "fraction of the baseline.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        if options["scenario"] == "index":
+            sizes = [int(size) for size in options["sizes"].split(",")]
+            with benchmarks.benchmark_database():
+                rows = benchmarks.index_scenario(
+                    sizes, options["iterations"] or 200)
+            self.report_index(rows)
+            return
+
+        if options["scenario"] == "asgi":
+            with benchmarks.benchmark_database(on_disk=True):
+                rows = benchmarks.asgi_scenario(
+                    users=options["users"],
+                    dishes=options["dishes"],
+                    restaurants=options["restaurants"],
+                    orders=options["orders"],
+                    seed=options["seed"],
+                    threads=options["threads"],
+                    iterations=options["iterations"] or 20,
+                )
+            self.report_asgi(rows)
+            return
+
+        if options["scenario"] == "auth":
+            with benchmarks.benchmark_database():
+                rows = benchmarks.auth_scenario(
+                    users=options["users"],
+                    dishes=options["dishes"],
+                    restaurants=options["restaurants"],
+                    orders=options["orders"],
+                    seed=options["seed"],
+                    iterations=options["iterations"] or 20,
+                )
+            self.report_auth(rows)
+            return
+
+        if options["save_baseline"] and not options["baseline"]:
+            raise CommandError("--save-baseline needs --baseline PATH.")
+        with benchmarks.benchmark_database(
+                on_disk=options["mode"] == "wsgi"):
+            result = benchmarks.flow_scenario(
+                users=options["users"],
+                dishes=options["dishes"],
+                restaurants=options["restaurants"],
+                orders=options["orders"],
+                seed=options["seed"],
+                mode=options["mode"],
+                threads=options["threads"],
+                iterations=options["iterations"] or 20,
+            )
+        self.report_flow(result)
+        if options["baseline"]:
+            self.check_baseline(result, options)
+
+    def report_index(self, rows):
+        self.stdout.write(f"{'orders':>10} {'view p50':>10} "
+                          f"{'view p95':>10} {'queries':>8} "
+                          f"{'COUNT(*) p50':>13}")
+        for row in rows:
+            view, counts = row["view"], row["count_star"]
+            self.stdout.write(
+                f"{row['orders']:>10} {view['p50_ms']:>8.2f}ms "
+                f"{view['p95_ms']:>8.2f}ms {view['queries']:>8.1f} "
+                f"{counts['p50_ms']:>11.2f}ms"
+            )
+
+    def report_asgi(self, rows):
+        self.stdout.write(f"{'server':<8} {'views':<6} {'req/s':>8} "
+                          f"{'p50':>10} {'p95':>10} {'p99':>10} "
+                          f"{'errors':>6}")
+        for row in rows:
+            self.stdout.write(
+                f"{row['server']:<8} {row['views']:<6} {row['rps']:>8.1f} "
+                f"{row['p50_ms']:>8.2f}ms {row['p95_ms']:>8.2f}ms "
+                f"{row['p99_ms']:>8.2f}ms {row['errors']:>6}"
+            )
+
+    def report_auth(self, rows):
+        self.stdout.write(f"{'sessions':<8} {'page':<30} {'p50':>10} "
+                          f"{'p95':>10} {'queries':>8} {'session':>8} "
+                          f"{'user':>8} {'errors':>6}")
+        for row in rows:
+            self.stdout.write(
+                f"{row['config']:<8} {row['page']:<30} "
+                f"{row['p50_ms']:>8.2f}ms {row['p95_ms']:>8.2f}ms "
+                f"{row['queries']:>8.1f} {row['session_queries']:>8.1f} "
+                f"{row['user_queries']:>8.1f} {row['errors']:>6}"
+            )
+
+    def report_flow(self, result):
+        self.stdout.write(
+            f"{result['mode']} mode, {result['threads']} thread(s): "
+            f"{result['overall']['requests']} requests in "
+            f"{result['seconds']:.2f}s, {result['rps']:.1f} req/s, "
+            f"{result['errors']} errors")
+        self.stdout.write(f"{'view':<28} {'requests':>8} {'p50':>10} "
+                          f"{'p95':>10} {'p99':>10} {'queries':>8}")
+        for label, row in [*result["views"].items(),
+                           ("overall", result["overall"])]:
+            self.stdout.write(
+                f"{label:<28} {row['requests']:>8} {row['p50_ms']:>8.2f}ms "
+                f"{row['p95_ms']:>8.2f}ms {row['p99_ms']:>8.2f}ms "
+                f"{row['queries']:>8.1f}"
+            )
+
+    def check_baseline(self, result, options):
+        path = options["baseline"]
+        if options["save_baseline"]:
+            with open(path, "w") as baseline_file:
+                json.dump(result, baseline_file, indent=2, sort_keys=True)
+            self.stdout.write(f"Baseline written to {path}.")
+            return
+        try:
+            with open(path) as baseline_file:
+                baseline = json.load(baseline_file)
+        except (OSError, ValueError) as error:
+            raise CommandError(f"Cannot read baseline {path}: {error}")
+        problems = benchmarks.compare_to_baseline(result, baseline,
+                                                  options["tolerance"])
+        if problems:
+            raise CommandError("Regressed against the baseline:\n  "
+                               + "\n  ".join(problems))
+        self.stdout.write(self.style.SUCCESS("Within the baseline."))
@@ -0,0 +1,71 @@
+import json
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from bufet_system import reports
+
+
+class Command(BaseCommand):
+    help = ("Report revenue per restaurant and dish, hourly demand and "
+            "order value percentiles, streaming the order lines.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=date.fromisoformat,
+                            help="First day (YYYY-MM-DD); defaults to 30 "
+                                 "days before --end.")
+        parser.add_argument("--end", type=date.fromisoformat,
+                            help="Last day (YYYY-MM-DD); defaults to "
+                                 "today.")
+        parser.add_argument("--chunk-size", type=int,
+                            default=settings.BUFET_REPORT_CHUNK_SIZE,
+                            help="Order lines fetched per chunk.")
+        parser.add_argument("--top", type=int, default=10,
+                            help="How many dishes to list.")
+        parser.add_argument("--json", action="store_true",
+                            help="Print the full report as JSON.")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive.")
+        last = options["end"] or timezone.localdate()
+        first = options["start"] or last - timedelta(days=29)
+        if first > last:
+            raise CommandError("--start must not be after --end.")
+
+        report = reports.build(first, last,
+                               chunk_size=options["chunk_size"],
+                               top_dishes=options["top"])
+        if options["json"]:
+            self.stdout.write(json.dumps(report, cls=DjangoJSONEncoder,
+                                         indent=2))
+            return
+
+        value = report["order_value"]
+        self.stdout.write(
+            f"{first} .. {last}: {report['orders']} orders, "
+            f"{report['units']} units, revenue {report['revenue']}")
+        if report["orders"]:
+            self.stdout.write(
+                "Order value: mean {mean}, p50 {p50}, p90 {p90}, "
+                "p95 {p95}, p99 {p99}, max {max}".format(**value))
+        self.stdout.write("\nRestaurants:")
+        for row in report["restaurants"]:
+            self.stdout.write(
+                f"  {row['address'] or '(deleted)':<30} "
+                f"{row['orders']:>8} orders {row['revenue']:>12} "
+                f"peak {row['peak_hour']:02d}:00")
+        self.stdout.write("\nTop dishes:")
+        for row in report["dishes"]:
+            self.stdout.write(
+                f"  {row['name'] or '(deleted)':<30} "
+                f"{row['units']:>8} units {row['revenue']:>12} "
+                f"{row['share']:>7.1%}")
+        self.stdout.write("\nOrders per hour:")
+        peak = max(report["hourly_orders"]) or 1
+        for hour, orders in enumerate(report["hourly_orders"]):
+            self.stdout.write(f"  {hour:02d}:00 {orders:>8} "
+                              f"{'#' * round(40 * orders / peak)}")
@@ -0,0 +1,66 @@
+import io
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from bufet_system import analytics, exports
+
+
+class Command(BaseCommand):
+    help = ("Stream orders with their lines, user and restaurant as CSV or "
+            "JSONL, with constant memory use.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=date.fromisoformat,
+                            help="First day (YYYY-MM-DD); defaults to the "
+                                 "day of the oldest order.")
+        parser.add_argument("--end", type=date.fromisoformat,
+                            help="Last day (YYYY-MM-DD); defaults to the "
+                                 "day of the newest order.")
+        parser.add_argument("--restaurant", type=int,
+                            help="Only orders of this restaurant id.")
+        parser.add_argument("--format", choices=sorted(exports.FORMATS),
+                            default="csv")
+        parser.add_argument("--gzip", action="store_true",
+                            help="Compress the output with gzip.")
+        parser.add_argument("--chunk-size", type=int,
+                            default=settings.BUFET_EXPORT_CHUNK_SIZE,
+                            help="Orders fetched per chunk.")
+        parser.add_argument("--output", "-o", default="-",
+                            help="File to write; '-' (default) is stdout.")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive.")
+        days = analytics.order_days()
+        if days is None and not (options["start"] and options["end"]):
+            days = (timezone.localdate(), timezone.localdate())
+        first = options["start"] or days[0]
+        last = options["end"] or days[1]
+        if first > last:
+            raise CommandError("--start must not be after --end.")
+
+        records = exports.records(first, last,
+                                  restaurant=options["restaurant"],
+                                  chunk_size=options["chunk_size"])
+        pieces = exports.stream(records, options["format"],
+                                compress=options["gzip"])
+        if options["output"] == "-":
+            stdout = getattr(self.stdout._out, "buffer", self.stdout._out)
+            if isinstance(stdout, io.TextIOBase):
+                # A text-only stream such as StringIO: plain output is
+                # UTF-8 text, gzip has no text form.
+                if options["gzip"]:
+                    raise CommandError("--gzip needs a binary stdout; "
+                                       "use --output.")
+                pieces = (piece.decode() for piece in pieces)
+            for piece in pieces:
+                stdout.write(piece)
+            stdout.flush()
+            return
+        with open(options["output"], "wb") as output:
+            for piece in pieces:
+                output.write(piece)
+        self.stderr.write(f"Wrote {options['output']}.")
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from bufet_system.models import ProductCart
+
+
+class Command(BaseCommand):
+    help = ("Recompute the stored line count, item count and total "
+            "of product carts from their lines.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--drafts-only",
+            action="store_true",
+            help="Only repair carts that are still in draft status.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of cart ids updated per statement.",
+        )
+
+    def handle(self, *args, **options):
+        carts = ProductCart.objects.all()
+        if options["drafts_only"]:
+            carts = carts.filter(status=ProductCart.STATUS_DRAFT)
+
+        bounds = carts.aggregate(low=Min("pk"), high=Max("pk"))
+        if bounds["low"] is None:
+            self.stdout.write("No product carts to repair.")
+            return
+
+        batch_size = options["batch_size"]
+        updated = 0
+        for start in range(bounds["low"], bounds["high"] + 1, batch_size):
+            updated += carts.filter(
+                pk__gte=start, pk__lt=start + batch_size
+            ).recompute_summaries()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Recomputed summaries for {updated} product carts."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from bufet_system import stats
+
+
+class Command(BaseCommand):
+    help = ("Recount the landing page counters from their tables. "
+            "Run periodically to repair drift from bulk imports.")
+
+    def handle(self, *args, **options):
+        stats.refresh_counters()
+        for name, value in sorted(stats.get_site_stats().items()):
+            self.stdout.write(f"{name}: {value}")
@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from bufet_system import seeding
+
+
+class Command(BaseCommand):
+    help = ("Add deterministic synthetic users, dishes, restaurants and "
+            "orders for scale testing.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--dishes", type=int, default=500)
+        parser.add_argument("--restaurants", type=int, default=50)
+        parser.add_argument("--orders", type=int, default=100000)
+        parser.add_argument("--seed", type=int, default=0,
+                            help="Random seed; equal seeds give equal data.")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Rows generated and written per statement.",
+        )
+        copy = parser.add_mutually_exclusive_group()
+        copy.add_argument("--copy", dest="use_copy", action="store_true",
+                          default=None,
+                          help="Load orders with COPY (PostgreSQL only; "
+                               "the default there).")
+        copy.add_argument("--no-copy", dest="use_copy",
+                          action="store_false",
+                          help="Load orders with bulk_create.")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive.")
+        if options["use_copy"] and connection.vendor != "postgresql":
+            raise CommandError("--copy needs a PostgreSQL database.")
+
+        def progress(done):
+            if options["verbosity"] > 1:
+                self.stdout.write(f"  {done} / {options['orders']} orders")
+
+        started = time.perf_counter()
+        try:
+            seeding.seed(users=options["users"],
+                         dishes=options["dishes"],
+                         restaurants=options["restaurants"],
+                         orders=options["orders"],
+                         seed=options["seed"],
+                         batch_size=options["batch_size"],
+                         use_copy=options["use_copy"],
+                         progress=progress)
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {options['users']} users, {options['dishes']} dishes, "
+            f"{options['restaurants']} restaurants and {options['orders']} "
+            f"orders in {time.perf_counter() - started:.1f}s."))
@@ -0,0 +1,198 @@
+import logging
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from bufet_system import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+def view_label(request):
+    """``app_name:url_name`` of the resolved view, e.g. ``bufet_system:menu``.
+
+    Uses the application namespace rather than the instance namespace the
+    URLconf was included under, so labels match ``reverse()`` names.
+    """
+    match = getattr(request, "resolver_match", None)
+    if match is None or not match.url_name:
+        return None
+    if match.app_name:
+        return f"{match.app_name}:{match.url_name}"
+    return match.url_name
+
+
+class QueryCounter:
+    """``instrumentation.collect`` callable counting executed queries."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+class HybridMiddleware:
+    """Base for middleware that runs in the mode of the chain it wraps.
+
+    Under ASGI the chain is async and ``__call__`` returns the
+    ``__acall__`` coroutine, so Django does not push async views into a
+    worker thread on this middleware's account. Subclasses implement both.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryBudgetMiddleware(HybridMiddleware):
+    """Flag views that run more SQL queries than their budget allows.
+
+    Budgets come from ``BUFET_QUERY_BUDGETS`` (keyed by ``view_label``)
+    with ``BUFET_QUERY_BUDGET_DEFAULT`` as the fallback. With
+    ``BUFET_QUERY_BUDGET_MODE = "log"`` an overrun is logged as a
+    warning; with ``"raise"`` it raises ``QueryBudgetExceeded`` so tests
+    fail; any other value disables the check.
+    """
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if settings.BUFET_QUERY_BUDGET_MODE not in ("log", "raise"):
+            return self.get_response(request)
+        with instrumentation.collect(QueryCounter()) as counter:
+            response = self.get_response(request)
+        self.check(request, counter.count)
+        return response
+
+    async def __acall__(self, request):
+        if settings.BUFET_QUERY_BUDGET_MODE not in ("log", "raise"):
+            return await self.get_response(request)
+        with instrumentation.collect(QueryCounter()) as counter:
+            response = await self.get_response(request)
+        self.check(request, counter.count)
+        return response
+
+    def check(self, request, count):
+        label = view_label(request)
+        budget = settings.BUFET_QUERY_BUDGETS.get(
+            label, settings.BUFET_QUERY_BUDGET_DEFAULT)
+        if count > budget:
+            message = (f"{label or request.path} ran {count} "
+                       f"queries, over its budget of {budget}")
+            if settings.BUFET_QUERY_BUDGET_MODE == "raise":
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+
+class PerformanceMiddleware(HybridMiddleware):
+    """Record wall, SQL and template time per view for a sample of requests.
+
+    ``BUFET_PERF_SAMPLE_RATE`` (0..1) picks the share of requests that are
+    measured. Measured requests feed the rolling windows served by the
+    staff stats endpoint. Their responses carry a ``Server-Timing`` header
+    for staff, or for everyone with ``DEBUG`` or
+    ``BUFET_SERVER_TIMING_PUBLIC``, since query counts and timings help
+    whoever probes the site.
+    """
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.sampled(request):
+            return self.get_response(request)
+        started = time.perf_counter()
+        with instrumentation.collect(instrumentation.SQLTimer()) as timer:
+            response = self.get_response(request)
+        sample = self.record(request, response, started, timer)
+        user = getattr(request, "user", None)
+        if self.public() or (user is not None and user.is_staff):
+            response["Server-Timing"] = instrumentation.server_timing(sample)
+        return response
+
+    async def __acall__(self, request):
+        if not self.sampled(request):
+            return await self.get_response(request)
+        started = time.perf_counter()
+        with instrumentation.collect(instrumentation.SQLTimer()) as timer:
+            response = await self.get_response(request)
+        sample = self.record(request, response, started, timer)
+        if self.public() or (hasattr(request, "auser")
+                             and (await request.auser()).is_staff):
+            response["Server-Timing"] = instrumentation.server_timing(sample)
+        return response
+
+    def sampled(self, request):
+        rate = settings.BUFET_PERF_SAMPLE_RATE
+        if rate <= 0 or random.random() >= rate:
+            return False
+        request._perf_template_ms = None
+        return True
+
+    def record(self, request, response, started, timer):
+        sample = {
+            "wall_ms": (time.perf_counter() - started) * 1000,
+            "sql_ms": timer.duration * 1000,
+            "sql_queries": timer.count,
+            "template_ms": request._perf_template_ms,
+            "response_bytes": (None if response.streaming
+                               else len(response.content)),
+        }
+        instrumentation.registry.record(
+            view_label(request) or "unresolved", sample)
+        return sample
+
+    def public(self):
+        return settings.DEBUG or settings.BUFET_SERVER_TIMING_PUBLIC
+
+    def process_template_response(self, request, response):
+        if not hasattr(request, "_perf_template_ms"):
+            return response
+        started = time.perf_counter()
+
+        def rendered(response):
+            request._perf_template_ms = (
+                (time.perf_counter() - started) * 1000)
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+class GuestCartMiddleware(HybridMiddleware):
+    """Store the guest cart cookie when a view changed the guest cart."""
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.store(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.store(request, await self.get_response(request))
+
+    def store(self, request, response):
+        cart = getattr(request, "_guest_cart", None)
+        if cart is None or not cart.changed:
+            return response
+        name = settings.BUFET_GUEST_CART_COOKIE
+        if cart.quantities:
+            response.set_cookie(name, cart.dumps(),
+                                max_age=settings.BUFET_GUEST_CART_MAX_AGE,
+                                secure=settings.SESSION_COOKIE_SECURE,
+                                httponly=True,
+                                samesite="Lax")
+        else:
+            response.delete_cookie(name, samesite="Lax")
+        return response
@@ -0,0 +1,72 @@
+# Generated by Django 5.0.2 on 2026-10-18 09:28
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_cart_summaries(apps, schema_editor):
+    ProductCart = apps.get_model("bufet_system", "ProductCart")
+    ProductCartItem = apps.get_model("bufet_system", "ProductCartItem")
+    lines = (ProductCartItem.objects
+             .filter(cart=OuterRef("pk"))
+             .order_by()
+             .values("cart"))
+    money = models.DecimalField(max_digits=12, decimal_places=2)
+    ProductCart.objects.update(
+        lines_count=Coalesce(
+            Subquery(lines.annotate(n=Count("pk")).values("n"),
+                     output_field=models.IntegerField()),
+            0),
+        items_count=Coalesce(
+            Subquery(lines.annotate(n=Sum("quantity")).values("n"),
+                     output_field=models.IntegerField()),
+            0),
+        total_price=Coalesce(
+            Subquery(lines.annotate(
+                t=Sum(F("item__price") * F("quantity"),
+                      output_field=money)).values("t"),
+                     output_field=money),
+            Value(Decimal("0.00")),
+            output_field=money),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bufet_system', '0002_rename_dish_productcartitem_item'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productcart',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='productcart',
+            name='lines_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='productcart',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='restaurant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order', to='bufet_system.restaurant'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_cart_summaries,
+                             migrations.RunPython.noop),
+    ]
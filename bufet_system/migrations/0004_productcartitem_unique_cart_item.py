@@ -0,0 +1,39 @@
+# Generated by Django 5.0.2 on 2026-10-18 09:30
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    """Fold duplicate (cart, item) lines into the oldest one."""
+    ProductCartItem = apps.get_model("bufet_system", "ProductCartItem")
+    duplicates = (ProductCartItem.objects
+                  .values("cart_id", "item_id")
+                  .annotate(lines=Count("id"),
+                            keep_id=Min("id"),
+                            quantity=Sum("quantity"))
+                  .filter(lines__gt=1)
+                  .order_by())
+    for duplicate in duplicates.iterator():
+        ProductCartItem.objects.filter(pk=duplicate["keep_id"]).update(
+            quantity=duplicate["quantity"])
+        ProductCartItem.objects.filter(
+            cart_id=duplicate["cart_id"],
+            item_id=duplicate["item_id"],
+        ).exclude(pk=duplicate["keep_id"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bufet_system', '0003_productcart_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productcartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'item'), name='unique_cart_item'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.0.2 on 2026-10-18 09:31
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min, Sum
+
+
+def merge_duplicate_drafts(apps, schema_editor):
+    """Fold every user's extra draft carts into their oldest draft."""
+    ProductCart = apps.get_model("bufet_system", "ProductCart")
+    ProductCartItem = apps.get_model("bufet_system", "ProductCartItem")
+    duplicates = (ProductCart.objects
+                  .filter(status="draft")
+                  .values("user_id")
+                  .annotate(carts=Count("id"), keep_id=Min("id"))
+                  .filter(carts__gt=1)
+                  .order_by())
+    for duplicate in duplicates.iterator():
+        extra_carts = ProductCart.objects.filter(
+            user_id=duplicate["user_id"], status="draft",
+        ).exclude(pk=duplicate["keep_id"])
+        kept_items = dict(ProductCartItem.objects
+                          .filter(cart_id=duplicate["keep_id"])
+                          .values_list("item_id", "id"))
+        for line in ProductCartItem.objects.filter(cart__in=extra_carts):
+            if line.item_id in kept_items:
+                ProductCartItem.objects.filter(
+                    pk=kept_items[line.item_id]
+                ).update(quantity=F("quantity") + line.quantity)
+            else:
+                kept_items[line.item_id] = ProductCartItem.objects.create(
+                    cart_id=duplicate["keep_id"],
+                    item_id=line.item_id,
+                    quantity=line.quantity,
+                ).pk
+        extra_carts.delete()
+
+        lines = ProductCartItem.objects.filter(cart_id=duplicate["keep_id"])
+        summary = lines.aggregate(
+            lines_count=Count("id"),
+            items_count=Sum("quantity"),
+            total_price=Sum(F("item__price") * F("quantity"),
+                            output_field=models.DecimalField(
+                                max_digits=12, decimal_places=2)),
+        )
+        ProductCart.objects.filter(pk=duplicate["keep_id"]).update(
+            lines_count=summary["lines_count"],
+            items_count=summary["items_count"] or 0,
+            total_price=summary["total_price"] or 0,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bufet_system', '0004_productcartitem_unique_cart_item'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_drafts,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productcart',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'draft')), fields=('user',), name='unique_draft_cart_per_user'),
+        ),
+    ]
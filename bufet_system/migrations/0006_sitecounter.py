@@ -0,0 +1,39 @@
+# Generated by Django 5.0.2 on 2026-10-18 09:32
+
+from django.db import migrations, models
+
+
+def seed_counters(apps, schema_editor):
+    SiteCounter = apps.get_model("bufet_system", "SiteCounter")
+    counted = {
+        "restaurants": apps.get_model("bufet_system", "Restaurant"),
+        "orders": apps.get_model("bufet_system", "Order"),
+        "users": apps.get_model("bufet_system", "User"),
+    }
+    SiteCounter.objects.bulk_create([
+        SiteCounter(name=name, value=model.objects.count())
+        for name, model in counted.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bufet_system', '0005_unique_draft_cart_per_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SiteCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ('name',),
+            },
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
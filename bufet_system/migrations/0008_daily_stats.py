@@ -0,0 +1,59 @@
+# Generated by Django 5.0.2 on 2026-10-18 09:59
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bufet_system', '0007_order_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyDishStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('orders_count', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('dish', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='bufet_system.dish')),
+            ],
+            options={
+                'verbose_name_plural': 'daily dish stats',
+                'ordering': ('day',),
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyRestaurantStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('orders_count', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('restaurant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='bufet_system.restaurant')),
+            ],
+            options={
+                'verbose_name_plural': 'daily restaurant stats',
+                'ordering': ('day',),
+                'abstract': False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailydishstats',
+            constraint=models.UniqueConstraint(fields=('day', 'dish'), name='unique_dish_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyrestaurantstats',
+            constraint=models.UniqueConstraint(fields=('day', 'restaurant'), name='unique_restaurant_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyrestaurantstats',
+            constraint=models.UniqueConstraint(condition=models.Q(('restaurant', None)), fields=('day',), name='unique_no_restaurant_day'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bufet_system', '0008_daily_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productcartitem',
+            name='dish_name',
+            field=models.CharField(blank=True, default='', max_length=150),
+        ),
+        migrations.AddField(
+            model_name='productcartitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10,
+                                      null=True),
+        ),
+    ]
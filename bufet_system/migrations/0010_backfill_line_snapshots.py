@@ -0,0 +1,45 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:20
+
+from django.db import migrations, transaction
+from django.db.models import Max, Min, OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def copy_dish_snapshots(apps, schema_editor):
+    """Copy each line's current dish price and name onto the line.
+
+    Works through primary key ranges of ``BATCH_SIZE`` lines, committing
+    each one, so large tables are not locked in one long transaction.
+    Older prices are not recorded anywhere, so existing orders get the
+    price their dishes have now.
+    """
+    Dish = apps.get_model("bufet_system", "Dish")
+    ProductCartItem = apps.get_model("bufet_system", "ProductCartItem")
+    db_alias = schema_editor.connection.alias
+    lines = ProductCartItem.objects.using(db_alias)
+    bounds = lines.aggregate(first=Min("pk"), last=Max("pk"))
+    if bounds["first"] is None:
+        return
+    dish = Dish.objects.using(db_alias).filter(pk=OuterRef("item_id"))
+    for start in range(bounds["first"], bounds["last"] + 1, BATCH_SIZE):
+        with transaction.atomic(using=db_alias):
+            lines.filter(pk__gte=start,
+                         pk__lt=start + BATCH_SIZE,
+                         unit_price__isnull=True).update(
+                unit_price=Subquery(dish.values("price")[:1]),
+                dish_name=Subquery(dish.values("name")[:1]),
+            )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('bufet_system', '0009_productcartitem_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_dish_snapshots,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bufet_system', '0010_backfill_line_snapshots'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productcartitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+    ]
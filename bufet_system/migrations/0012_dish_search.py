@@ -0,0 +1,81 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:55
+
+from django.db import DatabaseError, migrations, transaction
+
+from bufet_system import fts_schema
+
+# Must match bufet_system.search.DOCUMENT for the index to be used.
+DOCUMENT = ("setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(ingredients, '')), "
+            "'B')")
+
+POSTGRESQL_FORWARD = [
+    f"CREATE INDEX IF NOT EXISTS dish_search_idx "
+    f"ON bufet_system_dish USING gin (({DOCUMENT}))",
+]
+POSTGRESQL_TRIGRAM = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS dish_name_trgm_idx "
+    "ON bufet_system_dish USING gin (name gin_trgm_ops)",
+]
+POSTGRESQL_BACKWARD = [
+    "DROP INDEX IF EXISTS dish_name_trgm_idx",
+    "DROP INDEX IF EXISTS dish_search_idx",
+]
+
+# The FTS5 table and its triggers are defined in bufet_system.fts_schema,
+# which later migrations that rebuild the dish table reuse.
+SQLITE_FORWARD = [
+    fts_schema.FTS_CREATE,
+    *fts_schema.FTS_TRIGGERS.values(),
+    "INSERT INTO bufet_system_dish_fts(bufet_system_dish_fts) "
+    "VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    *(f"DROP TRIGGER IF EXISTS {name}" for name in fts_schema.FTS_TRIGGERS),
+    "DROP TABLE IF EXISTS bufet_system_dish_fts",
+]
+
+
+def execute(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        execute(schema_editor, POSTGRESQL_FORWARD)
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                execute(schema_editor, POSTGRESQL_TRIGRAM)
+        except DatabaseError:
+            # pg_trgm is not available to this role; search then works
+            # without typo matching.
+            pass
+    elif vendor == "sqlite":
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                execute(schema_editor, SQLITE_FORWARD)
+        except DatabaseError:
+            # SQLite built without FTS5; search falls back to scans.
+            pass
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        execute(schema_editor, POSTGRESQL_BACKWARD)
+    elif vendor == "sqlite":
+        execute(schema_editor, SQLITE_BACKWARD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bufet_system', '0011_productcartitem_unit_price_required'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
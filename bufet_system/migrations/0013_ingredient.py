@@ -0,0 +1,41 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:21
+
+from django.db import migrations, models
+
+from bufet_system.fts_schema import restore_fts_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bufet_system', '0012_dish_search'),
+    ]
+
+    operations = [
+        # On the way back, removing ``allergens`` rebuilds the table again.
+        migrations.RunPython(migrations.RunPython.noop,
+                             restore_fts_triggers),
+        migrations.CreateModel(
+            name='Ingredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('allergens', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('name',),
+            },
+        ),
+        migrations.AddField(
+            model_name='dish',
+            name='allergens',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(restore_fts_triggers,
+                             migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='dish',
+            name='ingredient_set',
+            field=models.ManyToManyField(blank=True, related_name='dishes', to='bufet_system.ingredient'),
+        ),
+    ]
@@ -0,0 +1,117 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:21
+
+from collections import defaultdict
+
+from django.db import migrations, transaction
+from django.db.models import Max, Min
+
+BATCH_SIZE = 2000
+
+# Frozen copies of Ingredient.ALLERGENS and
+# bufet_system.ingredients.KNOWN_ALLERGENS as of this migration.
+ALLERGENS = ("gluten", "crustaceans", "eggs", "fish", "peanuts", "soy",
+             "milk", "nuts", "celery", "mustard", "sesame", "sulphites",
+             "lupin", "molluscs")
+KNOWN_ALLERGENS = {
+    "flour": ("gluten",),
+    "bread": ("gluten",),
+    "semolina": ("gluten",),
+    "pasta": ("gluten",),
+    "noodles": ("gluten", "eggs"),
+    "milk": ("milk",),
+    "butter": ("milk",),
+    "cream": ("milk",),
+    "sour cream": ("milk",),
+    "cheese": ("milk",),
+    "cottage cheese": ("milk",),
+    "kefir": ("milk",),
+    "eggs": ("eggs",),
+    "mayonnaise": ("eggs", "mustard"),
+    "walnuts": ("nuts",),
+    "hazelnuts": ("nuts",),
+    "almonds": ("nuts",),
+    "peanuts": ("peanuts",),
+    "fish": ("fish",),
+    "herring": ("fish",),
+    "salmon": ("fish",),
+    "shrimp": ("crustaceans",),
+    "mussels": ("molluscs",),
+    "soy sauce": ("soy", "gluten"),
+    "celery": ("celery",),
+    "mustard": ("mustard",),
+    "sesame": ("sesame",),
+}
+
+
+def parse(text):
+    names = (" ".join(part.split()).lower()[:100] for part in text.split(","))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def mask_of(name):
+    mask = 0
+    for allergen in KNOWN_ALLERGENS.get(name, ()):
+        mask |= 1 << ALLERGENS.index(allergen)
+    return mask
+
+
+def split_ingredients(apps, schema_editor):
+    """Link every dish to the ingredients named in its text.
+
+    Works through primary key ranges of ``BATCH_SIZE`` dishes, committing
+    each one. New ingredients get the allergens of ``KNOWN_ALLERGENS``,
+    and each dish the OR of its ingredients' masks.
+    """
+    Dish = apps.get_model("bufet_system", "Dish")
+    Ingredient = apps.get_model("bufet_system", "Ingredient")
+    DishIngredient = Dish.ingredient_set.through
+    db_alias = schema_editor.connection.alias
+    dishes = Dish.objects.using(db_alias)
+    ingredients = Ingredient.objects.using(db_alias)
+    bounds = dishes.aggregate(first=Min("pk"), last=Max("pk"))
+    if bounds["first"] is None:
+        return
+    known = {name: (pk, allergens) for name, pk, allergens
+             in ingredients.values_list("name", "pk", "allergens")}
+    for start in range(bounds["first"], bounds["last"] + 1, BATCH_SIZE):
+        with transaction.atomic(using=db_alias):
+            parsed = {pk: parse(text) for pk, text in
+                      dishes.filter(pk__gte=start,
+                                    pk__lt=start + BATCH_SIZE)
+                      .values_list("pk", "ingredients")}
+            missing = {name for names in parsed.values()
+                       for name in names if name not in known}
+            if missing:
+                ingredients.bulk_create(
+                    [Ingredient(name=name, allergens=mask_of(name))
+                     for name in sorted(missing)],
+                    ignore_conflicts=True)
+                known.update(
+                    (name, (pk, allergens)) for name, pk, allergens
+                    in ingredients.filter(name__in=missing)
+                    .values_list("name", "pk", "allergens"))
+            DishIngredient.objects.using(db_alias).bulk_create(
+                [DishIngredient(dish_id=dish, ingredient_id=known[name][0])
+                 for dish, names in parsed.items() for name in names],
+                ignore_conflicts=True)
+            by_mask = defaultdict(list)
+            for dish, names in parsed.items():
+                mask = 0
+                for name in names:
+                    mask |= known[name][1]
+                by_mask[mask].append(dish)
+            for mask, dish_ids in by_mask.items():
+                if mask:
+                    dishes.filter(pk__in=dish_ids).update(allergens=mask)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('bufet_system', '0013_ingredient'),
+    ]
+
+    operations = [
+        migrations.RunPython(split_ingredients, migrations.RunPython.noop),
+    ]
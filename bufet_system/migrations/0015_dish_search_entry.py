@@ -0,0 +1,24 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bufet_system', '0014_split_dish_ingredients'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DishSearchEntry',
+            fields=[
+                ('dish', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='bufet_system.dish')),
+            ],
+            options={
+                'db_table': 'bufet_system_dish_fts',
+                'managed': False,
+            },
+        ),
+    ]
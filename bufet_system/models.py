@@ -1,5 +1,18 @@
+from decimal import Decimal
+
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import (Case,
+                              Count,
+                              ExpressionWrapper,
+                              F,
+                              OuterRef,
+                              Q,
+                              Subquery,
+                              Sum,
+                              Value,
+                              When)
+from django.db.models.functions import Coalesce
 
 
 class User(AbstractUser):
@@ -8,12 +21,42 @@ class User(AbstractUser):
     def __str__(self):
         return f"{self.username} ({self.first_name} {self.last_name})"
 
+    def get_session_auth_hash(self):
+        # Users restored by CachedModelBackend carry the hash instead of
+        # the password it is derived from.
+        cached = getattr(self, "_session_auth_hash", None)
+        if cached is not None and "password" in self.get_deferred_fields():
+            return cached
+        return super().get_session_auth_hash()
+
+
+class Ingredient(models.Model):
+    # Bit i of an allergens mask stands for ALLERGENS[i]; only ever append.
+    ALLERGENS = ("gluten", "crustaceans", "eggs", "fish", "peanuts", "soy",
+                 "milk", "nuts", "celery", "mustard", "sesame", "sulphites",
+                 "lupin", "molluscs")
+
+    name = models.CharField(max_length=100, unique=True)
+    allergens = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ("name",)
+
+    def __str__(self):
+        return self.name
+
 
 class Dish(models.Model):
     name = models.CharField(max_length=150)
+    # The text shown on the menu. It is parsed into ``ingredient_set`` and
+    # ``allergens`` (the OR of the ingredients' masks) on every save; see
+    # bufet_system.ingredients.
     ingredients = models.CharField(max_length=255)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     weight = models.DecimalField(max_digits=5, decimal_places=2)
+    ingredient_set = models.ManyToManyField(Ingredient, blank=True,
+                                            related_name="dishes")
+    allergens = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ("name",)
@@ -23,6 +66,22 @@ class Dish(models.Model):
         return f"{self.name}: {self.price} uah ({self.weight} g)"
 
 
+class DishSearchEntry(models.Model):
+    """A row of the SQLite FTS5 table ``bufet_system_dish_fts``.
+
+    Only there so that search can join the table; see
+    bufet_system.search. The table is created by migration 0012 on SQLite
+    only and never queried directly.
+    """
+    dish = models.OneToOneField(Dish, on_delete=models.DO_NOTHING,
+                                primary_key=True, db_column="rowid",
+                                related_name="search_entry")
+
+    class Meta:
+        managed = False
+        db_table = "bufet_system_dish_fts"
+
+
 class Restaurant(models.Model):
     address = models.TextField()
 
@@ -33,10 +92,110 @@ class Restaurant(models.Model):
         return f"Restaurant: {self.address}"
 
 
+class ProductCartItemQuerySet(models.QuerySet):
+    def with_details(self):
+        """Lines annotated with dish name, unit price and line subtotal.
+
+        Everything a cart or checkout table shows, read from the line
+        table alone.
+        """
+        return self.annotate(
+            name=F("dish_name"),
+            price=F("unit_price"),
+            subtotal=ExpressionWrapper(
+                F("unit_price") * F("quantity"),
+                output_field=models.DecimalField(max_digits=12,
+                                                 decimal_places=2)),
+        ).order_by("dish_name", "pk")
+
+    def total(self):
+        """Sum of price * quantity over the lines, in a single query."""
+        total = self.aggregate(
+            total=Sum(F("unit_price") * F("quantity"),
+                      output_field=models.DecimalField(max_digits=12,
+                                                       decimal_places=2))
+        )["total"]
+        if total is None:
+            return Decimal("0.00")
+        return total.quantize(Decimal("0.01"))
+
+
 class ProductCartItem(models.Model):
     cart = models.ForeignKey("ProductCart", on_delete=models.CASCADE)
     item = models.ForeignKey(Dish, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    # The dish's price and name when the line was written. Draft lines
+    # follow later dish edits (see signals); completed ones keep them, so
+    # order totals and history never need to join Dish.
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    dish_name = models.CharField(max_length=150, blank=True, default="")
+
+    objects = ProductCartItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["cart", "item"],
+                                    name="unique_cart_item"),
+        ]
+
+    @classmethod
+    def for_dish(cls, dish, **fields):
+        """An unsaved line for ``dish`` with its price and name copied."""
+        return cls(item_id=dish.pk, unit_price=dish.price,
+                   dish_name=dish.name, **fields)
+
+    def save(self, *args, **kwargs):
+        if self.unit_price is None or not self.dish_name:
+            if self.unit_price is None:
+                self.unit_price = self.item.price
+            self.dish_name = self.dish_name or self.item.name
+        super().save(*args, **kwargs)
+
+
+class ProductCartQuerySet(models.QuerySet):
+    def draft_for(self, user):
+        """The user's draft cart, or None if there is none yet."""
+        return self.filter(user=user, status=ProductCart.STATUS_DRAFT).first()
+
+    def get_or_create_draft(self, user):
+        """The user's draft cart, created on first use.
+
+        The partial unique index on (user) for drafts makes concurrent
+        callers end up with the same cart: the loser of the insert race
+        re-reads the winner's row.
+        """
+        cart, _ = self.get_or_create(user=user,
+                                     status=ProductCart.STATUS_DRAFT)
+        return cart
+
+    def recompute_summaries(self):
+        """Rebuild the stored line/item counts and totals from the lines.
+
+        Runs as one UPDATE statement over the queryset, so it can be used
+        to repair carts in bulk.
+        """
+        lines = (ProductCartItem.objects
+                 .filter(cart=OuterRef("pk"))
+                 .order_by()
+                 .values("cart"))
+        money = models.DecimalField(max_digits=12, decimal_places=2)
+        return self.update(
+            lines_count=Coalesce(
+                Subquery(lines.annotate(n=Count("pk")).values("n"),
+                         output_field=models.IntegerField()),
+                0),
+            items_count=Coalesce(
+                Subquery(lines.annotate(n=Sum("quantity")).values("n"),
+                         output_field=models.IntegerField()),
+                0),
+            total_price=Coalesce(
+                Subquery(lines.annotate(
+                    t=Sum(F("unit_price") * F("quantity"),
+                          output_field=money)).values("t"),
+                         output_field=money),
+                Value(Decimal("0.00")),
+                output_field=money),
+        )
 
 
 class ProductCart(models.Model):
@@ -54,6 +213,20 @@ class ProductCart(models.Model):
     items = models.ManyToManyField(Dish,
                                    through=ProductCartItem,
                                    related_name="dishes")
+    lines_count = models.PositiveIntegerField(default=0)
+    items_count = models.PositiveIntegerField(default=0)
+    total_price = models.DecimalField(max_digits=12,
+                                      decimal_places=2,
+                                      default=Decimal("0.00"))
+
+    objects = ProductCartQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user"],
+                                    condition=Q(status="draft"),
+                                    name="unique_draft_cart_per_user"),
+        ]
 
     def __str__(self):
         return f"product cart: {self.id}"
@@ -69,37 +242,211 @@ class ProductCart(models.Model):
         )
         self.order = order
         self.status = self.STATUS_COMPLETED
-        self.save()
+        self.save(update_fields=["status"])
+
+    def get_lines(self):
+        return self.productcartitem_set.with_details()
 
     def get_cart_total(self):
-        return sum(
-            [item.item.price *
-             item.quantity for item
-             in self.productcartitem_set.all()]
+        """Authoritative total, recomputed from the cart lines."""
+        return self.productcartitem_set.total()
+
+    def _apply_summary_delta(self, lines, items, amount):
+        """Shift the stored summary in the database and on this instance.
+
+        Uses F-expressions so concurrent mutations of the same cart add up
+        instead of overwriting each other. Must be called inside the
+        transaction that changed the lines.
+        """
+        amount = Decimal(str(amount)).quantize(Decimal("0.01"))
+        updated = ProductCart.objects.filter(
+            pk=self.pk,
+            lines_count__gte=-lines,
+            items_count__gte=-items,
+        ).update(
+            lines_count=F("lines_count") + lines,
+            items_count=F("items_count") + items,
+            total_price=F("total_price") + amount,
         )
+        if updated:
+            self.lines_count += lines
+            self.items_count += items
+            self.total_price += amount
+        else:
+            # The stored summary drifted (lines written behind the cart's
+            # back), so rebuild it from the lines instead of going negative.
+            ProductCart.objects.filter(pk=self.pk).recompute_summaries()
+            self.refresh_from_db(fields=["lines_count",
+                                         "items_count",
+                                         "total_price"])
+
+    def _insert_line(self, item, quantity):
+        """Insert a new line, returning False if one already exists.
+
+        Any other integrity error is re-raised.
+        """
+        try:
+            with transaction.atomic():
+                ProductCartItem.for_dish(item, cart=self,
+                                         quantity=quantity).save()
+        except IntegrityError:
+            if not self.productcartitem_set.filter(item_id=item.pk).exists():
+                raise
+            return False
+        return True
+
+    def _insert_lines(self, quantities):
+        """Bulk insert new lines, returning False if any already exists.
+
+        ``quantities`` maps dishes to quantities. Any other integrity
+        error is re-raised.
+        """
+        try:
+            with transaction.atomic():
+                ProductCartItem.objects.bulk_create([
+                    ProductCartItem.for_dish(dish, cart=self,
+                                             quantity=quantity)
+                    for dish, quantity in quantities.items()
+                ])
+        except IntegrityError:
+            if not self.productcartitem_set.filter(
+                    item_id__in=[dish.pk for dish in quantities]).exists():
+                raise
+            return False
+        return True
+
+    @staticmethod
+    def _check_quantity(quantity):
+        if quantity < 1:
+            raise ValueError(f"Quantity must be at least 1, not {quantity}.")
 
     def add_product(self, item, quantity=1):
-        existing_item, created = (
-            self.productcartitem_set.get_or_create(item=item))
-        if not created:
-            existing_item.quantity += quantity
-            existing_item.save()
+        self._check_quantity(quantity)
+        with transaction.atomic():
+            lines = self.productcartitem_set.filter(item_id=item.pk)
+            created = False
+            # UPDATE ... SET quantity = quantity + n; only insert when no
+            # line exists, and fall back to the UPDATE if a concurrent
+            # request inserted it first.
+            if not lines.update(quantity=F("quantity") + quantity):
+                created = self._insert_line(item, quantity)
+                if not created:
+                    lines.update(quantity=F("quantity") + quantity)
+            self._apply_summary_delta(int(created),
+                                      quantity,
+                                      item.price * quantity)
 
     def remove_product(self, item, quantity=1):
-        existing_item, created = (
-            self.productcartitem_set.get_or_create(item=item))
-        if not created:
-            existing_item.quantity -= quantity
-            if existing_item.quantity <= 0:
-                existing_item.delete()
+        self._check_quantity(quantity)
+        with transaction.atomic():
+            lines = self.productcartitem_set.filter(item_id=item.pk)
+            if lines.filter(quantity__gt=quantity).update(
+                    quantity=F("quantity") - quantity):
+                self._apply_summary_delta(0,
+                                          -quantity,
+                                          -item.price * quantity)
+                return
+            current = (lines.select_for_update()
+                       .values_list("quantity", flat=True)
+                       .first())
+            if current is None:
+                return
+            if current > quantity:
+                lines.update(quantity=F("quantity") - quantity)
+                self._apply_summary_delta(0,
+                                          -quantity,
+                                          -item.price * quantity)
             else:
-                existing_item.save()
+                lines.delete()
+                self._apply_summary_delta(-1,
+                                          -current,
+                                          -item.price * current)
 
     def update_quantity(self, item, quantity):
-        cart_item, created = self.productcartitem_set.get_or_create(item=item)
-        if not created:
-            cart_item.quantity = quantity
-            cart_item.save()
+        with transaction.atomic():
+            lines = self.productcartitem_set.filter(item_id=item.pk)
+            current = (lines.select_for_update()
+                       .values_list("quantity", flat=True)
+                       .first())
+            if current is None:
+                if quantity <= 0:
+                    return
+                if self._insert_line(item, quantity):
+                    self._apply_summary_delta(1,
+                                              quantity,
+                                              item.price * quantity)
+                    return
+                current = (lines.select_for_update()
+                           .values_list("quantity", flat=True)
+                           .get())
+            if quantity <= 0:
+                lines.delete()
+                self._apply_summary_delta(-1,
+                                          -current,
+                                          -item.price * current)
+            elif quantity != current:
+                delta = quantity - current
+                lines.update(quantity=quantity)
+                self._apply_summary_delta(0, delta, item.price * delta)
+
+    def set_quantities(self, quantities, add=False):
+        """Set the quantity of several dishes at once.
+
+        ``quantities`` maps dishes to their new quantity; zero or less
+        removes the line. With ``add`` the quantities are added to those
+        already in the cart instead. The affected lines are read once,
+        then deleted, updated and inserted with one statement each, and
+        the summary is shifted once for the whole batch.
+        """
+        if not quantities:
+            return
+        dishes = {dish.pk: dish for dish in quantities}
+        wanted = {dish.pk: quantity for dish, quantity in quantities.items()}
+        with transaction.atomic():
+            lines = self.productcartitem_set.filter(item_id__in=wanted)
+            current = dict(lines.select_for_update()
+                           .values_list("item_id", "quantity"))
+            if add:
+                wanted = {pk: current.get(pk, 0) + quantity
+                          for pk, quantity in wanted.items()}
+            removed = [pk for pk, quantity in wanted.items()
+                       if quantity <= 0 and pk in current]
+            changed = {pk: quantity for pk, quantity in wanted.items()
+                       if quantity > 0 and pk in current
+                       and current[pk] != quantity}
+            added = {pk: quantity for pk, quantity in wanted.items()
+                     if quantity > 0 and pk not in current}
+
+            lines_delta = -len(removed)
+            items_delta = 0
+            amount = Decimal("0")
+            if removed:
+                lines.filter(item_id__in=removed).delete()
+                for pk in removed:
+                    items_delta -= current[pk]
+                    amount -= dishes[pk].price * current[pk]
+            if changed:
+                lines.filter(item_id__in=changed).update(quantity=Case(
+                    *[When(item_id=pk, then=Value(quantity))
+                      for pk, quantity in changed.items()],
+                    output_field=models.PositiveIntegerField(),
+                ))
+                for pk, quantity in changed.items():
+                    items_delta += quantity - current[pk]
+                    amount += dishes[pk].price * (quantity - current[pk])
+            if added and not self._insert_lines(
+                    {dishes[pk]: quantity for pk, quantity in added.items()}):
+                # A concurrent request inserted one of the lines first;
+                # fall back to the per-line path, which handles that.
+                for pk, quantity in added.items():
+                    self.update_quantity(dishes[pk], quantity)
+                added = {}
+            lines_delta += len(added)
+            for pk, quantity in added.items():
+                items_delta += quantity
+                amount += dishes[pk].price * quantity
+            if lines_delta or items_delta or amount:
+                self._apply_summary_delta(lines_delta, items_delta, amount)
 
 
 class Order(models.Model):
@@ -121,6 +468,12 @@ class Order(models.Model):
 
     class Meta:
         ordering = ("created_at",)
+        indexes = [
+            models.Index(fields=["user", "created_at", "id"],
+                         name="order_user_created_idx"),
+            models.Index(fields=["created_at", "id"],
+                         name="order_created_idx"),
+        ]
 
     def __str__(self):
         return (f"Id: {self.id}, {self.product_cart}, "
@@ -131,8 +484,74 @@ class Order(models.Model):
         return self.product_cart.items.all()
 
     def get_cart_total(self):
-        return sum(
-            [item.item.price *
-             item.quantity for item
-             in self.product_cart.productcartitem_set.all()]
-        )
+        return ProductCartItem.objects.filter(
+            cart_id=self.product_cart_id
+        ).total()
+
+
+class SiteCounter(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ("name",)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class DailyStats(models.Model):
+    """Orders, units sold and revenue for one day and one subject."""
+    day = models.DateField()
+    orders_count = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14,
+                                  decimal_places=2,
+                                  default=Decimal("0.00"))
+
+    class Meta:
+        abstract = True
+        ordering = ("day",)
+
+
+class DailyRestaurantStats(DailyStats):
+    # Orders keep a deleted restaurant as NULL; its rollup rows are
+    # dropped instead, since merging them into the NULL row would need a
+    # recount (backfill_analytics does that).
+    restaurant = models.ForeignKey(Restaurant,
+                                   on_delete=models.CASCADE,
+                                   null=True,
+                                   blank=True,
+                                   related_name="daily_stats")
+
+    class Meta(DailyStats.Meta):
+        verbose_name_plural = "daily restaurant stats"
+        constraints = [
+            models.UniqueConstraint(fields=["day", "restaurant"],
+                                    name="unique_restaurant_day"),
+            # NULLs are distinct in unique constraints, so orders without
+            # a restaurant need their own one row per day rule.
+            models.UniqueConstraint(fields=["day"],
+                                    condition=Q(restaurant=None),
+                                    name="unique_no_restaurant_day"),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.restaurant}: {self.revenue}"
+
+
+class DailyDishStats(DailyStats):
+    dish = models.ForeignKey(Dish,
+                             on_delete=models.CASCADE,
+                             related_name="daily_stats")
+
+    class Meta(DailyStats.Meta):
+        verbose_name_plural = "daily dish stats"
+        constraints = [
+            models.UniqueConstraint(fields=["day", "dish"],
+                                    name="unique_dish_day"),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.dish.name}: {self.units}"
@@ -0,0 +1,186 @@
+"""Paginators for tables that grow without bound, such as orders.
+
+``CursorPaginator`` walks a queryset by its ordering key instead of an
+OFFSET, so the cost of a page does not depend on how deep it is, and it
+only runs COUNT(*) when asked to. ``EstimatedCountPaginator`` keeps the
+numbered interface the admin needs but uses the planner's row estimate
+for large PostgreSQL results.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    is_cursor_page = True
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f"<Cursor page of {len(self.object_list)} objects>"
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Keyset paginator ordered by ``ordering`` (ascending, unique)."""
+
+    def __init__(self, queryset, per_page, ordering=("created_at", "id"),
+                 with_count=False):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.with_count = with_count
+
+    @cached_property
+    def count(self):
+        """Total number of objects, or None when counting is disabled."""
+        if not self.with_count:
+            return None
+        return self.queryset.count()
+
+    def _key(self, obj):
+        return [str(getattr(obj, field)) for field in self.ordering]
+
+    def encode_cursor(self, direction, obj):
+        payload = json.dumps({"d": direction, "k": self._key(obj)})
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            direction, raw_key = payload["d"], payload["k"]
+            model = self.queryset.model
+            key = [model._meta.get_field(field).to_python(value)
+                   for field, value in zip(self.ordering, raw_key,
+                                           strict=True)]
+        except (ValueError, KeyError, TypeError, ValidationError) as error:
+            raise InvalidCursor(cursor) from error
+        if direction not in ("next", "prev"):
+            raise InvalidCursor(cursor)
+        return direction, key
+
+    def _after(self, key, reverse=False):
+        """Rows strictly after (or before) ``key`` in keyset order.
+
+        The leading ``>=`` on the first column lets the database turn the
+        OR into a single index range scan.
+        """
+        lookup = "lt" if reverse else "gt"
+        first = self.ordering[0]
+        condition = Q()
+        for depth in range(len(self.ordering) - 1, -1, -1):
+            equal = {field: value for field, value
+                     in zip(self.ordering[:depth], key[:depth])}
+            step = Q(**equal, **{f"{self.ordering[depth]}__{lookup}":
+                                 key[depth]})
+            condition = step | condition
+        bound = {f"{first}__{lookup[0]}te": key[0]}
+        return self.queryset.filter(Q(**bound), condition)
+
+    def page(self, cursor=None):
+        forward = list(self.ordering)
+        backward = [f"-{field}" for field in self.ordering]
+        if not cursor:
+            direction = "next"
+            rows = list(self.queryset.order_by(*forward)[:self.per_page + 1])
+        else:
+            direction, key = self.decode_cursor(cursor)
+            if direction == "next":
+                rows = list(self._after(key)
+                            .order_by(*forward)[:self.per_page + 1])
+            else:
+                rows = list(self._after(key, reverse=True)
+                            .order_by(*backward)[:self.per_page + 1])
+
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == "prev":
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(cursor)
+
+        next_cursor = (self.encode_cursor("next", rows[-1])
+                       if has_next and rows else None)
+        previous_cursor = (self.encode_cursor("prev", rows[0])
+                           if has_previous and rows else None)
+        return CursorPage(rows, self, next_cursor, previous_cursor)
+
+
+class CursorPaginationMixin:
+    """Drop-in replacement for ListView's OFFSET pagination."""
+    cursor_kwarg = "cursor"
+    cursor_ordering = ("created_at", "id")
+    paginate_with_count = False
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = CursorPaginator(queryset,
+                                    page_size,
+                                    ordering=self.cursor_ordering,
+                                    with_count=self.paginate_with_count)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404("Invalid page cursor.")
+        return paginator, page, page.object_list, page.has_other_pages()
+
+
+class EstimatedCountPaginator(Paginator):
+    """Numbered paginator that avoids exact COUNT(*) on huge results.
+
+    On PostgreSQL the planner's row estimate is used once it exceeds
+    ``exact_count_limit``; smaller results and other databases are
+    counted exactly.
+    """
+    exact_count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql":
+            estimate = self._planner_estimate(queryset, connection)
+            if estimate > self.exact_count_limit:
+                return estimate
+        return super().count
+
+    @staticmethod
+    def _planner_estimate(queryset, connection):
+        sql, params = queryset.order_by().values("pk").query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
@@ -0,0 +1,221 @@
+"""A small thread-safe pool of database connections.
+
+The pool knows nothing about Django or a particular driver: it is given
+a ``connect`` callable and, optionally, ``check`` (is this connection
+still usable?) and ``close`` callables. Each worker process keeps its own
+pools; a pool noticed in a forked child is replaced rather than shared.
+
+Django 5.0 has no pool of its own. ``CONN_MAX_AGE`` keeps one connection
+per thread, so it must be off under ASGI, where sync code runs in fresh
+threads, and there every request would connect anew. ``CONN_HEALTH_CHECKS``
+only adds a ping before reuse. PgBouncer in transaction mode would do the
+same job, but it is one more service to run on the production node. Once
+the project moves to Django 5.1 or later, its psycopg pool can replace
+this one.
+"""
+import os
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _Slot:
+    __slots__ = ("connection", "created_at", "released_at")
+
+    def __init__(self, connection, now):
+        self.connection = connection
+        self.created_at = now
+        self.released_at = now
+
+
+class ConnectionPool:
+    """Hand out at most ``max_size`` connections, reusing idle ones.
+
+    ``acquire`` waits up to ``timeout`` seconds for a free connection and
+    then raises ``PoolTimeout``. Idle connections older than
+    ``max_lifetime`` or idle for longer than ``max_idle`` seconds are
+    closed instead of reused; ones idle for longer than ``check_after``
+    are passed to ``check`` first.
+    """
+
+    def __init__(self, connect, max_size, *, check=None, close=None,
+                 timeout=10.0, max_idle=300.0, max_lifetime=3600.0,
+                 check_after=30.0, clock=time.monotonic):
+        if max_size < 1:
+            raise ValueError("A pool needs room for at least one "
+                             "connection.")
+        self.connect = connect
+        self.max_size = max_size
+        self.check = check
+        self.close_connection = close or (lambda connection:
+                                          connection.close())
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self.clock = clock
+        self.pid = os.getpid()
+        self._lock = threading.Condition()
+        self._idle = []
+        self._in_use = {}
+        self._size = 0
+        self._stats = dict.fromkeys(
+            ("checkouts", "waits", "timeouts", "created", "reused",
+             "discarded", "failed_checks", "connect_errors"), 0)
+        self._wait_seconds = 0.0
+
+    def _expired(self, slot, now):
+        return (now - slot.created_at >= self.max_lifetime
+                or now - slot.released_at >= self.max_idle)
+
+    def _discard(self, slot):
+        with self._lock:
+            self._size -= 1
+            self._stats["discarded"] += 1
+            self._lock.notify()
+        try:
+            self.close_connection(slot.connection)
+        except Exception:
+            pass
+
+    def acquire(self):
+        """Return a connection, waiting for one to be released if needed."""
+        deadline = None
+        while True:
+            with self._lock:
+                slot = None
+                while slot is None:
+                    if self._idle:
+                        slot = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    now = self.clock()
+                    if deadline is None:
+                        deadline = now + self.timeout
+                        self._stats["waits"] += 1
+                    if now >= deadline:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"No database connection became free within "
+                            f"{self.timeout:g}s ({self.max_size} in use).")
+                    started = self.clock()
+                    self._lock.wait(deadline - now)
+                    self._wait_seconds += self.clock() - started
+
+            if slot is None:
+                return self._open()
+
+            now = self.clock()
+            if self._expired(slot, now):
+                self._discard(slot)
+                continue
+            if (self.check is not None
+                    and now - slot.released_at >= self.check_after
+                    and not self._usable(slot.connection)):
+                with self._lock:
+                    self._stats["failed_checks"] += 1
+                self._discard(slot)
+                continue
+            with self._lock:
+                self._stats["checkouts"] += 1
+                self._stats["reused"] += 1
+                self._in_use[id(slot.connection)] = slot
+            return slot.connection
+
+    def _usable(self, connection):
+        try:
+            return bool(self.check(connection))
+        except Exception:
+            return False
+
+    def _open(self):
+        try:
+            connection = self.connect()
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._stats["connect_errors"] += 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["created"] += 1
+            self._in_use[id(connection)] = _Slot(connection, self.clock())
+        return connection
+
+    def release(self, connection, discard=False):
+        """Give ``connection`` back; ``discard`` closes it instead."""
+        with self._lock:
+            slot = self._in_use.pop(id(connection), None)
+        if slot is None:
+            # Not ours (e.g. opened before a fork); just close it.
+            try:
+                self.close_connection(connection)
+            except Exception:
+                pass
+            return
+        if discard or self._expired(slot, self.clock()):
+            self._discard(slot)
+            return
+        slot.released_at = self.clock()
+        with self._lock:
+            self._idle.append(slot)
+            self._lock.notify()
+
+    def close(self):
+        """Close the idle connections; ones in use close on release."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self.max_lifetime = 0
+        for slot in idle:
+            try:
+                self.close_connection(slot.connection)
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                **self._stats,
+                "wait_ms": round(self._wait_seconds * 1000, 3),
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, factory):
+    """The pool for ``key`` in this process, created by ``factory()``."""
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.pid != os.getpid():
+            pool = _pools[key] = factory()
+        return pool
+
+
+def close_pools(match=lambda key: True):
+    """Close and forget the pools whose key satisfies ``match``."""
+    with _pools_lock:
+        keys = [key for key in _pools if match(key)]
+        pools = [_pools.pop(key) for key in keys]
+    for pool in pools:
+        pool.close()
+
+
+def snapshot():
+    """Stats of every pool in this process, keyed by a readable name."""
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {":".join(str(part) for part in key): pool.stats()
+            for key, pool in pools}
@@ -0,0 +1,281 @@
+"""Revenue and demand reports computed with NumPy over streamed order lines.
+
+``stream_lines`` reads the lines of orders placed in a date range with
+``values_list().iterator()`` and hands them over as NumPy arrays,
+``chunk_size`` rows at a time. ``DemandReport`` folds each chunk into
+accumulators with ``bincount`` and ``reduceat``. Restaurant and dish ids
+are first mapped to dense indexes, so the accumulators have one slot per
+restaurant and dish that appears in the range, however large the ids.
+Memory therefore depends on the chunk size and on the number of
+restaurants and dishes, not on how much order history is covered. Order value
+percentiles come from a histogram with logarithmic bins, so they are
+accurate to ``VALUE_PRECISION`` (1%) of the value whatever its size.
+"""
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+from django.utils import timezone
+
+from bufet_system.analytics import day_bounds
+from bufet_system.models import Dish, ProductCartItem, Restaurant
+from bufet_system.utils import batched
+
+HOURS = 24
+QUARTER_HOUR = 15 * 60
+VALUE_PRECISION = 0.01
+VALUE_STEP = np.log1p(VALUE_PRECISION)
+PERCENTILES = (50, 90, 95, 99)
+NO_RESTAURANT = -1
+
+LINE_FIELDS = ("cart_id", "cart__order__restaurant_id", "item_id",
+               "quantity", "unit_price", "cart__order__created_at")
+
+
+def local_hours(timestamps):
+    """Local hour of day for each POSIX timestamp.
+
+    Time zone offsets are whole quarter hours, so only one conversion per
+    distinct quarter hour in the chunk is needed.
+    """
+    quarters, inverse = np.unique(timestamps // QUARTER_HOUR,
+                                  return_inverse=True)
+    zone = timezone.get_current_timezone()
+    hours = np.array([datetime.fromtimestamp(quarter * QUARTER_HOUR,
+                                             zone).hour
+                      for quarter in quarters.tolist()], dtype=np.int64)
+    return hours[inverse]
+
+
+def stream_lines(first, last, chunk_size=10000):
+    """Yield the order lines of days ``first`` to ``last`` as arrays.
+
+    Each chunk is a dict of equally long arrays: ``cart``, ``restaurant``
+    (``NO_RESTAURANT`` for deleted ones), ``dish``, ``quantity``,
+    ``cents`` (line value) and ``hour``. Lines arrive ordered by cart, so
+    an order's lines are adjacent, though they may span two chunks.
+    """
+    start, end = day_bounds(first, last)
+    rows = (ProductCartItem.objects
+            .filter(cart__order__created_at__gte=start,
+                    cart__order__created_at__lt=end)
+            .order_by("cart_id", "item_id")
+            .values_list(*LINE_FIELDS)
+            .iterator(chunk_size=chunk_size))
+    for batch in batched(rows, chunk_size):
+        carts, restaurants, dishes, quantities, prices, created = zip(*batch)
+        quantity = np.array(quantities, dtype=np.int64)
+        price_cents = np.rint(np.array(prices, dtype=np.float64) * 100)
+        yield {
+            "cart": np.array(carts, dtype=np.int64),
+            "restaurant": np.array(
+                [NO_RESTAURANT if restaurant is None else restaurant
+                 for restaurant in restaurants], dtype=np.int64),
+            "dish": np.array(dishes, dtype=np.int64),
+            "quantity": quantity,
+            "cents": quantity * price_cents.astype(np.int64),
+            "hour": local_hours(np.array(
+                [moment.timestamp() for moment in created],
+                dtype=np.int64)),
+        }
+
+
+def _add(total, index, weights=None):
+    """``total`` plus ``bincount(index, weights)``, growing it as needed."""
+    counts = np.bincount(index, weights=weights, minlength=len(total))
+    if weights is not None:
+        counts = np.rint(counts).astype(np.int64)
+    if len(counts) > len(total):
+        total = np.pad(total, (0, len(counts) - len(total)))
+    total[:len(counts)] += counts
+    return total
+
+
+class DenseIndex:
+    """Consecutive indexes for ids, in order of first appearance."""
+
+    def __init__(self):
+        self.ids = []
+        self._slots = {}
+
+    def __call__(self, ids):
+        """The index of each of ``ids``, assigning new ones as needed."""
+        unique, inverse = np.unique(ids, return_inverse=True)
+        slots = np.empty(len(unique), dtype=np.int64)
+        for position, value in enumerate(unique.tolist()):
+            slot = self._slots.get(value)
+            if slot is None:
+                slot = self._slots[value] = len(self.ids)
+                self.ids.append(value)
+            slots[position] = slot
+        return slots[inverse]
+
+    def ranked(self, slots, keys):
+        """``slots`` by descending ``keys``, ties by ascending id."""
+        ids = np.array(self.ids, dtype=np.int64)[slots]
+        return slots[np.lexsort((ids, -keys[slots]))]
+
+
+def _money(cents):
+    return Decimal(int(cents)).scaleb(-2)
+
+
+class DemandReport:
+    """Accumulate revenue, units and order statistics chunk by chunk.
+
+    Per-restaurant and per-dish arrays are indexed by ``DenseIndex`` slot.
+    Orders of deleted restaurants share the slot of ``NO_RESTAURANT``.
+    """
+
+    def __init__(self):
+        self.restaurant_index = DenseIndex()
+        self.dish_index = DenseIndex()
+        empty = np.zeros(0, dtype=np.int64)
+        self.restaurant_orders = empty
+        self.restaurant_units = empty
+        self.restaurant_revenue = empty
+        self.restaurant_hours = empty
+        self.dish_lines = empty
+        self.dish_units = empty
+        self.dish_revenue = empty
+        self.hourly_orders = np.zeros(HOURS, dtype=np.int64)
+        self.hourly_units = np.zeros(HOURS, dtype=np.int64)
+        self.value_histogram = empty
+        self.max_value = 0
+        self.lines = 0
+        # The last order of a chunk may continue in the next one.
+        self._open = None
+
+    def add(self, chunk):
+        if not len(chunk["cart"]):
+            return
+        slot = self.restaurant_index(chunk["restaurant"])
+        dish = self.dish_index(chunk["dish"])
+        quantity, cents = chunk["quantity"], chunk["cents"]
+        self.lines += len(quantity)
+        self.restaurant_units = _add(self.restaurant_units, slot, quantity)
+        self.restaurant_revenue = _add(self.restaurant_revenue, slot, cents)
+        self.restaurant_hours = _add(self.restaurant_hours,
+                                     slot * HOURS + chunk["hour"], quantity)
+        self.dish_lines = _add(self.dish_lines, dish)
+        self.dish_units = _add(self.dish_units, dish, quantity)
+        self.dish_revenue = _add(self.dish_revenue, dish, cents)
+        self.hourly_units = _add(self.hourly_units, chunk["hour"], quantity)
+
+        carts = chunk["cart"]
+        starts = np.flatnonzero(np.r_[True, carts[1:] != carts[:-1]])
+        values = np.add.reduceat(cents, starts)
+        if self._open is not None:
+            cart, value, order_slot, hour = self._open
+            if carts[0] == cart:
+                values[0] += value
+            else:
+                self._close_orders(np.array([value]), np.array([order_slot]),
+                                   np.array([hour]))
+        self._open = (carts[starts[-1]], values[-1], slot[starts[-1]],
+                      chunk["hour"][starts[-1]])
+        self._close_orders(values[:-1], slot[starts[:-1]],
+                           chunk["hour"][starts[:-1]])
+
+    def _close_orders(self, values, slots, hours):
+        if not len(values):
+            return
+        self.restaurant_orders = _add(self.restaurant_orders, slots)
+        self.hourly_orders = _add(self.hourly_orders, hours)
+        bins = (np.log1p(values) / VALUE_STEP).astype(np.int64)
+        self.value_histogram = _add(self.value_histogram, bins)
+        self.max_value = max(self.max_value, int(values.max()))
+
+    def finish(self):
+        if self._open is not None:
+            _, value, slot, hour = self._open
+            self._close_orders(np.array([value]), np.array([slot]),
+                               np.array([hour]))
+            self._open = None
+
+    def percentiles(self):
+        """Upper bound of the bin holding each of ``PERCENTILES``."""
+        orders = int(self.value_histogram.sum())
+        if not orders:
+            return {}
+        cumulative = np.cumsum(self.value_histogram)
+        result = {}
+        for percentile in PERCENTILES:
+            index = int(np.searchsorted(cumulative,
+                                        orders * percentile / 100))
+            cents = min(round(np.expm1((index + 1) * VALUE_STEP)),
+                        self.max_value)
+            result[f"p{percentile}"] = _money(cents)
+        return result
+
+    def as_dict(self, top_dishes=10):
+        """Plain data, with restaurant and dish names looked up by id."""
+        self.finish()
+        orders = int(self.restaurant_orders.sum())
+        revenue = int(self.restaurant_revenue.sum())
+        hours = self.restaurant_hours
+        hours = np.pad(hours, (0, len(self.restaurant_units) * HOURS
+                               - len(hours))).reshape(-1, HOURS)
+
+        restaurant_ids = self.restaurant_index.ids
+        addresses = Restaurant.objects.in_bulk(
+            [pk for pk in restaurant_ids if pk != NO_RESTAURANT])
+        restaurants = []
+        for slot in self.restaurant_index.ranked(
+                np.flatnonzero(self.restaurant_units),
+                self.restaurant_revenue).tolist():
+            pk = restaurant_ids[slot]
+            restaurant = addresses.get(pk)
+            restaurants.append({
+                "restaurant": None if pk == NO_RESTAURANT else pk,
+                "address": restaurant.address if restaurant else None,
+                "orders": int(self.restaurant_orders[slot])
+                if slot < len(self.restaurant_orders) else 0,
+                "units": int(self.restaurant_units[slot]),
+                "revenue": _money(self.restaurant_revenue[slot]),
+                "hourly_units": hours[slot].tolist(),
+                "peak_hour": int(hours[slot].argmax()),
+            })
+
+        dish_slots = self.dish_index.ranked(
+            np.flatnonzero(self.dish_lines),
+            self.dish_revenue)[:top_dishes].tolist()
+        dish_ids = self.dish_index.ids
+        names = dict(Dish.objects
+                     .filter(pk__in=[dish_ids[slot] for slot in dish_slots])
+                     .values_list("pk", "name"))
+        dishes = [{
+            "dish": dish_ids[slot],
+            "name": names.get(dish_ids[slot]),
+            "lines": int(self.dish_lines[slot]),
+            "units": int(self.dish_units[slot]),
+            "revenue": _money(self.dish_revenue[slot]),
+            "share": round(int(self.dish_revenue[slot]) / revenue, 4)
+            if revenue else 0.0,
+        } for slot in dish_slots]
+
+        return {
+            "orders": orders,
+            "lines": self.lines,
+            "units": int(self.restaurant_units.sum()),
+            "revenue": _money(revenue),
+            "order_value": {
+                "mean": _money(round(revenue / orders)) if orders
+                else _money(0),
+                "max": _money(self.max_value),
+                **self.percentiles(),
+            },
+            "hourly_orders": self.hourly_orders.tolist(),
+            "hourly_units": self.hourly_units.tolist(),
+            "restaurants": restaurants,
+            "dishes": dishes,
+        }
+
+
+def build(first, last, chunk_size=10000, top_dishes=10):
+    """The demand report for days ``first`` to ``last``."""
+    report = DemandReport()
+    for chunk in stream_lines(first, last, chunk_size):
+        report.add(chunk)
+    return {"first": first, "last": last,
+            **report.as_dict(top_dishes=top_dishes)}
@@ -0,0 +1,132 @@
+"""Ranked search over dish names and ingredients.
+
+On PostgreSQL ``search_dishes`` matches a weighted ``tsvector`` of name
+(weight A) and ingredients (weight B) against prefix terms. It is served
+by the GIN expression index ``dish_search_idx``, so ``DOCUMENT`` must stay
+identical to the expression in migration 0012. When ``pg_trgm`` is
+installed, names similar to the query (typos) also match, through the
+trigram index ``dish_name_trgm_idx``.
+
+On SQLite it queries the FTS5 table ``bufet_system_dish_fts``, which
+triggers keep in step with the dish table, and ranks with ``bm25``.
+The table and triggers are defined in ``bufet_system.fts_schema``. SQLite
+drops the triggers whenever a migration rebuilds the dish table, so such
+migrations end with ``fts_schema.restore_fts_triggers``. Elsewhere, or
+without FTS5, it falls back to ``icontains`` scans.
+"""
+import re
+
+from django.db import connections, models
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from bufet_system.fts_schema import FTS_TABLE, has_fts
+from bufet_system.models import Dish
+
+DOCUMENT = ("setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(ingredients, '')), "
+            "'B')")
+# bm25 weights of the name and ingredients columns.
+FTS_WEIGHTS = (10.0, 1.0)
+MAX_TERMS = 8
+
+_features = {}
+
+
+def terms(query):
+    """Lower-cased word tokens of ``query``, at most ``MAX_TERMS``."""
+    return re.findall(r"\w+", query.lower())[:MAX_TERMS]
+
+
+def _feature(alias, name, probe):
+    key = (alias, name)
+    if key not in _features:
+        _features[key] = probe(connections[alias])
+    return _features[key]
+
+
+def _has_trigram(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def backend(using="default"):
+    """``"postgresql"``, ``"fts5"`` or ``"scan"`` for database ``using``."""
+    connection = connections[using]
+    if connection.vendor == "postgresql":
+        return "postgresql"
+    if connection.vendor == "sqlite" and _feature(using, "fts5", has_fts):
+        return "fts5"
+    return "scan"
+
+
+def _postgresql(queryset, words, query, using):
+    tsquery = " & ".join(f"{word}:*" for word in words)
+    matched = RawSQL(f"({DOCUMENT}) @@ to_tsquery('simple', %s)",
+                     (tsquery,), output_field=models.BooleanField())
+    rank = f"ts_rank({DOCUMENT}, to_tsquery('simple', %s))"
+    params = (tsquery,)
+    if _feature(using, "pg_trgm", _has_trigram):
+        matched = RawSQL(f"(({DOCUMENT}) @@ to_tsquery('simple', %s) "
+                         f"OR name %% %s)",
+                         (tsquery, query),
+                         output_field=models.BooleanField())
+        rank = f"{rank} + similarity(name, %s)"
+        params = (tsquery, query)
+    return queryset.filter(matched).annotate(
+        rank=RawSQL(rank, params, output_field=models.FloatField()))
+
+
+def _fts5(queryset, words):
+    match = " ".join(f'"{word}"*' for word in words)
+    table = connections[queryset.db].ops.quote_name(FTS_TABLE)
+    name_weight, ingredients_weight = FTS_WEIGHTS
+    # MATCH and bm25 (lower for better matches) must refer to the FTS
+    # table in the query that joins it, through DishSearchEntry. A
+    # correlated subquery per dish would be hundreds of times slower.
+    # The join is the only one to the table, so its alias is the name.
+    matched = RawSQL(f"{table} MATCH %s", (match,),
+                     output_field=models.BooleanField())
+    rank = RawSQL(f"-bm25({table}, {name_weight}, {ingredients_weight})",
+                  (), output_field=models.FloatField())
+    return (queryset.filter(search_entry__isnull=False)
+            .filter(matched).annotate(rank=rank))
+
+
+def _scan(queryset, words):
+    matched = Q()
+    for word in words:
+        matched &= Q(name__icontains=word) | Q(ingredients__icontains=word)
+    in_name = Q()
+    for word in words:
+        in_name &= Q(name__icontains=word)
+    return queryset.filter(matched).annotate(rank=models.Case(
+        models.When(in_name, then=models.Value(1.0)),
+        default=models.Value(0.0),
+        output_field=models.FloatField(),
+    ))
+
+
+def search_dishes(query, queryset=None):
+    """Dishes matching ``query``, best first, annotated with ``rank``.
+
+    Every word must match the start of a word in the name or the
+    ingredients (on PostgreSQL with ``pg_trgm``, a name similar to the
+    whole query also matches). An empty query matches nothing. The
+    result must not be used as a subquery: the raw SQL refers to the dish
+    table by name.
+    """
+    if queryset is None:
+        queryset = Dish.objects.all()
+    words = terms(query)
+    if not words:
+        return queryset.none()
+    kind = backend(queryset.db)
+    if kind == "postgresql":
+        queryset = _postgresql(queryset, words, query, queryset.db)
+    elif kind == "fts5":
+        queryset = _fts5(queryset, words)
+    else:
+        queryset = _scan(queryset, words)
+    return queryset.order_by("-rank", "name", "pk")
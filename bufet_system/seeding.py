@@ -0,0 +1,259 @@
+"""Deterministic synthetic data for benchmarks and scale testing.
+
+Rows are generated batch by batch and written with ``bulk_create`` (or
+``COPY`` on PostgreSQL), so memory use depends on the batch size rather
+than on how many rows are requested. The same ``seed`` always produces
+the same data.
+"""
+import csv
+import io
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+
+from bufet_system import analytics, caching, ingredients, stats
+from bufet_system.models import (Dish,
+                                 Order,
+                                 ProductCart,
+                                 ProductCartItem,
+                                 Restaurant,
+                                 User)
+from bufet_system.utils import batched
+
+SEED_PASSWORD = "Bufet-seed-123"
+
+WORDS = ("borscht", "varenyky", "holubtsi", "deruny", "salo", "kulish",
+         "banosh", "syrnyky", "pampushky", "kyiv cutlet", "uzvar",
+         "mlyntsi", "kapusniak", "nalysnyky", "shuba", "olivier")
+INGREDIENTS = ("potato", "beet", "cabbage", "pork", "beef", "chicken",
+               "mushrooms", "sour cream", "dill", "garlic", "onion",
+               "cheese", "flour", "eggs", "milk", "walnuts", "honey")
+
+
+def generate_users(count, rng, offset=0):
+    password = make_password(SEED_PASSWORD)
+    for number in range(offset, offset + count):
+        yield User(username=f"seed_user_{number}",
+                   first_name=rng.choice(("Olena", "Taras", "Iryna",
+                                          "Andrii", "Oksana", "Dmytro")),
+                   last_name=f"Seed{number}",
+                   email=f"seed_user_{number}@example.com",
+                   phone_number=f"+380{number:09d}",
+                   password=password)
+
+
+def generate_dishes(count, rng, offset=0):
+    for number in range(offset, offset + count):
+        yield Dish(name=f"{rng.choice(WORDS).title()} #{number}",
+                   ingredients=", ".join(rng.sample(INGREDIENTS, 4)),
+                   price=Decimal(rng.randint(4000, 45000)) / 100,
+                   weight=Decimal(rng.randint(100, 900)))
+
+
+def generate_restaurants(count, rng, offset=0):
+    for number in range(offset, offset + count):
+        yield Restaurant(address=f"Kharkiv, Sumska St. {number + 1}")
+
+
+def seed_reference_data(users, dishes, restaurants, rng, batch_size):
+    offsets = (User.objects.count(), Dish.objects.count(),
+               Restaurant.objects.count())
+    for model, rows in (
+            (User, generate_users(users, rng, offsets[0])),
+            (Dish, generate_dishes(dishes, rng, offsets[1])),
+            (Restaurant, generate_restaurants(restaurants, rng, offsets[2])),
+    ):
+        for batch in batched(rows, batch_size):
+            model.objects.bulk_create(batch)
+            if model is Dish:
+                ingredients.link_dishes(batch)
+
+
+def seed_orders(count, rng, batch_size, max_lines=5, history_days=365,
+                use_copy=False, progress=None):
+    """Completed carts with lines and their orders, ``batch_size`` at a time.
+
+    Users, dishes and restaurants are sampled from what already exists;
+    order timestamps are spread over the last ``history_days`` days.
+    ``progress`` is called with the number of orders written so far.
+    """
+    write_batch = copy_order_batch if use_copy else write_order_batch
+    user_ids = list(User.objects.values_list("pk", flat=True))
+    dishes = Dish.objects.values_list("pk", "price", "name")
+    prices = {pk: price for pk, price, _ in dishes}
+    names = {pk: name for pk, _, name in dishes}
+    dish_ids = list(prices)
+    restaurant_ids = list(Restaurant.objects.values_list("pk", flat=True))
+    if not (user_ids and dish_ids and restaurant_ids):
+        raise ValueError("Seed users, dishes and restaurants first.")
+
+    now = timezone.now()
+    span = history_days * 24 * 3600
+    remaining = count
+    while remaining > 0:
+        size = min(batch_size, remaining)
+        remaining -= size
+        plans = []
+        for _ in range(size):
+            created_at = now - timedelta(seconds=rng.randrange(span))
+            lines = {dish: rng.randint(1, 3) for dish in
+                     rng.sample(dish_ids,
+                                min(len(dish_ids),
+                                    rng.randint(1, max_lines)))}
+            plans.append((rng.choice(user_ids),
+                          rng.choice(restaurant_ids),
+                          created_at,
+                          lines))
+        with transaction.atomic():
+            write_batch(plans, prices, names)
+        if progress is not None:
+            progress(count - remaining)
+
+
+def backdate(objs, timestamps):
+    """Set ``created_at`` of just inserted ``objs`` to ``timestamps``.
+
+    ``bulk_create`` stamps ``auto_now_add`` fields with the current time,
+    so the planned times are written with a second statement.
+    ``bulk_update`` does not call ``pre_save`` and keeps them.
+    """
+    for obj, created_at in zip(objs, timestamps):
+        obj.created_at = created_at
+    type(objs[0]).objects.bulk_update(objs, ["created_at"])
+
+
+def write_order_batch(plans, prices, names):
+    timestamps = [created_at for _, _, created_at, _ in plans]
+    carts = ProductCart.objects.bulk_create([
+        ProductCart(
+            user_id=user_id,
+            status=ProductCart.STATUS_COMPLETED,
+            lines_count=len(lines),
+            items_count=sum(lines.values()),
+            total_price=sum(prices[dish] * quantity
+                            for dish, quantity in lines.items()),
+        )
+        for user_id, _, _, lines in plans
+    ])
+    backdate(carts, timestamps)
+    ProductCartItem.objects.bulk_create([
+        ProductCartItem(cart_id=cart.pk, item_id=dish, quantity=quantity,
+                        unit_price=prices[dish], dish_name=names[dish])
+        for cart, (_, _, _, lines) in zip(carts, plans)
+        for dish, quantity in lines.items()
+    ])
+    orders = Order.objects.bulk_create([
+        Order(user_id=cart.user_id,
+              restaurant_id=restaurant_id,
+              total_price=cart.total_price,
+              product_cart_id=cart.pk)
+        for cart, (_, restaurant_id, _, _) in zip(carts, plans)
+    ])
+    backdate(orders, timestamps)
+
+
+def reserve_ids(model, count):
+    """Draw ``count`` primary keys from the table's sequence."""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, %s)) "
+            "FROM generate_series(1, %s)",
+            [table, model._meta.pk.column, count],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def copy_rows(model, columns, rows):
+    """Stream ``rows`` into ``model``'s table with PostgreSQL ``COPY``."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    table = connection.ops.quote_name(model._meta.db_table)
+    names = ", ".join(connection.ops.quote_name(column)
+                      for column in columns)
+    sql = f"COPY {table} ({names}) FROM STDIN WITH (FORMAT csv)"
+    with connection.cursor() as cursor:
+        raw = cursor.cursor
+        if hasattr(raw, "copy_expert"):
+            raw.copy_expert(sql, buffer)
+        else:
+            with raw.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+
+
+def copy_order_batch(plans, prices, names):
+    """``write_order_batch`` for PostgreSQL, using ``COPY``.
+
+    Cart and order ids are taken from their sequences up front, so lines
+    and orders can reference carts without reading anything back.
+    """
+    cart_ids = reserve_ids(ProductCart, len(plans))
+    order_ids = reserve_ids(Order, len(plans))
+    totals = [sum(prices[dish] * quantity
+                  for dish, quantity in lines.items())
+              for _, _, _, lines in plans]
+    copy_rows(
+        ProductCart,
+        ("id", "user_id", "created_at", "status", "lines_count",
+         "items_count", "total_price"),
+        ((cart_id, user_id, created_at.isoformat(),
+          ProductCart.STATUS_COMPLETED, len(lines), sum(lines.values()),
+          total)
+         for cart_id, (user_id, _, created_at, lines), total
+         in zip(cart_ids, plans, totals)),
+    )
+    copy_rows(
+        ProductCartItem,
+        ("cart_id", "item_id", "quantity", "unit_price", "dish_name"),
+        ((cart_id, dish, quantity, prices[dish], names[dish])
+         for cart_id, (_, _, _, lines) in zip(cart_ids, plans)
+         for dish, quantity in lines.items()),
+    )
+    copy_rows(
+        Order,
+        ("id", "user_id", "restaurant_id", "created_at", "total_price",
+         "product_cart_id"),
+        ((order_id, user_id, restaurant_id, created_at.isoformat(), total,
+          cart_id)
+         for order_id, cart_id, (user_id, restaurant_id, created_at, _),
+         total in zip(order_ids, cart_ids, plans, totals)),
+    )
+
+
+def analyze(*models):
+    """Refresh PostgreSQL planner statistics after a large load."""
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        for model in models:
+            cursor.execute(
+                f"ANALYZE {connection.ops.quote_name(model._meta.db_table)}")
+
+
+def seed(users=0, dishes=0, restaurants=0, orders=0, seed=0,
+         batch_size=1000, use_copy=None, progress=None):
+    """Add the requested number of rows of each kind.
+
+    ``use_copy`` defaults to ``COPY`` on PostgreSQL and ``bulk_create``
+    elsewhere; both produce the same rows for the same ``seed``.
+    """
+    if use_copy is None:
+        use_copy = connection.vendor == "postgresql"
+    elif use_copy and connection.vendor != "postgresql":
+        raise ValueError("COPY is only available on PostgreSQL.")
+    rng = random.Random(seed)
+    seed_reference_data(users, dishes, restaurants, rng, batch_size)
+    if orders:
+        seed_orders(orders, rng, batch_size, use_copy=use_copy,
+                    progress=progress)
+    analyze(User, Dish, Restaurant, ProductCart, ProductCartItem, Order)
+    stats.refresh_counters()
+    if orders:
+        analytics.backfill(*analytics.order_days(), chunk_days=31)
+    caching.bump_version(caching.MENU)
+    caching.bump_version(caching.RESTAURANTS)
@@ -0,0 +1,112 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from bufet_system import (analytics, caching, ingredients, instrumentation,
+                          stats)
+from bufet_system.backends.auth import forget_user
+from bufet_system.cart import merge_guest_cart
+from bufet_system.models import (Dish,
+                                 Ingredient,
+                                 Order,
+                                 ProductCart,
+                                 ProductCartItem,
+                                 Restaurant,
+                                 User)
+
+
+@receiver(post_save, sender=Dish)
+def refresh_draft_carts_for_dish(sender, instance, created, **kwargs):
+    """Reprice draft cart lines and totals after a dish edit.
+
+    Completed carts keep the price and name they were ordered at.
+    """
+    if created:
+        return
+    repriced = ProductCartItem.objects.filter(
+        item=instance,
+        cart__status=ProductCart.STATUS_DRAFT,
+    ).exclude(
+        unit_price=instance.price, dish_name=instance.name,
+    ).update(unit_price=instance.price, dish_name=instance.name)
+    if repriced:
+        ProductCart.objects.filter(
+            status=ProductCart.STATUS_DRAFT,
+            productcartitem__item=instance,
+        ).recompute_summaries()
+
+
+@receiver(post_save, sender=Dish)
+def link_dish_ingredients(sender, instance, **kwargs):
+    ingredients.link_dishes([instance])
+
+
+@receiver(post_save, sender=Ingredient)
+def refresh_dish_allergens(sender, instance, created, **kwargs):
+    if not created:
+        ingredients.refresh_allergens(
+            instance.dishes.values_list("pk", flat=True))
+
+
+@receiver(pre_delete, sender=Ingredient)
+def remember_ingredient_dishes(sender, instance, **kwargs):
+    # The links are gone by post_delete.
+    instance._dish_ids = list(instance.dishes.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Ingredient)
+def refresh_former_dish_allergens(sender, instance, **kwargs):
+    ingredients.refresh_allergens(getattr(instance, "_dish_ids", ()))
+
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_save, sender=Order)
+@receiver(post_save, sender=User)
+def count_created_row(sender, instance, created, **kwargs):
+    if created:
+        stats.increment(stats.counter_name(sender))
+
+
+@receiver(post_save, sender=Order)
+def record_order_analytics(sender, instance, created, **kwargs):
+    if created:
+        analytics.record_orders([instance])
+
+
+@receiver(post_delete, sender=Restaurant)
+@receiver(post_delete, sender=Order)
+@receiver(post_delete, sender=User)
+def count_deleted_row(sender, instance, **kwargs):
+    stats.increment(stats.counter_name(sender), -1)
+
+
+@receiver(post_save, sender=Dish)
+@receiver(post_delete, sender=Dish)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_menu_cache(sender, **kwargs):
+    caching.bump_version(caching.MENU)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def invalidate_restaurant_cache(sender, **kwargs):
+    caching.bump_version(caching.RESTAURANTS)
+
+
+@receiver(user_logged_in)
+def merge_guest_cart_on_login(sender, request, user, **kwargs):
+    if request is not None:
+        merge_guest_cart(request, user)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    instrumentation.install(connection)
@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from bufet_system.models import Order, Restaurant, SiteCounter
+
+CACHE_KEY = "bufet:site-stats"
+
+
+def counted_models():
+    """Counter name -> model whose rows it counts."""
+    return {
+        "restaurants": Restaurant,
+        "orders": Order,
+        "users": get_user_model(),
+    }
+
+
+def counter_name(model):
+    """Name of the counter tracking ``model``, or None."""
+    for name, counted in counted_models().items():
+        if counted is model:
+            return name
+    return None
+
+
+def get_site_stats():
+    """Landing page numbers, read from the counters table via the cache.
+
+    Never runs COUNT(*). The cached copy may lag behind the counters by
+    at most ``BUFET_STATS_MAX_AGE`` seconds.
+    """
+    stats = cache.get(CACHE_KEY)
+    if stats is None:
+        stats = dict.fromkeys(counted_models(), 0)
+        stats.update(SiteCounter.objects.values_list("name", "value"))
+        cache.set(CACHE_KEY, stats, settings.BUFET_STATS_MAX_AGE)
+    return stats
+
+
+def increment(name, delta=1):
+    """Shift a counter by ``delta`` once the current transaction commits.
+
+    Deferring to commit keeps the hot counter row locked only for the
+    single UPDATE rather than for the whole order transaction.
+    """
+    def apply():
+        updated = SiteCounter.objects.filter(name=name).update(
+            value=F("value") + delta, updated_at=timezone.now())
+        if not updated:
+            refresh_counters([name])
+
+    transaction.on_commit(apply)
+
+
+def refresh_counters(names=None):
+    """Recount the given counters (all by default) with COUNT(*).
+
+    Meant for periodic repair, e.g. after bulk imports that bypass the
+    model signals.
+    """
+    models = counted_models()
+    for name in names or models:
+        SiteCounter.objects.update_or_create(
+            name=name,
+            defaults={"value": models[name].objects.count()},
+        )
+    cache.delete(CACHE_KEY)
@@ -1,13 +1,24 @@
 from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.models import Sum
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
+from bufet_system import ingredients, seeding, stats
 from bufet_system.models import (Dish,
+                                 Ingredient,
                                  Restaurant,
                                  ProductCart,
                                  ProductCartItem,
-                                 Order)
+                                 Order,
+                                 SiteCounter)
 
 
 class UserModelTest(TestCase):
@@ -61,6 +72,79 @@ class ProductCartModelTest(TestCase):
         self.cart.remove_product(self.dish1)
         self.assertEqual(self.cart.get_cart_items().count(), 0)
 
+    def test_add_existing_line_is_single_update(self):
+        self.cart.add_product(self.dish1)
+        with CaptureQueriesContext(connection) as queries:
+            self.cart.add_product(self.dish1, quantity=2)
+        statements = [query["sql"] for query in queries
+                      if not query["sql"].startswith(("SAVEPOINT",
+                                                      "RELEASE"))]
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(all(sql.startswith("UPDATE") for sql in statements))
+        self.assertEqual(
+            self.cart.productcartitem_set.get(item=self.dish1).quantity, 3)
+
+    def test_non_positive_quantities_are_rejected(self):
+        self.cart.add_product(self.dish1, quantity=2)
+        for quantity in (0, -3):
+            with self.assertRaises(ValueError):
+                self.cart.add_product(self.dish2, quantity=quantity)
+            with self.assertRaises(ValueError):
+                self.cart.remove_product(self.dish1, quantity=quantity)
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.lines_count, self.cart.items_count,
+                          self.cart.total_price), (1, 2, Decimal("21.98")))
+
+    def test_insert_reraises_errors_other_than_a_duplicate_line(self):
+        with mock.patch.object(ProductCartItem, "save",
+                               side_effect=IntegrityError("not null")):
+            with self.assertRaises(IntegrityError):
+                self.cart.add_product(self.dish1)
+        with mock.patch.object(ProductCartItem.objects, "bulk_create",
+                               side_effect=IntegrityError("not null")):
+            with self.assertRaises(IntegrityError):
+                self.cart.set_quantities({self.dish1: 1})
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.lines_count, self.cart.items_count),
+                         (0, 0))
+        self.assertFalse(self.cart.productcartitem_set.exists())
+
+    def test_remove_missing_product_does_not_insert(self):
+        self.cart.remove_product(self.dish1)
+        self.assertFalse(self.cart.productcartitem_set.exists())
+        self.assertEqual(self.cart.items_count, 0)
+
+    def test_remove_more_than_in_cart_deletes_line(self):
+        self.cart.add_product(self.dish1, quantity=2)
+        self.cart.remove_product(self.dish1, quantity=5)
+        self.assertFalse(self.cart.productcartitem_set.exists())
+        self.assertEqual(self.cart.total_price, Decimal("0.00"))
+
+    def test_update_quantity_to_zero_deletes_line(self):
+        self.cart.add_product(self.dish1, quantity=2)
+        self.cart.update_quantity(self.dish1, 0)
+        self.assertFalse(self.cart.productcartitem_set.exists())
+        self.assertEqual(self.cart.lines_count, 0)
+
+    def test_cart_item_is_unique_per_cart(self):
+        self.cart.add_product(self.dish1)
+        with self.assertRaises(IntegrityError):
+            ProductCartItem.objects.create(cart=self.cart, item=self.dish1)
+
+    def test_one_draft_cart_per_user(self):
+        self.assertEqual(ProductCart.objects.get_or_create_draft(self.user),
+                         self.cart)
+        with self.assertRaises(IntegrityError):
+            ProductCart.objects.create(user=self.user)
+
+    def test_completed_carts_do_not_count_as_drafts(self):
+        self.cart.status = ProductCart.STATUS_COMPLETED
+        self.cart.save()
+        ProductCart.objects.create(user=self.user)
+        ProductCart.objects.create(user=self.user,
+                                   status=ProductCart.STATUS_COMPLETED)
+        self.assertEqual(ProductCart.objects.count(), 3)
+
     def test_update_quantity(self):
         self.cart.add_product(self.dish1)
         self.assertEqual(self.cart.get_cart_total(), self.dish1.price)
@@ -78,6 +162,114 @@ class ProductCartModelTest(TestCase):
         self.assertEqual(order.restaurant, self.restaurant)
         self.assertEqual(order.total_price, self.cart.get_cart_total())
 
+    def test_get_cart_total_uses_single_query(self):
+        for i in range(10):
+            dish = Dish.objects.create(name=f"Extra {i}",
+                                       ingredients="Ingredient 1",
+                                       price=Decimal("1.50"),
+                                       weight=Decimal(100.00))
+            ProductCartItem.objects.create(cart=self.cart,
+                                           item=dish,
+                                           quantity=2)
+        self.cart.add_product(self.dish1)
+        with self.assertNumQueries(1):
+            total = self.cart.get_cart_total()
+        self.assertEqual(total, Decimal("30.00") + self.dish1.price)
+
+    def test_cart_summary_follows_mutations(self):
+        self.cart.add_product(self.dish1, quantity=2)
+        self.cart.add_product(self.dish2)
+        self.cart.add_product(self.dish1)
+        self.cart.remove_product(self.dish2)
+        self.cart.update_quantity(self.dish1, 5)
+        stored = ProductCart.objects.get(pk=self.cart.pk)
+        self.assertEqual(stored.lines_count, 1)
+        self.assertEqual(stored.items_count, 5)
+        self.assertEqual(stored.total_price, self.dish1.price * 5)
+        self.assertEqual(stored.total_price, self.cart.total_price)
+
+    def test_set_quantities_applies_batch(self):
+        dish3 = Dish.objects.create(name="Dish 3",
+                                    ingredients="Ingredient 1",
+                                    price=Decimal("2.50"),
+                                    weight=Decimal(100))
+        self.cart.add_product(self.dish1, quantity=2)
+        self.cart.add_product(self.dish2)
+        self.cart.set_quantities({self.dish1: 4, self.dish2: 0, dish3: 3})
+        self.assertEqual(
+            dict(self.cart.productcartitem_set.values_list("item_id",
+                                                           "quantity")),
+            {self.dish1.pk: 4, dish3.pk: 3})
+        stored = ProductCart.objects.get(pk=self.cart.pk)
+        self.assertEqual(stored.lines_count, 2)
+        self.assertEqual(stored.items_count, 7)
+        self.assertEqual(stored.total_price, stored.get_cart_total())
+        self.assertEqual(stored.total_price, self.cart.total_price)
+
+    def test_set_quantities_query_count_is_flat(self):
+        dishes = [Dish.objects.create(name=f"Batch {number}",
+                                      ingredients="Ingredient 1",
+                                      price=Decimal("1.00"),
+                                      weight=Decimal(100))
+                  for number in range(10)]
+        with CaptureQueriesContext(connection) as one:
+            self.cart.set_quantities({dishes[0]: 1})
+        with CaptureQueriesContext(connection) as many:
+            self.cart.set_quantities({dish: 2 for dish in dishes[1:]})
+        self.assertEqual(len(one), len(many))
+
+    def test_recompute_summaries(self):
+        ProductCartItem.objects.create(cart=self.cart,
+                                       item=self.dish1,
+                                       quantity=3)
+        ProductCart.objects.filter(pk=self.cart.pk).recompute_summaries()
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.lines_count, 1)
+        self.assertEqual(self.cart.items_count, 3)
+        self.assertEqual(self.cart.total_price, self.dish1.price * 3)
+
+    def test_recompute_cart_summaries_command(self):
+        ProductCartItem.objects.create(cart=self.cart,
+                                       item=self.dish2,
+                                       quantity=2)
+        call_command("recompute_cart_summaries", stdout=StringIO())
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_price, self.dish2.price * 2)
+
+    def test_dish_price_change_refreshes_draft_totals(self):
+        self.cart.add_product(self.dish1, quantity=2)
+        self.dish1.price = Decimal("5.00")
+        self.dish1.save()
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_price, Decimal("10.00"))
+        line = self.cart.productcartitem_set.get()
+        self.assertEqual(line.unit_price, Decimal("5.00"))
+
+    def test_completed_cart_keeps_ordered_prices(self):
+        self.cart.add_product(self.dish1, quantity=2)
+        self.cart.create_order(restaurant=self.restaurant)
+        self.dish1.price = Decimal("99.00")
+        self.dish1.name = "Renamed"
+        self.dish1.save()
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_price, Decimal("21.98"))
+        self.assertEqual(self.cart.get_cart_total(), Decimal("21.98"))
+        line = self.cart.get_lines().get()
+        self.assertEqual((line.name, line.price), ("Dish 1",
+                                                   Decimal("10.99")))
+
+    def test_cart_lines_do_not_join_dishes(self):
+        self.cart.set_quantities({self.dish1: 1, self.dish2: 2})
+        with CaptureQueriesContext(connection) as captured:
+            lines = list(self.cart.get_lines())
+            self.cart.get_cart_total()
+        self.assertEqual([line.name for line in lines], ["Dish 1", "Dish 2"])
+        self.assertFalse(any(Dish._meta.db_table in query["sql"]
+                             for query in captured))
+
+    def test_empty_cart_total(self):
+        self.assertEqual(self.cart.get_cart_total(), Decimal("0.00"))
+
 
 class OrderModelTest(TestCase):
     def setUp(self):
@@ -96,6 +288,16 @@ class OrderModelTest(TestCase):
                         f"total price: 20.0")
         self.assertEqual(str(self.order), expected_str)
 
+    def test_order_cart_total_uses_single_query(self):
+        dish = Dish.objects.create(name="Dish",
+                                   ingredients="Ingredient 1",
+                                   price=Decimal("4.25"),
+                                   weight=Decimal(100.00))
+        ProductCartItem.objects.create(cart=self.cart, item=dish, quantity=4)
+        order = Order.objects.get(pk=self.order.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(order.get_cart_total(), Decimal("17.00"))
+
 
 class ProductCartItemModelTest(TestCase):
     def test_product_cart_item_creation(self):
@@ -115,3 +317,132 @@ class ProductCartItemModelTest(TestCase):
         self.assertEqual(product_cart_item.cart, product_cart)
         self.assertEqual(product_cart_item.item, dish)
         self.assertEqual(product_cart_item.quantity, 2)
+
+    def test_save_copies_dish_price_and_name(self):
+        user = get_user_model().objects.create(username="testuser",
+                                               phone_number="123456789")
+        dish = Dish.objects.create(name="Soup",
+                                   ingredients="Beet",
+                                   price=Decimal("4.50"),
+                                   weight=300)
+        line = ProductCartItem.objects.create(
+            cart=ProductCart.objects.create(user=user), item=dish)
+        line.refresh_from_db()
+        self.assertEqual((line.unit_price, line.dish_name),
+                         (Decimal("4.50"), "Soup"))
+
+
+class SiteCounterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_counters_follow_creates_and_deletes(self):
+        before = stats.get_site_stats()["restaurants"]
+        with self.captureOnCommitCallbacks(execute=True):
+            restaurant = Restaurant.objects.create(address="Counter street")
+        self.assertEqual(
+            SiteCounter.objects.get(name="restaurants").value, before + 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            restaurant.delete()
+        self.assertEqual(
+            SiteCounter.objects.get(name="restaurants").value, before)
+
+    def test_refresh_counters_recounts(self):
+        SiteCounter.objects.filter(name="orders").update(value=42)
+        stats.refresh_counters(["orders"])
+        self.assertEqual(stats.get_site_stats()["orders"],
+                         Order.objects.count())
+
+
+class IngredientModelTest(TestCase):
+    def names(self, dish):
+        return list(dish.ingredient_set.values_list("name", flat=True))
+
+    def test_parse_normalizes_and_deduplicates(self):
+        self.assertEqual(ingredients.parse(" Beet,sour  Cream,, beet ,"),
+                         ["beet", "sour cream"])
+
+    def test_save_links_ingredients_and_allergens(self):
+        dish = Dish.objects.create(name="Varenyky",
+                                   ingredients="Potato, flour, cheese",
+                                   price=Decimal("3.00"), weight=250)
+        dish.refresh_from_db()
+        self.assertEqual(self.names(dish), ["cheese", "flour", "potato"])
+        self.assertEqual(ingredients.allergen_names(dish.allergens),
+                         ["gluten", "milk"])
+
+        dish.ingredients = "Potato, cabbage"
+        dish.save()
+        dish.refresh_from_db()
+        self.assertEqual(self.names(dish), ["cabbage", "potato"])
+        self.assertEqual(dish.allergens, 0)
+
+    def test_ingredient_changes_update_dish_masks(self):
+        dish = Dish.objects.create(name="Salad", ingredients="Beet, honey",
+                                   price=Decimal("2.00"), weight=200)
+        honey = Ingredient.objects.get(name="honey")
+        honey.allergens = ingredients.allergen_mask(["sulphites"])
+        honey.save()
+        dish.refresh_from_db()
+        self.assertEqual(ingredients.allergen_names(dish.allergens),
+                         ["sulphites"])
+        honey.delete()
+        dish.refresh_from_db()
+        self.assertEqual(dish.allergens, 0)
+
+    def test_relinking_unchanged_dishes_writes_nothing(self):
+        seeding.seed(dishes=50)
+        dishes = list(Dish.objects.all())
+        with CaptureQueriesContext(connection) as captured:
+            ingredients.link_dishes(dishes)
+        self.assertFalse([query for query in captured
+                          if query["sql"].startswith(("INSERT", "UPDATE",
+                                                      "DELETE"))])
+        self.assertEqual(Dish.objects.filter(ingredient_set=None).count(), 0)
+
+
+class SeedingTest(TestCase):
+    def test_seed_creates_consistent_orders(self):
+        seeding.seed(users=3, dishes=5, restaurants=2, orders=20,
+                     batch_size=7)
+        self.assertEqual(Order.objects.count(), 20)
+        self.assertEqual(
+            stats.get_site_stats()["users"], get_user_model().objects.count())
+        for order in Order.objects.select_related("product_cart"):
+            cart = order.product_cart
+            self.assertEqual(cart.status, ProductCart.STATUS_COMPLETED)
+            self.assertEqual(order.total_price, cart.get_cart_total())
+            self.assertEqual(cart.total_price, cart.get_cart_total())
+
+    def test_seeded_orders_keep_planned_timestamps(self):
+        started = timezone.now()
+        seeding.seed(users=2, dishes=3, restaurants=1, orders=10,
+                     batch_size=4, use_copy=False)
+        orders = list(Order.objects.select_related("product_cart"))
+        self.assertTrue(all(order.created_at < started for order in orders))
+        self.assertGreater(len({order.created_at for order in orders}), 1)
+        for order in orders:
+            self.assertEqual(order.product_cart.created_at, order.created_at)
+        self.assertTrue(
+            Order._meta.get_field("created_at").auto_now_add)
+
+    def test_seed_is_deterministic(self):
+        seeding.seed(dishes=4, seed=7)
+        first = list(Dish.objects.order_by("pk")
+                     .values_list("name", "price"))
+        Dish.objects.all().delete()
+        seeding.seed(dishes=4, seed=7)
+        second = list(Dish.objects.order_by("pk")
+                      .values_list("name", "price"))
+        self.assertEqual(first, second)
+
+    def test_seed_bufet_command(self):
+        out = StringIO()
+        call_command("seed_bufet", users=2, dishes=3, restaurants=1,
+                     orders=5, batch_size=2, stdout=out)
+        self.assertIn("5 orders", out.getvalue())
+        self.assertEqual(Order.objects.count(), 5)
+        self.assertEqual(ProductCartItem.objects.filter(
+            cart__status=ProductCart.STATUS_COMPLETED).count(),
+            ProductCart.objects.aggregate(
+                lines=Sum("lines_count"))["lines"])
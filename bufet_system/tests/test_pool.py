@@ -0,0 +1,192 @@
+import threading
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase
+
+from bufet_system import pool
+from bufet_system.pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    def setUp(self):
+        self.opened = []
+        self.clock = FakeClock()
+
+    def connect(self):
+        connection = FakeConnection(len(self.opened))
+        self.opened.append(connection)
+        return connection
+
+    def make_pool(self, **options):
+        return ConnectionPool(self.connect, clock=self.clock, **options)
+
+    def test_reuses_released_connections(self):
+        connections = self.make_pool(max_size=2)
+        first = connections.acquire()
+        connections.release(first)
+        self.assertIs(connections.acquire(), first)
+        stats = connections.stats()
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["reused"], 1)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["in_use"], 1)
+
+    def test_times_out_when_exhausted(self):
+        connections = self.make_pool(max_size=1, timeout=0)
+        connections.acquire()
+        with self.assertRaises(PoolTimeout):
+            connections.acquire()
+        stats = connections.stats()
+        self.assertEqual(stats["waits"], 1)
+        self.assertEqual(stats["timeouts"], 1)
+
+    def test_waiter_gets_released_connection(self):
+        connections = ConnectionPool(self.connect, max_size=1, timeout=5)
+        held = connections.acquire()
+        acquired = []
+        waiter = threading.Thread(
+            target=lambda: acquired.append(connections.acquire()))
+        waiter.start()
+        while connections.stats()["waits"] == 0:
+            pass
+        connections.release(held)
+        waiter.join(5)
+        self.assertEqual(acquired, [held])
+        self.assertEqual(connections.stats()["created"], 1)
+
+    def test_expired_connections_are_replaced(self):
+        connections = self.make_pool(max_size=1, max_idle=60)
+        first = connections.acquire()
+        connections.release(first)
+        self.clock.now = 61
+        second = connections.acquire()
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertEqual(connections.stats()["discarded"], 1)
+
+    def test_failed_health_check_discards_connection(self):
+        connections = self.make_pool(max_size=1,
+                                     check=lambda connection: False,
+                                     check_after=10)
+        first = connections.acquire()
+        connections.release(first)
+        self.assertIs(connections.acquire(), first)
+        connections.release(first)
+        self.clock.now = 11
+        self.assertIsNot(connections.acquire(), first)
+        self.assertEqual(connections.stats()["failed_checks"], 1)
+
+    def test_discard_frees_a_slot(self):
+        connections = self.make_pool(max_size=1, timeout=0)
+        first = connections.acquire()
+        connections.release(first, discard=True)
+        self.assertTrue(first.closed)
+        self.assertIsNot(connections.acquire(), first)
+
+    def test_connect_error_frees_a_slot(self):
+        def broken():
+            raise OSError("refused")
+
+        connections = ConnectionPool(broken, max_size=1, timeout=0)
+        for _ in range(2):
+            with self.assertRaises(OSError):
+                connections.acquire()
+        self.assertEqual(connections.stats()["connect_errors"], 2)
+        self.assertEqual(connections.stats()["size"], 0)
+
+
+def backend_pid(raw):
+    with raw.cursor() as cursor:
+        cursor.execute("SELECT pg_backend_pid()")
+        return cursor.fetchone()[0]
+
+
+@skipUnless(connection.settings_dict["ENGINE"]
+            == "bufet_system.backends.postgresql",
+            "Needs the pooled PostgreSQL backend")
+class PooledBackendTest(TransactionTestCase):
+    """The pool against a real server; CI runs these in its PostgreSQL job."""
+
+    def test_threads_share_at_most_max_size_connections(self):
+        max_size = connection.settings_dict["POOL"]["max_size"]
+        connection.close()
+        pids, errors = set(), []
+
+        def work():
+            try:
+                for _ in range(5):
+                    connection.ensure_connection()
+                    pids.add(backend_pid(connection.connection))
+                    connection.close()
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=work)
+                   for _ in range(max_size * 3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(pids), max_size)
+        stats = connection.get_pool(connection.get_connection_params()).stats()
+        self.assertLessEqual(stats["size"], max_size)
+        self.assertEqual(stats["in_use"], 0)
+        self.assertGreater(stats["reused"], 0)
+
+    def test_terminated_connection_is_replaced(self):
+        from bufet_system.backends.postgresql.base import _is_usable
+
+        params = connection.get_connection_params()
+        connect = connection.Database.connect
+        connections = ConnectionPool(lambda: connect(**params), max_size=1,
+                                     check=_is_usable, check_after=0)
+        self.addCleanup(connections.close)
+        first = connections.acquire()
+        first.autocommit = True
+        pid = backend_pid(first)
+        connections.release(first)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", [pid])
+        second = connections.acquire()
+        self.assertIsNot(second, first)
+        self.assertNotEqual(backend_pid(second), pid)
+        self.assertEqual(connections.stats()["failed_checks"], 1)
+        connections.release(second)
+
+    def test_connections_return_to_the_pool(self):
+        connection.close()
+        connection.ensure_connection()
+        raw = connection.connection
+        connection.close()
+        self.assertTrue(any(stats["idle"] for stats
+                            in pool.snapshot().values()))
+        connection.ensure_connection()
+        self.assertIs(connection.connection, raw)
+
+    def test_open_transaction_is_rolled_back_on_release(self):
+        connection.ensure_connection()
+        raw = connection.connection
+        with raw.cursor() as cursor:
+            cursor.execute("BEGIN")
+            cursor.execute("SELECT 1")
+        connection.close()
+        self.assertEqual(raw.info.transaction_status, 0)
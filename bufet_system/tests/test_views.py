@@ -1,15 +1,61 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import date
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock, skipIf
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import (Client,
+                         TestCase,
+                         TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from django.contrib.auth import get_user_model
-from bufet_system.models import (Dish,
+from django.utils import timezone
+from django.contrib.auth import authenticate, get_user_model
+from bufet_system import (analytics,
+                          catalog,
+                          checkout,
+                          exports,
+                          fts_schema,
+                          ingredients,
+                          instrumentation,
+                          reports,
+                          search,
+                          stats,
+                          views)
+from bufet_system.async_views import gather_queries
+from bufet_system.backends.auth import user_key
+from bufet_system.middleware import (GuestCartMiddleware,
+                                     PerformanceMiddleware,
+                                     QueryBudgetExceeded,
+                                     QueryBudgetMiddleware)
+from bufet_system.models import (DailyDishStats,
+                                 DailyRestaurantStats,
+                                 Dish,
+                                 Ingredient,
                                  Restaurant,
                                  Order,
                                  ProductCart,
-                                 ProductCartItem)
+                                 ProductCartItem,
+                                 SiteCounter)
 
 
 class BufetSystemViewsTest(TestCase):
     def setUp(self):
+        cache.clear()
         self.user = get_user_model().objects.create_user(
             username="testuser",
             phone_number="123456789")
@@ -26,10 +72,48 @@ class BufetSystemViewsTest(TestCase):
         response = self.client.get(reverse("bufet_system:index"))
         self.assertEqual(response.status_code, 200)
 
+    def test_index_view_runs_no_aggregate_queries(self):
+        stats.refresh_counters()
+        self.client.get(reverse("bufet_system:index"))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("bufet_system:index"))
+        self.assertEqual(response.context["num_restaurants"], 1)
+        self.assertEqual(response.context["num_users"], 1)
+
     def test_menu_list_view(self):
         response = self.client.get(reverse("bufet_system:menu"))
         self.assertEqual(response.status_code, 200)
 
+    def test_menu_pages_are_served_from_cache(self):
+        url = reverse("bufet_system:menu")
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual([(dish.pk, dish.name, str(dish.price))
+                          for dish in response.context["dishes"]],
+                         [(self.dish.pk, "Dish", "9.99")])
+
+    def test_menu_cache_is_invalidated_by_dish_changes(self):
+        url = reverse("bufet_system:menu")
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dish.name = "Renamed dish"
+            self.dish.save()
+        self.assertContains(self.client.get(url), "Renamed dish")
+        detail_url = reverse("bufet_system:dish-detail",
+                             kwargs={"pk": self.dish.pk})
+        self.assertContains(self.client.get(detail_url), "Renamed dish")
+
+    def test_restaurant_list_is_served_from_cache(self):
+        url = reverse("bufet_system:restaurant-list")
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, "Test Address")
+        with self.captureOnCommitCallbacks(execute=True):
+            Restaurant.objects.create(address="New Address")
+        self.assertContains(self.client.get(url), "New Address")
+
     def test_restaurant_list_view(self):
         response = self.client.get(reverse("bufet_system:restaurant-list"))
         self.assertEqual(response.status_code, 200)
@@ -47,11 +131,128 @@ class BufetSystemViewsTest(TestCase):
         response = self.client.get(reverse('bufet_system:product-cart'))
         self.assertEqual(response.status_code, 200)
 
+    def test_product_cart_view_query_count_is_constant(self):
+        self.client.force_login(self.user)
+        cart = ProductCart.objects.create(user=self.user, status="draft")
+        cart.add_product(self.dish, quantity=2)
+        url = reverse("bufet_system:product-cart")
+        # Warm the cached session and user so both requests hit them.
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as small_cart:
+            self.client.get(url)
+        for i in range(4):
+            dish = Dish.objects.create(name=f"Dish {i}",
+                                       ingredients="Ingredient 1",
+                                       price=1.5,
+                                       weight=100.0)
+            cart.add_product(dish)
+        with CaptureQueriesContext(connection) as large_cart:
+            response = self.client.get(url)
+        self.assertEqual(len(small_cart), len(large_cart))
+        self.assertEqual(str(response.context["total_price"]), "25.98")
+
+    def test_checkout_lines_come_from_one_query(self):
+        self.client.force_login(self.user)
+        cart = ProductCart.objects.create(user=self.user, status="draft")
+        cart.add_product(self.dish, quantity=3)
+        response = self.client.get(reverse("bufet_system:order-checkout"))
+        lines = response.context["lines"]
+        with self.assertNumQueries(1):
+            rows = [(line.name, line.quantity, line.subtotal)
+                    for line in lines.all()]
+        self.assertEqual(rows, [("Dish", 3, Decimal("29.97"))])
+        self.assertContains(response, "29.97 uah")
+
+    def test_draft_cart_is_resolved_once_per_request(self):
+        self.client.force_login(self.user)
+        cart = ProductCart.objects.create(user=self.user, status="draft")
+        cart.add_product(self.dish)
+        for url_name in ("bufet_system:product-cart",
+                         "bufet_system:order-checkout"):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse(url_name))
+            cart_lookups = [
+                query["sql"] for query in queries
+                if query["sql"].startswith("SELECT")
+                and 'FROM "bufet_system_productcart" ' in query["sql"]
+            ]
+            self.assertEqual(len(cart_lookups), 1, url_name)
+
+    def test_delete_from_cart_without_cart_creates_nothing(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse("bufet_system:delete-from-cart",
+                                            args=[self.dish.id]))
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(ProductCart.objects.exists())
+
+    def test_navbar_shows_cart_item_count(self):
+        self.client.force_login(self.user)
+        cart = ProductCart.objects.create(user=self.user, status="draft")
+        cart.add_product(self.dish, quantity=3)
+        response = self.client.get(reverse("bufet_system:menu"))
+        self.assertContains(
+            response,
+            '<span class="badge bg-gradient-primary ms-1">3</span>',
+            html=True)
+
     def test_order_list_view(self):
         self.client.force_login(self.user)
         response = self.client.get(reverse("bufet_system:order-list"))
         self.assertEqual(response.status_code, 200)
 
+    def test_order_list_uses_cursor_pagination(self):
+        self.client.force_login(self.user)
+        orders = [Order.objects.create(user=self.user,
+                                       restaurant=self.restaurant,
+                                       total_price=i)
+                  for i in range(12)]
+        url = reverse("bufet_system:order-list")
+        seen = []
+        response = self.client.get(url)
+        while True:
+            page = response.context["page_obj"]
+            seen.extend(page.object_list)
+            if not page.has_next():
+                break
+            response = self.client.get(url, {"cursor": page.next_cursor})
+        self.assertEqual(seen, orders)
+
+        last_page = response.context["page_obj"]
+        response = self.client.get(url, {"cursor": last_page.previous_cursor})
+        self.assertEqual(list(response.context["orders"]), orders[5:10])
+        self.assertIsNone(response.context["paginator"].count)
+
+    def test_order_list_labels_the_count_as_a_total(self):
+        self.client.force_login(self.user)
+        for i in range(7):
+            Order.objects.create(user=self.user, restaurant=self.restaurant,
+                                 total_price=i)
+        with mock.patch.object(views.OrderListView, "paginate_with_count",
+                               True):
+            response = self.client.get(reverse("bufet_system:order-list"))
+        self.assertContains(response, "7 total")
+        self.assertNotContains(response, '<li class="page-item active">')
+
+    def test_order_list_rejects_invalid_cursor(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("bufet_system:order-list"),
+                                   {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_admin_order_list(self):
+        admin_user = get_user_model().objects.create_superuser(
+            username="admin",
+            phone_number="987654321",
+            password="Admin123!")
+        Order.objects.create(user=self.user,
+                             restaurant=self.restaurant,
+                             total_price=10)
+        self.client.force_login(admin_user)
+        response = self.client.get(
+            reverse("admin:bufet_system_order_changelist"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["cl"].result_count, 1)
+
     def test_add_to_cart_view(self):
         self.client.force_login(self.user)
         response = self.client.post(reverse(
@@ -73,6 +274,34 @@ class BufetSystemViewsTest(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertEqual(ProductCartItem.objects.count(), 0)
 
+    def test_cart_views_reject_bad_quantities(self):
+        self.client.force_login(self.user)
+        cart = ProductCart.objects.create(user=self.user, status="draft")
+        cart.add_product(self.dish, quantity=10)
+        other = Dish.objects.create(name="Other", ingredients="Beet",
+                                    price=Decimal("2.00"), weight=100)
+        for name, dish in (("add-to-cart", other),
+                           ("delete-from-cart", self.dish)):
+            for quantity in ("0", "-3", "abc", "2.5", "", "1000"):
+                response = self.client.post(
+                    reverse(f"bufet_system:{name}", args=[dish.pk]),
+                    {"quantity": quantity}, follow=True)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn("whole number",
+                              str(list(response.context["messages"])[0]))
+        cart.refresh_from_db()
+        self.assertEqual((cart.lines_count, cart.items_count,
+                          cart.total_price), (1, 10, Decimal("99.90")))
+        self.assertEqual(list(cart.productcartitem_set.values_list(
+            "item", "quantity")), [(self.dish.pk, 10)])
+
+    def test_guest_cart_rejects_bad_quantities(self):
+        url = reverse("bufet_system:add-to-cart", args=[self.dish.pk])
+        for quantity in ("0", "-3", "abc"):
+            self.client.post(url, {"quantity": quantity})
+        self.assertNotIn(settings.BUFET_GUEST_CART_COOKIE,
+                         self.client.cookies)
+
     def test_order_create_view_with_cart(self):
         self.client.force_login(self.user)
         cart = ProductCart.objects.create(user=self.user)
@@ -83,3 +312,1314 @@ class BufetSystemViewsTest(TestCase):
         self.assertEqual(Order.objects.count(), 1)
         self.assertEqual(ProductCart.objects.get(id=cart.id).status,
                          ProductCart.STATUS_COMPLETED)
+
+
+@override_settings(BUFET_PERF_SAMPLE_RATE=1.0)
+class PerformanceInstrumentationTest(TestCase):
+    def setUp(self):
+        instrumentation.registry.reset()
+        self.staff = get_user_model().objects.create_user(
+            username="staff",
+            phone_number="123456789",
+            is_staff=True)
+
+    def test_sampled_response_has_server_timing_for_staff(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("bufet_system:menu"))
+        self.assertRegex(response["Server-Timing"],
+                         r'^db;dur=[\d.]+;desc="\d+ queries", '
+                         r'tpl;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_server_timing_is_hidden_from_visitors(self):
+        customer = get_user_model().objects.create_user(
+            username="customer",
+            phone_number="555")
+        response = self.client.get(reverse("bufet_system:menu"))
+        self.assertNotIn("Server-Timing", response)
+        self.client.force_login(customer)
+        response = self.client.get(reverse("bufet_system:menu"))
+        self.assertNotIn("Server-Timing", response)
+        with override_settings(BUFET_SERVER_TIMING_PUBLIC=True):
+            response = self.client.get(reverse("bufet_system:menu"))
+        self.assertIn("Server-Timing", response)
+        menu = instrumentation.registry.snapshot()["bufet_system:menu"]
+        self.assertEqual(menu["wall_ms"]["count"], 3)
+
+    async def test_async_pages_show_server_timing_to_staff(self):
+        url = reverse("bufet_system:async-menu")
+        response = await self.async_client.get(url)
+        self.assertNotIn("Server-Timing", response)
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get(url)
+        self.assertIn("Server-Timing", response)
+
+    @override_settings(BUFET_PERF_SAMPLE_RATE=0)
+    def test_unsampled_response_is_left_alone(self):
+        response = self.client.get(reverse("bufet_system:menu"))
+        self.assertNotIn("Server-Timing", response)
+
+    def test_staff_endpoint_reports_per_view_stats(self):
+        self.client.get(reverse("bufet_system:menu"))
+        self.client.get(reverse("bufet_system:menu"))
+        self.client.force_login(self.staff)
+        response = self.client.get(
+            reverse("bufet_system:performance-stats"))
+        menu = response.json()["views"]["bufet_system:menu"]
+        self.assertEqual(menu["wall_ms"]["count"], 2)
+        self.assertEqual(sum(menu["wall_ms"]["histogram"].values()), 2)
+        self.assertGreater(menu["response_bytes"]["p50"], 0)
+        self.assertIn("template_ms", menu)
+        self.assertIn("db_pools", response.json())
+
+    def test_endpoint_is_staff_only(self):
+        customer = get_user_model().objects.create_user(
+            username="customer",
+            phone_number="555")
+        self.client.force_login(customer)
+        response = self.client.get(
+            reverse("bufet_system:performance-stats"))
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(BUFET_QUERY_BUDGET_MODE="raise")
+class QueryBudgetTest(TestCase):
+    """Every page stays within its query budget with realistic data."""
+    rows = 20
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="testuser",
+            phone_number="123456789")
+        self.restaurants = [
+            Restaurant.objects.create(address=f"Address {i}")
+            for i in range(self.rows)]
+        self.dishes = [Dish.objects.create(name=f"Dish {i}",
+                                           ingredients="Ingredient 1",
+                                           price=9.99,
+                                           weight=200.0)
+                       for i in range(self.rows)]
+        cart = ProductCart.objects.get_or_create_draft(self.user)
+        for dish in self.dishes:
+            cart.add_product(dish, quantity=2)
+        for restaurant in self.restaurants:
+            Order.objects.create(user=self.user,
+                                 restaurant=restaurant,
+                                 total_price=10)
+        self.client.force_login(self.user)
+
+    def test_pages_stay_within_budget(self):
+        dish_id = self.dishes[0].id
+        for url in (reverse("bufet_system:index"),
+                    reverse("bufet_system:menu"),
+                    reverse("bufet_system:dish-detail", args=[dish_id]),
+                    reverse("bufet_system:restaurant-list"),
+                    reverse("bufet_system:product-cart"),
+                    reverse("bufet_system:order-checkout"),
+                    reverse("bufet_system:order-list")):
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+        for url_name in ("bufet_system:add-to-cart",
+                         "bufet_system:delete-from-cart"):
+            response = self.client.post(reverse(url_name, args=[dish_id]),
+                                        {"quantity": 1})
+            self.assertEqual(response.status_code, 302, url_name)
+        response = self.client.post(reverse("bufet_system:order-checkout"),
+                                    {"restaurant": self.restaurants[0].pk})
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(BUFET_QUERY_BUDGET_DEFAULT=12)
+    def test_admin_lists_stay_within_budget(self):
+        self.user.is_staff = True
+        self.user.is_superuser = True
+        self.user.save()
+        for url_name in ("admin:bufet_system_order_changelist",
+                         "admin:bufet_system_productcart_changelist"):
+            response = self.client.get(reverse(url_name))
+            self.assertEqual(response.status_code, 200, url_name)
+
+    @override_settings(BUFET_QUERY_BUDGETS={"bufet_system:order-list": 1})
+    def test_exceeding_budget_raises(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse("bufet_system:order-list"))
+
+
+@override_settings(BUFET_QUERY_BUDGET_MODE="raise")
+class CheckoutQueryBudgetTest(TransactionTestCase):
+    """Checkout stays within budget including its on-commit work.
+
+    The analytics rollup and counters run when the order transaction
+    commits, which only happens inside the request outside a TestCase.
+    """
+
+    def test_checkout_stays_within_budget(self):
+        # Earlier transaction tests flush the counter rows a deployed
+        # site always has.
+        stats.refresh_counters()
+        user = get_user_model().objects.create_user(
+            username="testuser",
+            phone_number="123456789")
+        restaurant = Restaurant.objects.create(address="Address")
+        cart = ProductCart.objects.get_or_create_draft(user)
+        for i in range(5):
+            cart.add_product(Dish.objects.create(name=f"Dish {i}",
+                                                 ingredients="Beet",
+                                                 price=9.99,
+                                                 weight=200.0))
+        self.client.force_login(user)
+        url = reverse("bufet_system:order-checkout")
+        for _ in range(2):
+            # The second order hits the rollup rows the first one made.
+            response = self.client.post(url, {"restaurant": restaurant.pk})
+            self.assertEqual(response.status_code, 302)
+            cart = ProductCart.objects.get_or_create_draft(user)
+            cart.add_product(Dish.objects.first())
+        self.assertEqual(DailyRestaurantStats.objects.get().orders_count, 2)
+
+
+@skipIf(connection.vendor == "sqlite",
+        "SQLite serialises writers with a database-wide lock")
+class CartConcurrencyTest(TransactionTestCase):
+    workers = 8
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="testuser",
+            phone_number="123456789")
+        self.dish = Dish.objects.create(name="Dish",
+                                        ingredients="Ingredient 1",
+                                        price=9.99,
+                                        weight=200.0)
+        ProductCart.objects.create(user=self.user, status="draft")
+
+    def _post(self, url_name):
+        client = Client()
+        client.force_login(self.user)
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                response = client.post(reverse(url_name,
+                                               args=[self.dish.id]),
+                                       {"quantity": 1})
+            return response.status_code, len(queries)
+        finally:
+            connection.close()
+
+    def _run_parallel(self, url_names):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(self._post, url_names))
+
+    def test_parallel_adds_do_not_lose_updates(self):
+        results = self._run_parallel(["bufet_system:add-to-cart"] * 20)
+        self.assertTrue(all(status == 302 for status, _ in results))
+        self.assertLessEqual(max(count for _, count in results), 14)
+        line = ProductCartItem.objects.get()
+        self.assertEqual(line.quantity, 20)
+        cart = ProductCart.objects.get()
+        self.assertEqual(cart.items_count, 20)
+
+    def test_parallel_adds_and_removes(self):
+        self._run_parallel(["bufet_system:add-to-cart"] * 10)
+        results = self._run_parallel(
+            ["bufet_system:add-to-cart", "bufet_system:delete-from-cart"]
+            * 5 + ["bufet_system:delete-from-cart"] * 4)
+        self.assertTrue(all(status == 302 for status, _ in results))
+        self.assertEqual(ProductCartItem.objects.get().quantity, 6)
+        self.assertEqual(ProductCart.objects.get().items_count, 6)
+
+
+class CartInsertRaceTest(TestCase):
+    """The lost-insert race of CartConcurrencyTest, replayed in order.
+
+    A second request inserts the line after this one's UPDATE found no
+    row and before its INSERT, so it runs on SQLite as well.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="testuser",
+            phone_number="123456789")
+        self.soup = Dish.objects.create(name="Soup", ingredients="Beet",
+                                        price=Decimal("4.50"), weight=300)
+        self.bread = Dish.objects.create(name="Bread", ingredients="Flour",
+                                         price=Decimal("1.25"), weight=100)
+        self.cart = ProductCart.objects.create(user=self.user)
+
+    def race(self, method, concurrent):
+        """Patch ``method`` to run ``concurrent`` once, before inserting."""
+        original = getattr(ProductCart, method)
+        pending = [concurrent]
+
+        def racing(cart, *args):
+            if pending:
+                pending.pop()(ProductCart.objects.get(pk=cart.pk))
+            return original(cart, *args)
+
+        return mock.patch.object(ProductCart, method, racing)
+
+    def assertCart(self, quantities):
+        self.assertEqual(dict(self.cart.productcartitem_set
+                              .values_list("item", "quantity")),
+                         {dish.pk: quantity
+                          for dish, quantity in quantities.items()})
+        # Each request only tracks its own deltas in memory, so compare
+        # the stored summary, which both shifted, with a recount.
+        self.cart.refresh_from_db()
+        stored = (self.cart.lines_count, self.cart.items_count,
+                  self.cart.total_price)
+        ProductCart.objects.filter(pk=self.cart.pk).recompute_summaries()
+        self.cart.refresh_from_db()
+        self.assertEqual(stored, (self.cart.lines_count,
+                                  self.cart.items_count,
+                                  self.cart.total_price))
+
+    def test_add_falls_back_to_update_after_lost_insert(self):
+        with self.race("_insert_line",
+                       lambda other: other.add_product(self.soup, 2)):
+            self.cart.add_product(self.soup, 3)
+        self.assertCart({self.soup: 5})
+        self.assertEqual(self.cart.total_price, Decimal("22.50"))
+
+    def test_batch_falls_back_to_single_lines_after_lost_insert(self):
+        with self.race("_insert_lines",
+                       lambda other: other.add_product(self.bread, 1)):
+            self.cart.set_quantities({self.soup: 2, self.bread: 4})
+        self.assertCart({self.soup: 2, self.bread: 4})
+        self.assertEqual(self.cart.total_price, Decimal("14.00"))
+
+
+class BatchCheckoutTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = get_user_model().objects.create_user(
+            username="staff",
+            phone_number="100",
+            is_staff=True)
+        self.users = [get_user_model().objects.create_user(
+            username=f"team{number}",
+            phone_number=f"20{number}") for number in range(3)]
+        self.restaurant = Restaurant.objects.create(address="Office street")
+        self.soup = Dish.objects.create(name="Soup", ingredients="Beet",
+                                        price=Decimal("4.50"), weight=300)
+        self.bread = Dish.objects.create(name="Bread", ingredients="Flour",
+                                         price=Decimal("1.25"), weight=100)
+        self.url = reverse("bufet_system:batch-checkout")
+        self.client.force_login(self.staff)
+
+    def post(self, orders):
+        return self.client.post(self.url,
+                                json.dumps({"orders": orders}),
+                                content_type="application/json")
+
+    def entry(self, user, **lines):
+        return {"user": user.pk,
+                "restaurant": self.restaurant.pk,
+                "lines": {str(getattr(self, name).pk): quantity
+                          for name, quantity in lines.items()}}
+
+    def test_places_valid_entries_and_reports_errors(self):
+        orders_before = SiteCounter.objects.get(name="orders").value
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post([
+                self.entry(self.users[0], soup=2, bread=1),
+                {**self.entry(self.users[1], soup=1), "lines": {"999": 1}},
+                self.entry(self.users[2], bread=4),
+                {"user": self.users[0].pk},
+            ])
+        body = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body["placed"], 2)
+        first, unknown, second, broken = body["results"]
+        self.assertEqual(first["total"], "10.25")
+        self.assertEqual(second["total"], "5.00")
+        self.assertEqual(unknown, {"errors": ["Unknown dish 999."]})
+        self.assertIn("errors", broken)
+
+        order = Order.objects.get(pk=first["order"])
+        self.assertEqual(order.user, self.users[0])
+        self.assertEqual(order.product_cart.status,
+                         ProductCart.STATUS_COMPLETED)
+        self.assertEqual(order.product_cart.get_cart_total(),
+                         Decimal("10.25"))
+        self.assertEqual(order.product_cart.items_count, 3)
+        self.assertEqual(SiteCounter.objects.get(name="orders").value,
+                         orders_before + 2)
+
+    def test_oversized_entries_are_rejected_without_losing_the_rest(self):
+        caviar = Dish.objects.create(name="Caviar", ingredients="Roe",
+                                     price=Decimal("99999999.00"),
+                                     weight=50)
+        response = self.post([
+            self.entry(self.users[0], soup=2),
+            self.entry(self.users[1], soup=10**12),
+            {**self.entry(self.users[2]),
+             "lines": [{"dish": self.soup.pk, "quantity": 60},
+                       {"dish": self.soup.pk, "quantity": 60}]},
+            {**self.entry(self.users[2]), "lines": {str(caviar.pk): 2}},
+        ])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["placed"], 1)
+        placed, huge, merged, expensive = body["results"]
+        self.assertEqual(placed["total"], "9.00")
+        self.assertIn("at most 99", huge["errors"][0])
+        self.assertIn("at most 99", merged["errors"][0])
+        self.assertIn("over the limit", expensive["errors"][0])
+        self.assertEqual(Order.objects.get().pk, placed["order"])
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        def queries(size):
+            orders = [self.entry(self.users[number % 3], soup=1, bread=2)
+                      for number in range(size)]
+            with CaptureQueriesContext(connection) as captured:
+                self.assertEqual(self.post(orders).json()["placed"], size)
+            return len(captured)
+
+        queries(1)  # warm the cached session and user
+        self.assertEqual(queries(2), queries(20))
+
+    def test_rejects_malformed_body(self):
+        response = self.client.post(self.url, "not json",
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(BUFET_BATCH_CHECKOUT_MAX=1)
+    def test_rejects_oversized_batch(self):
+        response = self.post([self.entry(self.users[0], soup=1)] * 2)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_staff_only(self):
+        self.client.force_login(self.users[0])
+        response = self.post([self.entry(self.users[0], soup=1)])
+        self.assertEqual(response.status_code, 403)
+
+
+class AnalyticsTest(TestCase):
+    def setUp(self):
+        self.staff = get_user_model().objects.create_user(
+            username="staff",
+            phone_number="100",
+            is_staff=True)
+        self.users = [get_user_model().objects.create_user(
+            username=f"eater{number}",
+            phone_number=f"30{number}") for number in range(2)]
+        self.restaurants = [Restaurant.objects.create(address=address)
+                            for address in ("North", "South")]
+        self.soup = Dish.objects.create(name="Soup", ingredients="Beet",
+                                        price=Decimal("4.50"), weight=300)
+        self.bread = Dish.objects.create(name="Bread", ingredients="Flour",
+                                         price=Decimal("1.25"), weight=100)
+        self.prices = {self.soup.pk: self.soup.price,
+                       self.bread.pk: self.bread.price}
+        self.url = reverse("bufet_system:analytics-report")
+
+    def plans(self, count):
+        return [(self.users[number % 2].pk,
+                 self.restaurants[number % 2].pk,
+                 {self.soup.pk: 1 + number % 3, self.bread.pk: 2})
+                for number in range(count)]
+
+    def rollups(self):
+        return (sorted(DailyRestaurantStats.objects.values_list(
+                    "day", "restaurant_id", "orders_count", "units",
+                    "revenue")),
+                sorted(DailyDishStats.objects.values_list(
+                    "day", "dish_id", "orders_count", "units", "revenue")))
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            checkout.write_orders(self.plans(5), self.prices)
+        with self.captureOnCommitCallbacks(execute=True):
+            checkout.write_orders(self.plans(3), self.prices)
+        incremental = self.rollups()
+        north = DailyRestaurantStats.objects.get(
+            restaurant=self.restaurants[0])
+        self.assertEqual(north.orders_count, 5)
+
+        analytics.backfill(*analytics.order_days())
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_orders_placed_through_the_model_are_recorded(self):
+        cart = ProductCart.objects.create(user=self.users[0])
+        cart.set_quantities({self.soup: 2})
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.create(user=self.users[0], restaurant=None,
+                                 total_price=cart.total_price,
+                                 product_cart=cart)
+        row = DailyRestaurantStats.objects.get(restaurant=None)
+        self.assertEqual((row.orders_count, row.units, row.revenue),
+                         (1, 2, Decimal("9.00")))
+        self.assertEqual(DailyDishStats.objects.get(dish=self.soup).units, 2)
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        def queries(plans):
+            orders = checkout.write_orders(plans, self.prices)
+            with CaptureQueriesContext(connection) as captured:
+                analytics.apply_orders(orders)
+            return len(captured)
+
+        queries(self.plans(2))
+        self.assertEqual(queries(self.plans(2)), queries(self.plans(20)))
+
+    def test_report_reads_rollups(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            checkout.write_orders(self.plans(4), self.prices)
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url, {"format": "json"})
+        body = response.json()
+        self.assertEqual(body["totals"]["orders"], 4)
+        self.assertEqual(Decimal(body["totals"]["revenue"]),
+                         sum(order.total_price
+                             for order in Order.objects.all()))
+        self.assertEqual(body["dishes"][0]["dish__name"], "Bread")
+        self.assertContains(self.client.get(self.url), "North")
+
+    def test_backfill_command_rebuilds_deleted_rows(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            checkout.write_orders(self.plans(3), self.prices)
+        expected = self.rollups()
+        DailyRestaurantStats.objects.all().delete()
+        DailyDishStats.objects.all().delete()
+        call_command("backfill_analytics", chunk_days=1, verbosity=0)
+        self.assertEqual(self.rollups(), expected)
+
+    def test_rejects_bad_dates(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url, {"start": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_staff_only(self):
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class DemandReportTest(TestCase):
+    def setUp(self):
+        self.staff = get_user_model().objects.create_user(
+            username="staff",
+            phone_number="100",
+            is_staff=True)
+        self.restaurants = [Restaurant.objects.create(address=address)
+                            for address in ("North", "South")]
+        self.dishes = [Dish.objects.create(name=f"Dish {number}",
+                                           ingredients="Salt",
+                                           price=Decimal(price),
+                                           weight=100)
+                       for number, price in enumerate(("4.50", "1.25",
+                                                       "12.00"))]
+        prices = {dish.pk: dish.price for dish in self.dishes}
+        plans = [(self.staff.pk,
+                  self.restaurants[number % 2].pk,
+                  {dish.pk: 1 + (number + index) % 4
+                   for index, dish in enumerate(self.dishes)
+                   if (number + index) % 3})
+                 for number in range(9)]
+        self.orders = checkout.write_orders(plans, prices)
+        self.today = timezone.localdate()
+        self.url = reverse("bufet_system:demand-report")
+
+    def test_matches_orm_aggregates_for_any_chunk_size(self):
+        values = sorted(order.total_price for order in self.orders)
+        by_dish = dict(
+            ProductCartItem.objects.values("item_id")
+            .annotate(units=Sum("quantity"))
+            .values_list("item_id", "units"))
+        for chunk_size in (1, 2, 7, 1000):
+            report = reports.build(self.today, self.today,
+                                   chunk_size=chunk_size)
+            self.assertEqual(report["orders"], 9)
+            self.assertEqual(report["revenue"], sum(values))
+            self.assertEqual(report["order_value"]["max"], values[-1])
+            self.assertEqual(sum(report["hourly_orders"]), 9)
+            self.assertEqual({row["dish"]: row["units"]
+                              for row in report["dishes"]}, by_dish)
+            north = report["restaurants"][
+                [row["address"] for row in report["restaurants"]]
+                .index("North")]
+            self.assertEqual(north["orders"], 5)
+            median = report["order_value"]["p50"]
+            self.assertLessEqual(values[4], median)
+            self.assertLessEqual(median - values[4],
+                                 values[4] * Decimal("0.01"))
+
+    def test_orders_of_deleted_restaurants_are_kept(self):
+        self.restaurants[1].delete()
+        report = reports.build(self.today, self.today)
+        deleted = [row for row in report["restaurants"]
+                   if row["restaurant"] is None]
+        self.assertEqual(deleted[0]["orders"], 4)
+
+    def test_accumulators_do_not_grow_with_ids(self):
+        far = Restaurant.objects.create(pk=2_000_000_000, address="Far")
+        dish = Dish.objects.create(pk=2_000_000_000, name="Far dish",
+                                   ingredients="Salt",
+                                   price=Decimal("2.00"), weight=100)
+        checkout.write_orders([(self.staff.pk, far.pk, {dish.pk: 2})],
+                              {dish.pk: dish.price})
+        report = reports.DemandReport()
+        for chunk in reports.stream_lines(self.today, self.today,
+                                          chunk_size=4):
+            report.add(chunk)
+        self.assertEqual(len(report.restaurant_units), 3)
+        self.assertEqual(len(report.dish_units), 4)
+        result = report.as_dict()
+        self.assertIn({"restaurant": far.pk, "address": "Far", "units": 2},
+                      [{key: row[key] for key in ("restaurant", "address",
+                                                  "units")}
+                       for row in result["restaurants"]])
+        self.assertIn((dish.pk, "Far dish", Decimal("4.00")),
+                      [(row["dish"], row["name"], row["revenue"])
+                       for row in result["dishes"]])
+
+    def test_empty_range(self):
+        report = reports.build(date(2000, 1, 1), date(2000, 1, 2))
+        self.assertEqual(report["orders"], 0)
+        self.assertEqual(report["restaurants"], [])
+
+    def test_view_returns_json_for_staff(self):
+        self.client.force_login(self.staff)
+        body = self.client.get(self.url).json()
+        self.assertEqual(body["orders"], 9)
+        self.assertEqual(len(body["hourly_units"]), 24)
+
+    def test_command_prints_summary(self):
+        output = StringIO()
+        call_command("demand_report", chunk_size=3, stdout=output)
+        self.assertIn("9 orders", output.getvalue())
+
+    def test_staff_only(self):
+        user = get_user_model().objects.create_user(username="eater",
+                                                    phone_number="300")
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class OrderExportTest(TestCase):
+    def setUp(self):
+        self.staff = get_user_model().objects.create_user(
+            username="staff",
+            phone_number="100",
+            email="staff@example.com",
+            is_staff=True)
+        self.restaurants = [Restaurant.objects.create(address=address)
+                            for address in ("North", "South, 2")]
+        self.soup = Dish.objects.create(name="Soup", ingredients="Beet",
+                                        price=Decimal("4.50"), weight=300)
+        self.bread = Dish.objects.create(name="Bread", ingredients="Flour",
+                                         price=Decimal("1.25"), weight=100)
+        plans = [(self.staff.pk,
+                  self.restaurants[number % 2].pk,
+                  {self.soup.pk: 1 + number, self.bread.pk: 2})
+                 for number in range(5)]
+        self.orders = checkout.write_orders(
+            plans, {self.soup.pk: self.soup.price,
+                    self.bread.pk: self.bread.price})
+        self.url = reverse("bufet_system:order-export")
+        self.client.force_login(self.staff)
+
+    def get(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content)
+
+    def test_csv_has_one_row_per_line(self):
+        response, body = self.get()
+        rows = list(csv.DictReader(io.StringIO(body.decode())))
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn("attachment", response["Content-Disposition"])
+        self.assertEqual(len(rows), 10)
+        first = [row for row in rows
+                 if row["order_id"] == str(self.orders[0].pk)]
+        self.assertEqual({row["dish"]: row["line_total"] for row in first},
+                         {"Soup": "4.50", "Bread": "2.50"})
+        self.assertEqual(first[0]["order_total"], "7.00")
+        self.assertEqual(first[0]["email"], "staff@example.com")
+
+    def test_jsonl_gzip_filtered_by_restaurant(self):
+        response, body = self.get(format="jsonl", gzip=1,
+                                  restaurant=self.restaurants[1].pk)
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        orders = [json.loads(line)
+                  for line in gzip.decompress(body).splitlines()]
+        self.assertEqual([order["id"] for order in orders],
+                         [order.pk for order in self.orders[1::2]])
+        self.assertEqual(orders[0]["restaurant"]["address"], "South, 2")
+        self.assertEqual(len(orders[0]["lines"]), 2)
+
+    def test_csv_quotes_cells_a_spreadsheet_would_run(self):
+        self.staff.username = "@staff"
+        self.staff.email = "-staff@example.com"
+        self.staff.save()
+        self.restaurants[0].address = "+North"
+        self.restaurants[0].save()
+        ProductCartItem.objects.filter(item=self.soup).update(
+            dish_name="=HYPERLINK(\"http://example.com\")")
+        _, body = self.get()
+        rows = list(csv.DictReader(io.StringIO(body.decode())))
+        north = [row for row in rows if row["restaurant_id"]
+                 == str(self.restaurants[0].pk)]
+        self.assertEqual(north[0]["restaurant"], "'+North")
+        self.assertEqual({row["username"] for row in rows}, {"'@staff"})
+        self.assertEqual({row["email"] for row in rows},
+                         {"'-staff@example.com"})
+        self.assertEqual({row["dish"] for row in rows},
+                         {"'=HYPERLINK(\"http://example.com\")", "Bread"})
+        self.assertEqual({row["order_total"] for row in rows
+                          if row["order_id"] == str(self.orders[0].pk)},
+                         {"7.00"})
+
+    def test_formats_keep_microseconds(self):
+        Order.objects.filter(pk=self.orders[0].pk).update(
+            created_at=self.orders[0].created_at.replace(microsecond=123456))
+        created_at = Order.objects.get(pk=self.orders[0].pk).created_at
+        _, body = self.get()
+        rows = {row["order_id"]: row
+                for row in csv.DictReader(io.StringIO(body.decode()))}
+        _, lines = self.get(format="jsonl")
+        orders = {order["id"]: order
+                  for order in map(json.loads, lines.splitlines())}
+        pk = self.orders[0].pk
+        self.assertEqual(rows[str(pk)]["created_at"], created_at.isoformat())
+        self.assertEqual(orders[pk]["created_at"], created_at.isoformat())
+        self.assertIn(".123456", orders[pk]["created_at"])
+
+    def test_chunked_export_matches_single_chunk(self):
+        today = timezone.localdate()
+        with CaptureQueriesContext(connection) as captured:
+            chunked = list(exports.records(today, today, chunk_size=2))
+        self.assertEqual(list(exports.records(today, today)), chunked)
+        self.assertEqual([order[0] for order, _ in chunked],
+                         [order.pk for order in self.orders])
+        # One query for the orders plus one per chunk of two orders.
+        self.assertEqual(len(captured), 4)
+
+    def test_command_writes_gzip_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "orders.csv.gz")
+            call_command("export_orders", output=path, gzip=True,
+                         stderr=StringIO())
+            with gzip.open(path, "rt") as export:
+                self.assertEqual(len(export.read().splitlines()), 11)
+
+    def test_command_writes_to_stdout(self):
+        raw = io.BytesIO()
+        stdout = io.TextIOWrapper(raw, write_through=True)
+        call_command("export_orders", gzip=True, stdout=stdout)
+        lines = gzip.decompress(raw.getvalue()).decode().splitlines()
+        self.assertEqual(len(lines), 11)
+
+        stdout = StringIO()
+        call_command("export_orders", format="jsonl", stdout=stdout)
+        self.assertEqual(len(stdout.getvalue().splitlines()),
+                         len(self.orders))
+        with self.assertRaises(CommandError):
+            call_command("export_orders", gzip=True, stdout=StringIO())
+
+    def test_rejects_unknown_format(self):
+        response = self.client.get(self.url, {"format": "xml"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_staff_only(self):
+        user = get_user_model().objects.create_user(username="eater",
+                                                    phone_number="300")
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.borscht = Dish.objects.create(name="Borscht",
+                                           ingredients="Beet, cabbage, dill",
+                                           price=Decimal("4.50"), weight=300)
+        self.varenyky = Dish.objects.create(name="Varenyky",
+                                            ingredients="Potato, cheese",
+                                            price=Decimal("3.00"),
+                                            weight=250)
+        self.salad = Dish.objects.create(name="Beet salad",
+                                         ingredients="Beet, walnuts",
+                                         price=Decimal("2.75"), weight=200)
+        self.url = reverse("bufet_system:menu")
+
+    def names(self, query):
+        return [dish.name for dish in search.search_dishes(query)]
+
+    def test_uses_an_index_backed_backend(self):
+        self.assertEqual(search.backend(),
+                         {"postgresql": "postgresql",
+                          "sqlite": "fts5"}[connection.vendor])
+
+    def test_matches_prefixes_and_ranks_names_first(self):
+        self.assertEqual(self.names("bor"), ["Borscht"])
+        self.assertEqual(self.names("beet"), ["Beet salad", "Borscht"])
+        self.assertEqual(self.names("beet walnut"), ["Beet salad"])
+        self.assertEqual(self.names("cheese"), ["Varenyky"])
+        self.assertEqual(self.names("  ?! "), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.varenyky.name = "Pelmeni"
+        self.varenyky.save()
+        self.assertEqual(self.names("pelmeni"), ["Pelmeni"])
+        self.assertEqual(self.names("varenyky"), [])
+        self.salad.delete()
+        self.assertEqual(self.names("beet"), ["Borscht"])
+
+    def test_menu_search_bypasses_page_cache(self):
+        self.client.get(self.url)
+        response = self.client.get(self.url, {"q": "beet"})
+        self.assertEqual([dish.name for dish in response.context["dishes"]],
+                         ["Beet salad", "Borscht"])
+        self.assertContains(response, 'value="beet"')
+        response = self.client.get(self.url, {"q": "potato"})
+        self.assertEqual(list(response.context["dishes"]), [self.varenyky])
+        self.assertContains(self.client.get(self.url, {"q": "sushi"}),
+                            "No dishes match")
+        response = self.client.get(self.url)
+        self.assertEqual(response.context["paginator"].count, 3)
+
+    def test_admin_search_uses_index(self):
+        admin = get_user_model().objects.create_superuser(
+            username="admin", phone_number="1", password="x")
+        self.client.force_login(admin)
+        response = self.client.get(
+            reverse("admin:bufet_system_dish_changelist"), {"q": "beet"})
+        self.assertEqual(
+            {dish.name for dish in response.context["cl"].result_list},
+            {"Beet salad", "Borscht"})
+
+    @skipIf(connection.vendor != "sqlite", "SQLite FTS5 triggers")
+    def test_fts_triggers_exist_after_migrate(self):
+        self.assertEqual(fts_schema.fts_triggers(connection),
+                         set(fts_schema.FTS_TRIGGERS))
+
+    @skipIf(connection.vendor != "postgresql", "PostgreSQL index")
+    def test_postgresql_query_can_use_gin_index(self):
+        queryset = search.search_dishes("beet")
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            plan = queryset.explain()
+        self.assertIn("dish_search_idx", plan)
+
+
+@skipIf(connection.vendor != "sqlite", "SQLite FTS5 triggers")
+class SearchTriggerTest(TransactionTestCase):
+    def test_restore_after_table_rebuild(self):
+        self.addCleanup(self.restore)
+        with connection.schema_editor() as editor:
+            # What SQLite does for changes it cannot make in place.
+            editor._remake_table(Dish)
+        self.assertEqual(fts_schema.fts_triggers(connection), set())
+        self.restore()
+        self.assertEqual(fts_schema.fts_triggers(connection),
+                         set(fts_schema.FTS_TRIGGERS))
+        Dish.objects.create(name="Solyanka", ingredients="Olives",
+                            price=Decimal("5.00"), weight=300)
+        self.assertEqual([dish.name for dish in
+                          search.search_dishes("solyanka")], ["Solyanka"])
+
+    def restore(self):
+        with connection.schema_editor() as editor:
+            fts_schema.restore_fts_triggers(None, editor)
+
+
+class IngredientFilterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        for name, text in (("Borscht", "Beet, cabbage, sour cream"),
+                           ("Deruny", "Potato, eggs, flour"),
+                           ("Beet salad", "Beet, walnuts"),
+                           ("Kulish", "Millet, potato, onion")):
+            Dish.objects.create(name=name, ingredients=text,
+                                price=Decimal("3.00"), weight=250)
+        self.url = reverse("bufet_system:menu")
+
+    def names(self, **filters):
+        return [dish.name for dish in
+                ingredients.filter_dishes(Dish.objects.all(), **filters)]
+
+    def test_include_and_exclude_ingredients(self):
+        self.assertEqual(self.names(include=["beet"]),
+                         ["Beet salad", "Borscht"])
+        self.assertEqual(self.names(include=["beet", "cabbage"]),
+                         ["Borscht"])
+        self.assertEqual(self.names(exclude=["beet", "eggs"]), ["Kulish"])
+        self.assertEqual(self.names(include=["saffron"]), [])
+        self.assertEqual(len(self.names(exclude=["saffron"])), 4)
+
+    def test_free_of_allergens_needs_no_join(self):
+        queryset = ingredients.filter_dishes(Dish.objects.all(),
+                                             free_of=["milk", "nuts"])
+        self.assertNotIn("JOIN", str(queryset.query))
+        self.assertNotIn("ingredient_set", str(queryset.query))
+        self.assertEqual([dish.name for dish in queryset],
+                         ["Deruny", "Kulish"])
+
+    def test_menu_filters_combine_with_search(self):
+        self.client.get(self.url)
+        response = self.client.get(self.url, {"q": "beet",
+                                              "without": "Walnuts",
+                                              "free_of": ["gluten", "bogus"]})
+        self.assertEqual([dish.name for dish in response.context["dishes"]],
+                         ["Borscht"])
+        self.assertEqual(response.context["without"], "walnuts")
+        self.assertEqual(response.context["free_of"], ["gluten"])
+
+        response = self.client.get(self.url, {"with": "potato, flour"})
+        self.assertEqual([dish.name for dish in response.context["dishes"]],
+                         ["Deruny"])
+        response = self.client.get(self.url, {"free_of": "gluten"})
+        self.assertEqual(len(response.context["dishes"]), 3)
+        self.assertContains(self.client.get(self.url, {"with": "saffron"}),
+                            "No dishes match")
+
+    def test_admin_edits_allergens_as_choices(self):
+        admin = get_user_model().objects.create_superuser(
+            username="admin", phone_number="1", password="x")
+        self.client.force_login(admin)
+        millet = Ingredient.objects.get(name="millet")
+        url = reverse("admin:bufet_system_ingredient_change",
+                      args=[millet.pk])
+        response = self.client.post(url, {"name": "millet",
+                                          "allergens": ["gluten", "soy"]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            ingredients.allergen_names(Dish.objects.get(
+                name="Kulish").allergens), ["gluten", "soy"])
+        self.assertEqual(
+            self.client.get(url).context["adminform"].form["allergens"]
+            .value(), ["gluten", "soy"])
+
+    def test_dish_page_lists_allergens(self):
+        dish = Dish.objects.get(name="Deruny")
+        response = self.client.get(reverse("bufet_system:dish-detail",
+                                           args=[dish.pk]))
+        self.assertContains(response, "gluten, eggs")
+
+
+class CartApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="customer",
+            phone_number="300")
+        self.soup = Dish.objects.create(name="Soup", ingredients="Beet",
+                                        price=Decimal("4.50"), weight=300)
+        self.bread = Dish.objects.create(name="Bread", ingredients="Flour",
+                                         price=Decimal("1.25"), weight=100)
+        self.url = reverse("bufet_system:cart-api")
+        self.client.force_login(self.user)
+
+    def post(self, payload):
+        return self.client.post(self.url, json.dumps(payload),
+                                content_type="application/json")
+
+    def test_batch_update_returns_summary(self):
+        response = self.post({str(self.soup.pk): 2, str(self.bread.pk): 3})
+        self.assertEqual(response.json(), {"lines_count": 2,
+                                           "items_count": 5,
+                                           "total_price": "12.75"})
+        response = self.post({str(self.soup.pk): 0, str(self.bread.pk): 1})
+        self.assertEqual(response.json(), {"lines_count": 1,
+                                           "items_count": 1,
+                                           "total_price": "1.25"})
+
+    def test_get_lists_lines(self):
+        self.post({str(self.soup.pk): 2})
+        body = self.client.get(self.url).json()
+        self.assertEqual(body["lines"], [{"dish": self.soup.pk,
+                                          "name": "Soup",
+                                          "price": "4.50",
+                                          "quantity": 2,
+                                          "subtotal": "9.00"}])
+
+    def test_removing_without_cart_creates_nothing(self):
+        response = self.post({str(self.soup.pk): 0})
+        self.assertEqual(response.json()["lines_count"], 0)
+        self.assertFalse(ProductCart.objects.exists())
+
+    def test_rejects_unknown_dishes_and_bad_payloads(self):
+        response = self.post({"999": 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["dishes"], [999])
+        self.assertEqual(self.post(["not", "a", "mapping"]).status_code, 400)
+        self.assertEqual(self.post({"soup": 1}).status_code, 400)
+
+    def test_rejects_quantities_that_are_not_small_whole_numbers(self):
+        dish = str(self.soup.pk)
+        for quantity in (1.9, 2.0, True, "3", None, [1], -1, 100, 10**20):
+            response = self.post({dish: quantity})
+            self.assertEqual(response.status_code, 400, quantity)
+        self.assertFalse(ProductCart.objects.exists())
+        with override_settings(BUFET_CART_MAX_QUANTITY=5):
+            self.assertEqual(self.post({dish: 6}).status_code, 400)
+            self.assertEqual(self.post({dish: 5}).json()["items_count"], 5)
+
+    def test_requires_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        response = client.post(self.url, json.dumps({str(self.soup.pk): 1}),
+                               content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+        client.force_login(self.user)
+        response = client.post(self.url, json.dumps({str(self.soup.pk): 1}),
+                               content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+
+    def test_guests_use_the_guest_cart(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).json()["lines"], [])
+        response = self.post({str(self.soup.pk): 2, str(self.bread.pk): 1})
+        self.assertEqual(response.json(), {"lines_count": 2,
+                                           "items_count": 3,
+                                           "total_price": "10.25"})
+        self.assertEqual(self.client.get(self.url).json()["items_count"], 3)
+        self.assertFalse(ProductCartItem.objects.exists())
+
+
+class GuestCartTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="customer", phone_number="350", password="Secret-123")
+        self.soup = Dish.objects.create(name="Soup", ingredients="Beet",
+                                        price=Decimal("4.50"), weight=300)
+        self.bread = Dish.objects.create(name="Bread", ingredients="Flour",
+                                         price=Decimal("1.25"), weight=100)
+
+    def add(self, dish, quantity=1):
+        return self.client.post(reverse("bufet_system:add-to-cart",
+                                        args=[dish.pk]),
+                                {"quantity": quantity})
+
+    def writes(self, action):
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            if sql.lstrip().upper().startswith(("INSERT", "UPDATE",
+                                                "DELETE")):
+                statements.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            action()
+        return statements
+
+    def test_guest_cart_lives_in_a_cookie(self):
+        def browse():
+            self.add(self.soup, 2)
+            self.add(self.bread)
+            self.client.post(reverse("bufet_system:delete-from-cart",
+                                     args=[self.bread.pk]))
+            self.add(self.bread, 3)
+
+        self.assertEqual(self.writes(browse), [])
+        self.assertIn(settings.BUFET_GUEST_CART_COOKIE, self.client.cookies)
+        response = self.client.get(reverse("bufet_system:product-cart"))
+        self.assertEqual([(line.name, line.quantity)
+                          for line in response.context["lines"]],
+                         [("Bread", 3), ("Soup", 2)])
+        self.assertEqual(response.context["total_price"], Decimal("12.75"))
+        self.assertEqual(response.context["cart_items_count"], 5)
+
+    def test_tampered_cookie_is_dropped(self):
+        self.add(self.soup)
+        cookie = self.client.cookies[settings.BUFET_GUEST_CART_COOKIE]
+        cookie.set(cookie.key, cookie.value + "x", cookie.value + "x")
+        response = self.client.get(reverse("bufet_system:product-cart"))
+        self.assertEqual(list(response.context["lines"]), [])
+        self.assertEqual(
+            self.client.cookies[settings.BUFET_GUEST_CART_COOKIE].value, "")
+
+    @override_settings(BUFET_GUEST_CART_MAX_LINES=1)
+    def test_guest_cart_is_capped(self):
+        self.add(self.soup)
+        response = self.client.post(reverse("bufet_system:add-to-cart",
+                                            args=[self.bread.pk]),
+                                    follow=True)
+        self.assertIn("Your cart is full. Log in to add more dishes.",
+                      [str(message)
+                       for message in response.context["messages"]])
+        self.add(self.soup)
+        response = self.client.get(reverse("bufet_system:product-cart"))
+        self.assertEqual([(line.name, line.quantity)
+                          for line in response.context["lines"]],
+                         [("Soup", 2)])
+
+    def test_login_merges_into_draft_cart(self):
+        draft = ProductCart.objects.get_or_create_draft(self.user)
+        draft.add_product(self.soup)
+        self.add(self.soup, 2)
+        self.add(self.bread)
+        self.client.post(reverse("login"), {"username": "customer",
+                                            "password": "Secret-123"})
+
+        draft.refresh_from_db()
+        self.assertEqual(
+            dict(draft.productcartitem_set.values_list("item_id",
+                                                       "quantity")),
+            {self.soup.pk: 3, self.bread.pk: 1})
+        self.assertEqual((draft.lines_count, draft.items_count,
+                          draft.total_price), (2, 4, Decimal("14.75")))
+        self.assertEqual(
+            self.client.cookies[settings.BUFET_GUEST_CART_COOKIE].value, "")
+
+        # Logging in again must not add the same lines twice.
+        self.client.logout()
+        self.client.post(reverse("login"), {"username": "customer",
+                                            "password": "Secret-123"})
+        draft.refresh_from_db()
+        self.assertEqual(draft.items_count, 4)
+
+
+class CatalogTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="customer", phone_number="370")
+        self.soup = Dish.objects.create(name="Soup", ingredients="Beet",
+                                        price=Decimal("4.50"), weight=300)
+        self.add_url = reverse("bufet_system:add-to-cart",
+                               args=[self.soup.pk])
+
+    def test_add_to_cart_reads_no_dish_rows(self):
+        self.client.force_login(self.user)
+        self.client.post(self.add_url)
+        table = connection.ops.quote_name(Dish._meta.db_table)
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            self.client.post(self.add_url, {"quantity": 2})
+        self.assertTrue(statements)
+        self.assertEqual([sql for sql in statements if table in sql], [])
+        cart = ProductCart.objects.draft_for(self.user)
+        self.assertEqual(cart.items_count, 3)
+        self.assertEqual(cart.total_price, Decimal("13.50"))
+
+    def test_snapshot_follows_dish_changes(self):
+        snapshot = catalog.get_catalog()
+        self.assertIs(catalog.get_catalog(), snapshot)
+        self.assertEqual(snapshot.dishes[self.soup.pk].price, Decimal("4.50"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.soup.price = Decimal("5.00")
+            self.soup.save()
+        self.assertEqual(catalog.get_catalog().dishes[self.soup.pk].price,
+                         Decimal("5.00"))
+        self.assertEqual(snapshot.dishes[self.soup.pk].price, Decimal("4.50"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.soup.delete()
+        self.assertNotIn(self.soup.pk, catalog.get_catalog().dishes)
+        self.assertEqual(self.client.post(self.add_url).status_code, 404)
+
+    def test_flushed_cache_reloads_snapshot(self):
+        snapshot = catalog.get_catalog()
+        cache.clear()
+        self.assertIsNot(catalog.get_catalog(), snapshot)
+
+
+class CachedAuthTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="customer", phone_number="360", password="Secret-123")
+        self.client.force_login(self.user)
+        self.url = reverse("bufet_system:index")
+        self.client.get(self.url)
+
+    def test_pages_skip_session_and_user_tables_once_cached(self):
+        tables = ("django_session", get_user_model()._meta.db_table)
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = self.client.get(self.url)
+        self.assertEqual(response.wsgi_request.user, self.user)
+        self.assertEqual([sql for sql in statements
+                          if any(table in sql for table in tables)], [])
+
+    def test_snapshot_leaves_out_the_password(self):
+        cached = cache.get(user_key(self.user.pk))
+        self.assertNotIn("password", cached["fields"])
+        self.assertNotIn(self.user.password, repr(cached))
+
+        user = self.client.get(self.url).wsgi_request.user
+        self.assertIn("password", user.get_deferred_fields())
+        user.first_name = "Olena"
+        user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "Olena")
+        self.assertTrue(self.user.check_password("Secret-123"))
+
+    def test_sessions_of_the_stock_backend_stay_signed_in(self):
+        client = Client()
+        client.force_login(self.user,
+                           backend="django.contrib.auth.backends.ModelBackend")
+        response = client.get(self.url)
+        self.assertEqual(response.wsgi_request.user, self.user)
+
+    def test_wrong_password_is_checked_once(self):
+        table = get_user_model()._meta.db_table
+        lookups = []
+
+        def record(execute, sql, params, many, context):
+            if table in sql:
+                lookups.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            self.assertIsNone(authenticate(username="customer",
+                                           password="wrong"))
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(authenticate(username="customer",
+                                      password="Secret-123"), self.user)
+
+    def test_saving_the_user_drops_the_cached_snapshot(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = "Olena"
+            self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.wsgi_request.user.first_name, "Olena")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        response = self.client.get(self.url)
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+
+
+@override_settings(BUFET_ASYNC_PARALLEL_QUERIES=False)
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="customer",
+            phone_number="400")
+        self.restaurant = Restaurant.objects.create(address="Async street")
+        self.dishes = [Dish.objects.create(name=f"Async dish {number}",
+                                           ingredients="Beet",
+                                           price=Decimal("3.00"),
+                                           weight=200)
+                       for number in range(7)]
+
+    def test_index(self):
+        stats.refresh_counters()
+        response = self.client.get(reverse("bufet_system:async-index"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["num_restaurants"], 1)
+
+    def test_menu_pages_match_sync_view(self):
+        url = reverse("bufet_system:async-menu")
+        response = self.client.get(url, {"page": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["dishes"]), 2)
+        self.assertTrue(response.context["is_paginated"])
+        cached = self.client.get(url, {"page": 2})
+        self.assertEqual(list(cached.context["dishes"]),
+                         list(response.context["dishes"]))
+        self.assertEqual(self.client.get(url, {"page": 9}).status_code, 404)
+
+    def test_menu_search_and_filters_match_sync_view(self):
+        Dish.objects.create(name="Async salad", ingredients="Beet, walnuts",
+                            price=Decimal("2.00"), weight=150)
+        for params in ({"q": "async dish"},
+                       {"without": "walnuts", "page": 2},
+                       {"q": "async", "free_of": "nuts"}):
+            expected = self.client.get(reverse("bufet_system:menu"), params)
+            response = self.client.get(reverse("bufet_system:async-menu"),
+                                       params)
+            self.assertEqual(response.status_code, 200, params)
+            self.assertEqual([dish.pk for dish in response.context["dishes"]],
+                             [dish.pk for dish in expected.context["dishes"]])
+            for key in ("query", "with", "without", "free_of", "narrowed"):
+                self.assertEqual(response.context[key],
+                                 expected.context[key], key)
+        response = self.client.get(reverse("bufet_system:async-menu"),
+                                   {"q": "async", "free_of": "nuts"})
+        self.assertNotIn("Async salad",
+                         [dish.name for dish in response.context["dishes"]])
+
+    @override_settings(BUFET_QUERY_BUDGET_MODE="raise",
+                       BUFET_QUERY_BUDGETS={"bufet_system:async-menu": 0})
+    async def test_middleware_stays_async_under_asgi(self):
+        async def view(request):
+            pass
+
+        for middleware in (QueryBudgetMiddleware, PerformanceMiddleware,
+                           GuestCartMiddleware):
+            self.assertTrue(iscoroutinefunction(middleware(view)))
+            self.assertFalse(iscoroutinefunction(middleware(lambda r: r)))
+        with self.assertRaises(QueryBudgetExceeded):
+            await self.async_client.get(reverse("bufet_system:async-menu"),
+                                        {"q": "async"})
+
+    def test_checkout_requires_login(self):
+        response = self.client.get(
+            reverse("bufet_system:async-order-checkout"))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("/accounts/login/", response["Location"])
+
+    def test_cart_shows_the_guest_cart(self):
+        self.client.post(reverse("bufet_system:add-to-cart",
+                                 args=[self.dishes[0].pk]),
+                         {"quantity": 2})
+        response = self.client.get(reverse("bufet_system:async-product-cart"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Async dish 0")
+        self.assertEqual(len(response.context["lines"]), 1)
+        self.assertEqual(response.context["total_price"], Decimal("6.00"))
+
+    def test_cart_and_checkout_show_lines(self):
+        cart = ProductCart.objects.get_or_create_draft(self.user)
+        cart.add_product(self.dishes[0], quantity=2)
+        self.client.force_login(self.user)
+
+        response = self.client.get(
+            reverse("bufet_system:async-product-cart"))
+        self.assertEqual(len(response.context["lines"]), 1)
+        self.assertEqual(response.context["total_price"], Decimal("6.00"))
+
+        response = self.client.get(
+            reverse("bufet_system:async-order-checkout"))
+        self.assertEqual(response.context["total_price"], Decimal("6.00"))
+        self.assertEqual(response.context["lines"][0].quantity, 2)
+        self.assertContains(response, "Async street")
+
+    def test_checkout_form_reuses_fetched_restaurants(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse("bufet_system:async-order-checkout"))
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(reverse("bufet_system:async-order-checkout"))
+        restaurant_queries = [query for query in captured
+                              if "bufet_system_restaurant" in query["sql"]]
+        self.assertEqual(len(restaurant_queries), 1)
+
+    @override_settings(BUFET_ASYNC_PARALLEL_QUERIES=True)
+    def test_gather_queries_keeps_order_when_parallel(self):
+        results = async_to_sync(gather_queries)(lambda: 1, lambda: 2)
+        self.assertEqual(results, [1, 2])
+
+    @override_settings(BUFET_ASYNC_PARALLEL_QUERIES=True)
+    def test_queries_in_worker_threads_are_collected(self):
+        def query():
+            try:
+                # A table this test's transaction has not written to, so
+                # SQLite's shared in-memory database does not lock it.
+                return Order.objects.exists()
+            finally:
+                connection.close()
+
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with instrumentation.collect(record):
+            async_to_sync(gather_queries)(query, query)
+        self.assertEqual(len(queries), 2)
@@ -1,12 +1,22 @@
-from django.urls import path
+from django.urls import include, path
 
+from bufet_system.async_views import (AsyncIndexView,
+                                      AsyncMenuListView,
+                                      AsyncOrderCheckoutView,
+                                      AsyncProductCartListView)
 from bufet_system.views import (MenuListView,
                                 ProductCartListView,
                                 OrderCreateView,
                                 DishDetailView,
                                 RestaurantListView,
                                 AddToCartView,
-                                DeleteFromCartView, OrderListView, IndexView)
+                                DeleteFromCartView, OrderListView, IndexView,
+                                PerformanceStatsView,
+                                AnalyticsReportView,
+                                DemandReportView,
+                                OrderExportView,
+                                BatchCheckoutView,
+                                CartApiView)
 
 urlpatterns = [
     path("", IndexView.as_view(), name="index"),
@@ -21,7 +31,33 @@ urlpatterns = [
     path("add-to-cart/<int:dish_id>/",
          AddToCartView.as_view(),
          name="add-to-cart"),
-    path("orders/", OrderListView.as_view(), name="order-list")
+    path("orders/", OrderListView.as_view(), name="order-list"),
+    path("api/cart/", CartApiView.as_view(), name="cart-api"),
+    path("performance/",
+         PerformanceStatsView.as_view(),
+         name="performance-stats"),
+    path("analytics/",
+         AnalyticsReportView.as_view(),
+         name="analytics-report"),
+    path("analytics/demand/",
+         DemandReportView.as_view(),
+         name="demand-report"),
+    path("orders/export/",
+         OrderExportView.as_view(),
+         name="order-export"),
+    path("checkout/batch/",
+         BatchCheckoutView.as_view(),
+         name="batch-checkout"),
+    path("async/", include([
+        path("", AsyncIndexView.as_view(), name="async-index"),
+        path("menu/", AsyncMenuListView.as_view(), name="async-menu"),
+        path("product_cart/",
+             AsyncProductCartListView.as_view(),
+             name="async-product-cart"),
+        path("checkout/",
+             AsyncOrderCheckoutView.as_view(),
+             name="async-order-checkout"),
+    ])),
 ]
 
 app_name = "bufet_system"
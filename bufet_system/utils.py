@@ -0,0 +1,10 @@
+def batched(iterable, size):
+    """Lists of up to ``size`` consecutive items of ``iterable``."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
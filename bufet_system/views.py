@@ -1,61 +1,162 @@
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.shortcuts import render, get_object_or_404, redirect
+import json
+import os
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import render, redirect
 from django.urls import reverse_lazy
+from django.utils import timezone
 from django.views import generic, View
 from django.contrib import messages
+from . import (analytics, caching, catalog, checkout, exports,
+               ingredients, instrumentation, pool, reports, search)
+from .caching import CachedObjectMixin, CachedPageMixin
+from .cart import forget_draft_cart, get_draft_cart, get_guest_cart
 from .forms import OrderForm, AddToCartForm
-from .models import Dish, Restaurant, Order, User, ProductCart, ProductCartItem
+from .pagination import CursorPaginationMixin
+from .stats import get_site_stats
+from .models import (Dish, Ingredient, Restaurant, Order, ProductCart,
+                     ProductCartItem)
 from django.db import IntegrityError, transaction
 
 
 class IndexView(View):
     def get(self, request):
-        num_restaurants = Restaurant.objects.count()
-        num_orders = Order.objects.count()
-        num_users = User.objects.count()
+        site_stats = get_site_stats()
 
         context = {
-            "num_restaurants": num_restaurants,
-            "num_orders": num_orders,
-            "num_users": num_users
+            "num_restaurants": site_stats["restaurants"],
+            "num_orders": site_stats["orders"],
+            "num_users": site_stats["users"]
 
         }
         return render(request, "bufet_system/index.html", context=context)
 
 
+def menu_filters(params):
+    """``ingredients.filter_dishes`` arguments from the menu query string."""
+    return {
+        "include": ingredients.parse(",".join(params.getlist("with"))),
+        "exclude": ingredients.parse(",".join(params.getlist("without"))),
+        "free_of": [allergen for allergen in params.getlist("free_of")
+                    if allergen in Ingredient.ALLERGENS],
+    }
+
+
+def narrowed_menu(query, filters):
+    """Dishes matching a menu search and filters; ``None`` without either."""
+    if not query and not any(filters.values()):
+        return None
+    queryset = search.search_dishes(query) if query else Dish.objects.all()
+    return ingredients.filter_dishes(queryset, **filters)
+
+
+def menu_context(query, filters):
+    """Template context echoing a menu search and filters back."""
+    return {
+        "query": query,
+        "with": ", ".join(filters["include"]),
+        "without": ", ".join(filters["exclude"]),
+        "free_of": filters["free_of"],
+        "allergens": Ingredient.ALLERGENS,
+        "narrowed": bool(query or any(filters.values())),
+    }
+
+
 class MenuListView(generic.ListView):
+    """The menu, or with ``?q=`` the dishes matching a search, best first.
+
+    ``?with=`` and ``?without=`` take comma-separated ingredient names and
+    ``?free_of=`` an allergen (repeatable). The plain menu is paged from
+    the in-process catalog snapshot; searched or filtered results are
+    queried, since the indexes answer them quickly.
+    """
     model = Dish
     context_object_name = "dishes"
     template_name = "bufet_system/menu.html"
     paginate_by = 5
 
+    def get_search_query(self):
+        return self.request.GET.get("q", "").strip()
+
+    def get_filters(self):
+        return menu_filters(self.request.GET)
+
+    def is_narrowed(self):
+        return bool(self.get_search_query()
+                    or any(self.get_filters().values()))
 
-class AddToCartView(LoginRequiredMixin, View):
+    def get_queryset(self):
+        queryset = narrowed_menu(self.get_search_query(), self.get_filters())
+        if queryset is None:
+            return catalog.get_catalog().menu
+        return queryset
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(menu_context(self.get_search_query(),
+                                    self.get_filters()))
+        return context
+
+
+class CartQuantityMixin:
+    """Read the ``quantity`` a cart form posted, 1 when it is missing."""
     form_class = AddToCartForm
+
+    def get_quantity(self, request):
+        quantity = request.POST.get("quantity", 1)
+        form = self.form_class({"quantity": quantity})
+        if not form.is_valid():
+            messages.error(request,
+                           f"The quantity must be a whole number from 1 "
+                           f"to {settings.BUFET_CART_MAX_QUANTITY}.")
+            return None
+        return form.cleaned_data["quantity"]
+
+
+class AddToCartView(CartQuantityMixin, View):
+    """Add a dish to the draft cart, or to the guest cart when anonymous.
+
+    The dish comes from the catalog snapshot and the guest cart lives in
+    a signed cookie, so visitors who never log in cause no database
+    access at all.
+    """
     success_url = reverse_lazy("bufet_system:product-cart")
 
     def post(self, request, dish_id):
-        dish = get_object_or_404(Dish, pk=dish_id)
-        cart, created = ProductCart.objects.get_or_create(user=request.user,
-                                                          status="draft")
-        quantity = int(request.POST.get("quantity", 1))
-        cart.add_product(dish, quantity)
+        dish = catalog.get_dish_or_404(dish_id)
+        quantity = self.get_quantity(request)
+        if quantity is None:
+            return redirect(self.success_url)
+        if request.user.is_authenticated:
+            cart = get_draft_cart(request, create=True)
+            cart.add_product(dish, quantity)
+        elif not get_guest_cart(request).add(dish.pk, quantity):
+            messages.error(request,
+                           "Your cart is full. Log in to add more dishes.")
+            return redirect(self.success_url)
         messages.success(request, f"{dish.name} has been added to your cart.")
         return redirect(self.success_url)
 
 
-class DeleteFromCartView(LoginRequiredMixin, View):
+class DeleteFromCartView(CartQuantityMixin, View):
     model = ProductCartItem
     success_url = reverse_lazy("bufet_system:product-cart")
 
     def post(self, request, dish_id):
-        dish = get_object_or_404(Dish, pk=dish_id)
-        cart, created = (
-            ProductCart.objects.get_or_create(user=request.user,
-                                              status="draft"))
-        quantity = int(request.POST.get("quantity", 1))
-
-        cart.remove_product(dish, quantity)
+        dish = catalog.get_dish_or_404(dish_id)
+        quantity = self.get_quantity(request)
+        if quantity is None:
+            return redirect(self.success_url)
+        if request.user.is_authenticated:
+            cart = get_draft_cart(request)
+            if cart is not None:
+                cart.remove_product(dish, quantity)
+        else:
+            get_guest_cart(request).remove(dish.pk, quantity)
         messages.success(request,
                          f"{dish.name} has been removed "
                          f"from your cart.")
@@ -63,32 +164,31 @@ class DeleteFromCartView(LoginRequiredMixin, View):
         return redirect(self.success_url)
 
 
-class ProductCartListView(LoginRequiredMixin, generic.ListView):
-    model = Dish
-    context_object_name = "dishes"
+class ProductCartListView(generic.ListView):
+    model = ProductCartItem
+    context_object_name = "lines"
     template_name = "bufet_system/product_cart.html"
     paginate_by = 5
 
     def get_queryset(self):
-        try:
-            cart = ProductCart.objects.get(user=self.request.user,
-                                           status=ProductCart.STATUS_DRAFT)
-            return cart.items.all()
-        except ProductCart.DoesNotExist:
+        if not self.request.user.is_authenticated:
+            return get_guest_cart(self.request).get_lines()
+        cart = get_draft_cart(self.request)
+        if cart is None:
             return []
+        return cart.get_lines()
 
     def get_context_data(self, **kwargs):
-        try:
-            context = super().get_context_data(**kwargs)
-            cart = ProductCart.objects.get(user=self.request.user,
-                                           status=ProductCart.STATUS_DRAFT)
-            context["total_price"] = cart.get_cart_total()
-            quantities = {item.item_id: item.quantity for item
-                          in cart.productcartitem_set.all()}
-            context["quantities"] = quantities
-            return context
-        except ProductCart.DoesNotExist:
+        context = super().get_context_data(**kwargs)
+        if not self.request.user.is_authenticated:
+            context["total_price"] = sum(
+                (line.subtotal for line in self.object_list),
+                Decimal("0.00"))
             return context
+        cart = get_draft_cart(self.request)
+        if cart is not None:
+            context["total_price"] = cart.total_price
+        return context
 
 
 class OrderCreateView(LoginRequiredMixin, generic.CreateView):
@@ -98,12 +198,9 @@ class OrderCreateView(LoginRequiredMixin, generic.CreateView):
     template_name = "bufet_system/order_checkout.html"
 
     def form_valid(self, form):
-        user_product_carts = (
-            ProductCart.objects.filter(user=self.request.user,
-                                       status=ProductCart.STATUS_DRAFT))
+        cart = get_draft_cart(self.request)
 
-        if user_product_carts.exists():
-            cart = user_product_carts.first()
+        if cart is not None:
             form.instance.total_price = cart.get_cart_total()
 
             try:
@@ -115,9 +212,11 @@ class OrderCreateView(LoginRequiredMixin, generic.CreateView):
                     order.save()
 
                     cart.status = ProductCart.STATUS_COMPLETED
-                    cart.save()
+                    cart.save(update_fields=["status"])
+                    forget_draft_cart(self.request)
 
-                    return super().form_valid(form)
+                    self.object = order
+                    return redirect(self.get_success_url())
             except IntegrityError:
                 messages.error(self.request,
                                "Error: There was an issue creating the order.")
@@ -130,33 +229,38 @@ class OrderCreateView(LoginRequiredMixin, generic.CreateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user_product_carts = ProductCart.objects.filter(user=self.request.user,
-                                                        status=ProductCart.STATUS_DRAFT)
-        if user_product_carts.exists():
-            cart = user_product_carts.first()
-            context["total_price"] = cart.get_cart_total()
-            context["dishes"] = cart.get_cart_items()
-            quantities = {item.item_id: item.quantity for item
-                          in cart.productcartitem_set.all()}
-            context["quantities"] = quantities
+        cart = get_draft_cart(self.request)
+        if cart is not None:
+            context["total_price"] = cart.total_price
+            context["lines"] = cart.get_lines()
         context["user_details"] = self.request.user
         context["restaurants"] = Restaurant.objects.all()
         return context
 
 
-class DishDetailView(generic.DetailView):
+class DishDetailView(CachedObjectMixin, generic.DetailView):
     model = Dish
+    cache_namespace = caching.MENU
     template_name = "bufet_system/dish_detail.html"
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["allergens"] = ingredients.allergen_names(
+            self.object.allergens)
+        return context
+
 
-class RestaurantListView(generic.ListView):
+class RestaurantListView(CachedPageMixin, generic.ListView):
     model = Restaurant
+    cache_namespace = caching.RESTAURANTS
     context_object_name = "restaurants"
     template_name = "bufet_system/restaurants.html"
     paginate_by = 10
 
 
-class OrderListView(LoginRequiredMixin, generic.ListView):
+class OrderListView(LoginRequiredMixin,
+                    CursorPaginationMixin,
+                    generic.ListView):
     model = Order
     context_object_name = "orders"
     template_name = "bufet_system/orders.html"
@@ -165,6 +269,239 @@ class OrderListView(LoginRequiredMixin, generic.ListView):
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
-            return Order.objects.filter(user=self.request.user)
+            return (Order.objects
+                    .filter(user=self.request.user)
+                    .select_related("restaurant"))
         else:
             return Order.objects.none()
+
+
+class PerformanceStatsView(UserPassesTestMixin, View):
+    """Rolling per-view timings of this worker process, for staff."""
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        return JsonResponse({
+            "pid": os.getpid(),
+            "sample_rate": settings.BUFET_PERF_SAMPLE_RATE,
+            "views": instrumentation.registry.snapshot(),
+            "db_pools": pool.snapshot(),
+        })
+
+    def post(self, request):
+        instrumentation.registry.reset()
+        return JsonResponse({"pid": os.getpid(), "views": {}})
+
+
+def date_range(params, days):
+    """``(first, last)`` from ``start``/``end`` ISO dates in ``params``.
+
+    Defaults to the ``days`` days up to today; raises ``ValueError`` for
+    malformed dates.
+    """
+    last = params.get("end")
+    last = date.fromisoformat(last) if last else timezone.localdate()
+    first = params.get("start")
+    first = (date.fromisoformat(first) if first
+             else last - timedelta(days=days - 1))
+    return (first, last) if first <= last else (last, first)
+
+
+class StaffReportMixin(UserPassesTestMixin):
+    """Staff-only GET report over a ``?start``/``?end`` date range."""
+    default_days = 30
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        try:
+            first, last = date_range(request.GET, self.default_days)
+        except ValueError:
+            return JsonResponse({"error": "Dates must be YYYY-MM-DD."},
+                                status=400)
+        return self.respond(request, first, last)
+
+
+class AnalyticsReportView(StaffReportMixin, View):
+    """Sales per restaurant, dish and day from the rollups, for staff.
+
+    ``?start`` and ``?end`` are ISO dates; the default is the last 30
+    days. ``?format=json`` returns the same data as JSON.
+    """
+
+    def respond(self, request, first, last):
+        report = analytics.report(first, last)
+        if request.GET.get("format") == "json":
+            return JsonResponse(report)
+        return render(request, "bufet_system/analytics.html", report)
+
+
+class DemandReportView(StaffReportMixin, View):
+    """Revenue, hourly demand and order value percentiles as JSON.
+
+    Computed from the order lines of the ``?start``..``?end`` range
+    (default: the last 30 days) rather than the rollups.
+    """
+
+    def respond(self, request, first, last):
+        return JsonResponse(reports.build(
+            first, last, chunk_size=settings.BUFET_REPORT_CHUNK_SIZE))
+
+
+class OrderExportView(StaffReportMixin, View):
+    """Stream orders with their lines as CSV or JSONL, for staff.
+
+    Takes ``?start``/``?end`` (default: the last 30 days), ``?format=csv``
+    or ``jsonl``, ``?restaurant=<id>`` and ``?gzip=1``.
+    """
+
+    def respond(self, request, first, last):
+        export_format = request.GET.get("format", "csv")
+        if export_format not in exports.FORMATS:
+            return JsonResponse({"error": "Format must be csv or jsonl."},
+                                status=400)
+        restaurant = request.GET.get("restaurant") or None
+        if restaurant is not None:
+            try:
+                restaurant = int(restaurant)
+            except ValueError:
+                return JsonResponse({"error": "Restaurant must be an id."},
+                                    status=400)
+        compress = request.GET.get("gzip") in ("1", "true")
+
+        records = exports.records(first, last, restaurant=restaurant,
+                                  chunk_size=settings.BUFET_EXPORT_CHUNK_SIZE)
+        response = StreamingHttpResponse(
+            exports.stream(records, export_format, compress=compress),
+            content_type=("application/gzip" if compress
+                          else exports.FORMATS[export_format]),
+        )
+        name = exports.filename(first, last, export_format,
+                                compress=compress, restaurant=restaurant)
+        response["Content-Disposition"] = f'attachment; filename="{name}"'
+        return response
+
+
+def cart_summary_data(cart):
+    if cart is None:
+        return {"lines_count": 0, "items_count": 0, "total_price": "0.00"}
+    return {"lines_count": cart.lines_count,
+            "items_count": cart.items_count,
+            "total_price": str(cart.total_price)}
+
+
+def guest_summary_data(lines):
+    return {"lines_count": len(lines),
+            "items_count": sum(line.quantity for line in lines),
+            "total_price": str(sum((line.subtotal for line in lines),
+                                   Decimal("0.00")))}
+
+
+class CartApiView(View):
+    """JSON view of the draft cart that takes batched quantity changes.
+
+    GET returns the summary and lines. POST takes a JSON object mapping
+    dish ids to new quantities, JSON integers from 0 (which removes the
+    line) to ``BUFET_CART_MAX_QUANTITY``. It applies them in one
+    transaction and returns the new summary, so clients can coalesce
+    rapid clicks into one request without a redirect and re-render.
+    Anonymous visitors get their guest cart, kept in a cookie.
+    """
+
+    def get(self, request):
+        if request.user.is_authenticated:
+            cart = get_draft_cart(request)
+            data = cart_summary_data(cart)
+            lines = cart.get_lines() if cart is not None else []
+        else:
+            lines = get_guest_cart(request).get_lines()
+            data = guest_summary_data(lines)
+        data["lines"] = [
+            {"dish": line.item_id,
+             "name": line.name,
+             "price": str(line.price),
+             "quantity": line.quantity,
+             "subtotal": f"{line.subtotal:.2f}"}
+            for line in lines
+        ]
+        return JsonResponse(data)
+
+    def post(self, request):
+        try:
+            payload = json.loads(request.body)
+            if not isinstance(payload, dict):
+                raise ValueError
+            wanted = {int(dish): quantity
+                      for dish, quantity in payload.items()}
+        except (ValueError, TypeError):
+            return JsonResponse(
+                {"error": "Expected a JSON object of dish id to quantity."},
+                status=400)
+        if len(wanted) > settings.BUFET_CART_API_MAX_LINES:
+            return JsonResponse(
+                {"error": f"At most {settings.BUFET_CART_API_MAX_LINES} "
+                          f"dishes per request."}, status=400)
+        maximum = settings.BUFET_CART_MAX_QUANTITY
+        # ``int()`` would truncate 1.9 and take true as 1.
+        if not all(type(quantity) is int and 0 <= quantity <= maximum
+                   for quantity in wanted.values()):
+            return JsonResponse(
+                {"error": f"Quantities must be whole numbers from 0 to "
+                          f"{maximum}."}, status=400)
+
+        dishes = catalog.in_bulk(wanted)
+        missing = sorted(set(wanted) - set(dishes))
+        if missing:
+            return JsonResponse({"error": "Unknown dishes.",
+                                 "dishes": missing}, status=400)
+
+        if not request.user.is_authenticated:
+            guest = get_guest_cart(request)
+            if not guest.set_quantities(wanted):
+                return JsonResponse(
+                    {"error": f"A guest cart holds at most "
+                              f"{settings.BUFET_GUEST_CART_MAX_LINES} "
+                              f"dishes. Log in to add more."}, status=400)
+            return JsonResponse(guest_summary_data(guest.get_lines()))
+
+        cart = get_draft_cart(
+            request, create=any(quantity > 0 for quantity in wanted.values()))
+        if cart is not None:
+            cart.set_quantities({dishes[pk]: quantity
+                                 for pk, quantity in wanted.items()})
+        return JsonResponse(cart_summary_data(cart))
+
+
+class BatchCheckoutView(UserPassesTestMixin, View):
+    """Place a batch of orders for other users, for staff.
+
+    Expects a JSON body ``{"orders": [{"user": id, "restaurant": id,
+    "lines": {dish_id: quantity}}, ...]}`` and answers with one result
+    per entry.
+    """
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def post(self, request):
+        try:
+            entries = json.loads(request.body)["orders"]
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({"error": "Expected a JSON object with an "
+                                          "\"orders\" list."}, status=400)
+        if not isinstance(entries, list):
+            return JsonResponse({"error": "\"orders\" must be a list."},
+                                status=400)
+        limit = settings.BUFET_BATCH_CHECKOUT_MAX
+        if len(entries) > limit:
+            return JsonResponse(
+                {"error": f"At most {limit} orders per batch."}, status=400)
+
+        results = checkout.place_orders(entries)
+        return JsonResponse({
+            "placed": sum("order" in result for result in results),
+            "results": results,
+        })
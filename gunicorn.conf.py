@@ -0,0 +1,11 @@
+"""Gunicorn settings, read from the working directory on start.
+
+The database pool size in bufet/settings.py is derived from the same
+WEB_CONCURRENCY and GUNICORN_THREADS variables.
+"""
+import os
+
+wsgi_app = "bufet.wsgi:application"
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))